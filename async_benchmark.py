@@ -0,0 +1,113 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Aacer Daken and Arielle Wilson
+:Filename: async_benchmark.py
+:Version: 1.0
+Description: Many subscriptions on one event loop. Runs a publisher, opens the given number of subscriptions with
+daily_news_client.subscribe on one asyncio loop, half of them filtered on a source, and publishes news items from
+two sources. Reports how many items the subscriptions got, and how long the loop took to get them all.
+
+Usage:
+    python3 async_benchmark.py [<number of subscriptions> [<number of items>]]
+"""
+import asyncio
+import contextlib
+import io
+import sys
+import threading
+import time
+
+import daily_news_client
+import daily_news_provider
+import wire_codec
+
+SUBSCRIPTIONS = 500
+ITEMS = 200
+BATCH = 10                      #Items published at a time
+INTERVAL = 0.01                 #Seconds between two batches
+REG_PORT = 51114                #Registration port of the publisher
+SOURCES = ('BBC', 'Reuters')    #Sources of the news items, in turn
+TIMEOUT = 10.0                  #Max seconds to wait for the subscriptions after the last item
+
+
+async def consume(count, filters, received) -> None:
+    """
+    Subscribes, and counts the news items received until count of them are
+    Args:
+        count: Number of news items expected
+        filters: Filters of the subscription, or None
+        received: List the count of the subscription is appended to, and updated in place
+
+    Returns: None
+
+    """
+    index = len(received)
+    received.append(0)
+    if count == 0:
+        return
+    async for item in daily_news_client.subscribe(('localhost', REG_PORT), filters=filters):
+        received[index] += 1
+        if received[index] == count:
+            break
+
+
+async def measure(subscriptions, count, publisher) -> str:
+    """
+    Opens the subscriptions, publishes the news items, and reports how the subscriptions got them
+    Args:
+        subscriptions: Number of subscriptions
+        count: Number of news items
+        publisher: DailyNewsPublisher serving on another thread
+
+    Returns: Row of the results table
+
+    """
+    received = []
+    filtered = {'sources': [SOURCES[0]]}
+    expected = [count if i % 2 == 0 else (count + 1) // 2 for i in range(subscriptions)]
+    consumers = [asyncio.ensure_future(consume(expected[i], None if i % 2 == 0 else filtered, received))
+                 for i in range(subscriptions)]
+    while len(publisher.subscriptions) < subscriptions:
+        await asyncio.sleep(0.01)
+
+    items = [wire_codec.NewsItem(SOURCES[i % len(SOURCES)], 'headline {}'.format(i)) for i in range(count)]
+    start = time.perf_counter()
+    for i in range(0, count, BATCH):
+        await asyncio.get_running_loop().run_in_executor(None, publisher.publish_batch, items[i:i + BATCH])
+        await asyncio.sleep(INTERVAL)
+    done, pending = await asyncio.wait(consumers, timeout=TIMEOUT)
+    elapsed = time.perf_counter() - start
+    for consumer in pending:
+        consumer.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    return '{:>14} {:>8} {:>14} {:>10} {:>10.1f}'.format(
+        subscriptions, count, '{}/{}'.format(sum(received), sum(expected)), len(done), elapsed * 1000)
+
+
+def run(subscriptions, count) -> None:
+    """
+    Runs the benchmark
+    Args:
+        subscriptions: Number of subscriptions
+        count: Number of news items
+
+    Returns: None
+
+    """
+    print('Publishing {} items to {} subscriptions on one event loop, half of them filtered on {}'.format(
+        count, subscriptions, SOURCES[0]))
+    print('{:>14} {:>8} {:>14} {:>10} {:>10}'.format('subscriptions', 'items', 'received', 'complete', 'ms'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        publisher = daily_news_provider.DailyNewsPublisher(REG_PORT, 0)
+        threading.Thread(target=publisher.serve, args=(), daemon=True).start()
+        while publisher.selector is None:
+            time.sleep(0.01)
+        row = asyncio.run(measure(subscriptions, count, publisher))
+    print(row)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else SUBSCRIPTIONS,
+        int(sys.argv[2]) if len(sys.argv) > 2 else ITEMS)
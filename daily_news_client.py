@@ -0,0 +1,232 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Arielle Wilson and Aacer Daken
+:Version: 1.0
+Description: asyncio client for daily news subscriptions, for services embedding subscribers. Each subscription is a
+datagram endpoint on the caller's event loop, so one process can hold hundreds of them on one loop. Registration,
+heartbeats, registering again, sequencing, retransmission and decoding are handled like in DailyNewsSubscriber, and
+the news items are yielded by an async generator:
+
+    async for item in subscribe(('localhost', 50414), filters={'sources': ['BBC']}):
+        print(item.source, item.headline)
+"""
+
+import asyncio
+
+import daily_news_subscriber
+import transport
+import wire_codec
+
+REGISTER_RETRY = 1.0    # seconds to wait for the registration reply before registering again
+QUEUE_SIZE = 10000      # news items waiting for the caller, beyond which new ones are dropped
+
+
+class AsyncSubscriber(daily_news_subscriber.DailyNewsSubscriber, asyncio.DatagramProtocol):
+    """
+    Subscription served by an event loop. The protocol logic is DailyNewsSubscriber's, with rpcs sent on the datagram
+    endpoint, timers run by the loop, and news items queued for the caller instead of a consumer thread
+
+    Attributes:
+        endpoint: DatagramTransport, or None until the endpoint is open
+        queue: asyncio Queue
+            news items received, waiting for the caller, as NewsItems or xml strings
+        registered: bool
+            True once the publisher confirmed a registration
+        timers: dict
+            pending TimerHandle of the 'register', 'renew' and 'gap' timers
+    """
+
+    def __init__(self, publisher_addr, codec=wire_codec.BINARY, sources=(), keywords=(), since=None,
+                 host='localhost', queue_size=QUEUE_SIZE):
+        """
+        :param publisher_addr: (host, port) registration address of the publisher
+        :param codec: name of the wire codec to receive publications with
+        :param sources: news sources wanted, all sources if empty
+        :param keywords: words wanted in headlines
+        :param since: sequence number of the last publication received, to be caught up from
+        :param host: host name publications are received on, on a free port
+        :param queue_size: max news items waiting for the caller, new ones are dropped beyond it
+        """
+
+        super().__init__(0, publisher_addr[1], codec, sources, keywords, since=since, queue_size=queue_size)
+        self.publisher_addr = tuple(publisher_addr)
+        self.publisher.bind((host, 0))
+        self.address = (host, self.publisher.getsockname()[1])
+        self.endpoint = None
+        self.queue = asyncio.Queue(self.queue_size)
+        self.registered = False
+        self.timers = {}
+
+    async def open(self):
+        """
+        Opens the datagram endpoint on the running loop, and registers with the publisher
+        """
+
+        await asyncio.get_running_loop().create_datagram_endpoint(lambda: self, sock=self.publisher)
+        self.register()
+        self.arm('register', REGISTER_RETRY, self.on_register_timer)
+        if not self.legacy:
+            self.arm('renew', self.renew_interval, self.on_renew_timer)
+
+    def close(self):
+        """
+        Stops the timers and closes the endpoint. The publisher drops the subscription once its lease expires
+        """
+
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers = {}
+        if self.endpoint is not None:
+            self.endpoint.close()
+
+    async def get(self):
+        """
+        Waits for the next news item
+        :return: NewsItem
+        """
+
+        item = await self.queue.get()
+        return item if isinstance(item, wire_codec.NewsItem) else self.parse_xml(item)
+
+    def connection_made(self, endpoint):
+        self.endpoint = endpoint
+
+    def datagram_received(self, data, addr):
+        """
+        Handles a datagram from the publisher, and follows the gap the datagram opened or closed with the gap timer
+        :param data: bytes
+        :param addr: address of the publisher
+        """
+
+        size = len(data) - transport.HEADER.size
+        if size < 0 or transport.HEADER.unpack_from(data)[0] != size:
+            print('failed to receive from publisher: truncated or malformed datagram from {}'.format(addr))
+            return
+        self.handle_datagram(memoryview(data)[transport.HEADER.size:])
+        self.follow_gap()
+
+    def error_received(self, exc):
+        print('failed to receive from publisher: {}'.format(exc))
+
+    def send_rpc(self, message):
+        """
+        Sends an rpc to the publisher on the endpoint
+        :param message: tuple (method, request)
+        """
+
+        if self.endpoint is not None and not self.endpoint.is_closing():
+            self.endpoint.sendto(transport.encode_datagram(self.codec.encode(message)), self.publisher_addr)
+
+    def deliver(self, item):
+        """
+        Queues a news item for the caller, or drops it if the queue is full
+        :param item: NewsItem, or xml string
+        """
+
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped_count += 1
+
+    def print_registration_confirmation(self, result):
+        """
+        Notes the subscription is registered
+        :param result: str
+        """
+
+        self.registered = True
+
+    def register(self):
+        """
+        RPC to publisher register. The registration is sent again until the publisher confirms it
+        """
+
+        self.registered = False
+        super().register()
+
+    def arm(self, name, delay, callback):
+        """
+        Starts a timer, replacing the pending one of the same name
+        :param name: str
+        :param delay: float
+            seconds until the callback is called
+        :param callback: function
+        """
+
+        timer = self.timers.pop(name, None)
+        if timer is not None:
+            timer.cancel()
+        if self.endpoint is not None and not self.endpoint.is_closing():
+            self.timers[name] = asyncio.get_running_loop().call_later(max(0.0, delay), callback)
+
+    def on_register_timer(self):
+        """
+        Registers again if the publisher hasn't confirmed the registration yet
+        """
+
+        if not self.registered:
+            super().register()
+            self.arm('register', REGISTER_RETRY, self.on_register_timer)
+        else:
+            self.timers.pop('register', None)
+
+    def on_renew_timer(self):
+        """
+        Sends a heartbeat every renew_interval seconds. A publisher that doesn't know the subscription anymore
+        answers so, and the subscriber registers again
+        """
+
+        self.heartbeat()
+        self.arm('renew', self.renew_interval, self.on_renew_timer)
+        if not self.registered and 'register' not in self.timers:
+            self.arm('register', REGISTER_RETRY, self.on_register_timer)
+
+    def on_gap_timer(self):
+        """
+        Asks again for the missing publications, or gives them up
+        """
+
+        self.timers.pop('gap', None)
+        self.check_gap()
+        self.follow_gap()
+
+    def follow_gap(self):
+        """
+        Arms the gap timer for the current gap deadline, or stops it if there is no gap
+        """
+
+        timer = self.timers.get('gap')
+        if self.gap_deadline is None:
+            if timer is not None:
+                self.timers.pop('gap').cancel()
+            return
+        loop = asyncio.get_running_loop()
+        if timer is None or timer.when() != self.gap_deadline:
+            #The gap deadline is a time.monotonic() time, like the loop's clock
+            self.arm('gap', self.gap_deadline - loop.time(), self.on_gap_timer)
+
+
+async def subscribe(publisher_addr, filters=None, codec=wire_codec.BINARY, since=None, host='localhost',
+                    queue_size=QUEUE_SIZE):
+    """
+    Subscribes to a publisher, and yields the news items received, in order, until the generator is closed
+    :param publisher_addr: (host, port) registration address of the publisher
+    :param filters: dict, or None for all news
+        'sources' and 'keywords' lists, news from one of the sources or with one of the keywords in the headline
+    :param codec: name of the wire codec to receive publications with
+    :param since: sequence number of the last publication received, to be caught up from
+    :param host: host name publications are received on, on a free port
+    :param queue_size: max news items waiting for the caller, new ones are dropped beyond it
+    :return: async generator of NewsItem
+    """
+
+    filters = filters or {}
+    subscriber = AsyncSubscriber(publisher_addr, codec, filters.get('sources', ()), filters.get('keywords', ()),
+                                 since, host, queue_size)
+    await subscriber.open()
+    try:
+        while True:
+            yield await subscriber.get()
+    finally:
+        subscriber.close()
@@ -5,20 +5,458 @@ This is free and unencumbered software released into the public domain.
 :Version: 1.0
 Description: publishes daily news from RSS feed to subscribers
 """
+import heapq
+import multiprocessing
+import re
 import sys
-import pickle
 import socket
 import selectors
 import threading
+import time
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
 from datetime import datetime, timedelta
 
+import transport
+import wire_codec
+
 REGISTER_ADD = ('localhost', 50414)
 PUBLISH_ADD = ('localhost', 50500)
 REQUEST_SIZE = 12
 REGISTER = 'register'
 PUBLISH = 'publish'
+PUBLISH_BATCH = 'publish_batch'
+HEARTBEAT = 'heartbeat'
+NACK = 'nack'
+STATS = 'stats'
+FORWARD = 'forward'
 BACKLOG = 100
-BUF_SZ = 4096
+REGISTER_BATCH = 256            # max registration datagrams handled per wake-up of the selector loop
+RECV_SZ = 64 * 1024             # max bytes read from a host connection at a time
+MAX_OUTGOING = 1024 * 1024      # bytes of pending replies at which a host connection stops being read
+LEASE_DURATION = 30.0           # seconds a subscription lives without a heartbeat
+SWEEP_INTERVAL = 1.0            # seconds between two sweeps for expired subscriptions
+RING_SIZE = 8192                # latest publications kept for retransmission and catch-up
+RING_BYTES = 4 * 1024 * 1024    # bytes of source and headline text the kept publications may take
+PUBLISH_LINGER = 0.005          # seconds publications wait for more items to share their datagrams
+DATAGRAM_BUDGET = 1400          # bytes a datagram packing several publications may take, within an ethernet MTU
+COALESCE_MAX = 1024             # publications waiting to be sent that end the linger early
+COALESCE_QUEUE = 64 * 1024      # publications waiting for the coalescer thread, beyond which new ones are refused
+FANOUT_WORKERS = 4              # threads sending publications to large subscriber sets
+FANOUT_CHUNK = 4096             # max subscribers per fan-out task, smaller sets are sent on the calling thread
+STREAM_QUEUE = 4 * 1024 * 1024  # bytes of frames queued for a stream subscriber before its overflow policy applies
+STREAM_BUDGET = 64 * 1024       # bytes a frame packing several publications to a stream subscriber may take
+DROP_OLDEST = 'drop_oldest'     # stream overflow policy dropping the oldest queued frames
+DISCONNECT = 'disconnect'       # stream overflow policy closing the connection
+SHARD_STATS = ('subscribers', 'expired', 'published', 'datagrams', 'retransmitted')  # counters shared by each shard
+
+WORD_PATTERN = re.compile(r'\w+')   # words of a headline matched against keyword filters
+
+FanoutReport = namedtuple('FanoutReport', ['subscribers', 'sent', 'failed', 'elapsed', 'error'])
+
+
+class Subscription(object):
+    """
+    A registered subscriber
+
+    Attributes:
+        address: tuple (host, port)
+            address publications are sent to
+        codec: wire codec the subscriber registered with
+        registered: datetime
+            time of registration
+        sources: frozenset of str
+            news sources the subscriber wants, in lower case
+        keywords: frozenset of str
+            words, or phrases of words separated by one space, the subscriber wants in headlines, in lower case
+        expires: float, or None
+            time.monotonic() time the lease expires at, unless renewed by a heartbeat. None for legacy
+            subscribers, which don't send heartbeats and never expire
+        sequenced: bool
+            True if publications carry sequence numbers, False for legacy subscribers
+        start_seq: int
+            sequence number of the last publication before the subscription
+        last_seq: int
+            sequence number of the last publication sent to a filtered subscriber, start_seq if none
+        replay: list of bytes
+            frames catching the subscriber up on the publications it missed, sent after the registration reply
+        stream: StreamConnection, or None
+            connection publications are queued on, None for subscribers getting them as UDP datagrams
+    """
+    def __init__(self, address, codec, sources=frozenset(), keywords=frozenset(), expires=None, sequenced=False,
+                 stream=None):
+        self.address = address
+        self.codec = codec
+        self.registered = datetime.utcnow()
+        self.sockaddr = resolve(address)
+        self.sources = sources
+        self.keywords = keywords
+        self.expires = expires
+        self.sequenced = sequenced
+        self.start_seq = 0
+        self.last_seq = 0
+        self.replay = []
+        self.stream = stream
+
+    @property
+    def filtered(self):
+        """
+        :return: True, if the subscriber only wants news matching its filters, False if it wants all news
+        """
+
+        return len(self.sources) > 0 or len(self.keywords) > 0
+
+    def matches(self, item):
+        """
+        :param item: NewsItem
+        :return: True, if the subscriber wants the item
+        """
+
+        if not self.filtered or item.source.casefold() in self.sources:
+            return True
+        longest = max((keyword.count(' ') + 1 for keyword in self.keywords), default=0)
+        return not self.keywords.isdisjoint(headline_phrases(item.headline, longest))
+
+
+def normalize_filters(values):
+    """
+    Normalizes source or keyword filters for matching, ignoring case
+    :param values: list of str, or a single str
+    :return: frozenset of str
+    """
+
+    if isinstance(values, str):
+        values = [values]
+    return frozenset(str(value).strip().casefold() for value in values if len(str(value).strip()) > 0)
+
+
+def normalize_keywords(values):
+    """
+    Normalizes keyword filters for matching, ignoring case. A keyword is split into words like headlines are, so a
+    keyword of several words (e.g. 'New York') or with punctuation (e.g. 'U.S.') is matched as a phrase
+    :param values: list of str, or a single str
+    :return: frozenset of str
+        words of each keyword, separated by one space
+    """
+
+    if isinstance(values, str):
+        values = [values]
+    keywords = (' '.join(WORD_PATTERN.findall(str(value).casefold())) for value in values)
+    return frozenset(keyword for keyword in keywords if len(keyword) > 0)
+
+
+def headline_phrases(headline, longest):
+    """
+    Lists the phrases of a headline keywords are matched against
+    :param headline: str
+    :param longest: int
+        max words of a keyword
+    :return: set of str
+        runs of up to longest words of the headline, in lower case, separated by one space
+    """
+
+    words = WORD_PATTERN.findall(headline.casefold())
+    phrases = set(words)
+    for length in range(2, longest + 1):
+        phrases.update(' '.join(words[i:i + length]) for i in range(len(words) - length + 1))
+    return phrases
+
+
+def resolve(address):
+    """
+    Resolves a (host, port) address once, so that sending to it doesn't look up the host name every time
+    :param address: tuple (host, port)
+    :return: numeric (ip, port) address, or the address itself if it can't be resolved
+    """
+
+    try:
+        return resolve_host(address[0]), address[1]
+    except OSError:
+        return address
+
+
+@lru_cache(maxsize=1024)
+def resolve_host(host):
+    """
+    Resolves a host name to an IPv4 address. Results are cached, as a registration storm resolves the same few
+    host names over and over
+    :param host: str
+    :return: str
+    """
+
+    return socket.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_DGRAM)[0][4][0]
+
+
+class InterestIndex(object):
+    """
+    Inverted index from news sources and headline words to the filtered subscribers wanting them. A subscriber
+    matches an item if the item's source is one of its sources, or the headline holds one of its keywords, so
+    matching an item costs in proportion to the subscribers it matches, not to all subscribers. Keywords of several
+    words are looked up among the runs of as many words of the headline
+
+    Attributes:
+        by_source: map {source: set of subscriber addresses}
+        by_keyword: map {keyword: set of subscriber addresses}
+        keyword_lengths: Counter {number of words: keywords in by_keyword of that many words}
+        lock: Lock
+            guards the index against concurrent registrations
+    """
+    def __init__(self):
+        self.by_source = {}
+        self.by_keyword = {}
+        self.keyword_lengths = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, subscription):
+        """
+        Indexes a subscription under each of its filters
+        :param subscription: Subscription
+        """
+
+        with self.lock:
+            for source in subscription.sources:
+                self.by_source.setdefault(source, set()).add(subscription.address)
+            for keyword in subscription.keywords:
+                if keyword not in self.by_keyword:
+                    self.keyword_lengths[keyword.count(' ') + 1] += 1
+                self.by_keyword.setdefault(keyword, set()).add(subscription.address)
+
+    def remove(self, subscription):
+        """
+        Removes a subscription from the index
+        :param subscription: Subscription
+        """
+
+        with self.lock:
+            for index, keys in ((self.by_source, subscription.sources), (self.by_keyword, subscription.keywords)):
+                for key in keys:
+                    addresses = index.get(key)
+                    if addresses is not None:
+                        addresses.discard(subscription.address)
+                        if len(addresses) == 0:
+                            del index[key]
+                            if index is self.by_keyword:
+                                length = key.count(' ') + 1
+                                self.keyword_lengths[length] -= 1
+                                if self.keyword_lengths[length] == 0:
+                                    del self.keyword_lengths[length]
+
+    def match(self, items):
+        """
+        Finds the filtered subscribers wanting each of several items
+        :param items: list of NewsItem
+        :return: map {subscriber address: [indexes of the items it wants, in order]}
+        """
+
+        matches = {}
+        with self.lock:
+            for i, item in enumerate(items):
+                recipients = set(self.by_source.get(item.source.casefold(), ()))
+                if len(self.by_keyword) > 0:
+                    for phrase in headline_phrases(item.headline, max(self.keyword_lengths)):
+                        recipients.update(self.by_keyword.get(phrase, ()))
+                for address in recipients:
+                    matches.setdefault(address, []).append(i)
+        return matches
+
+
+class RetransmitRing(object):
+    """
+    Numbers publications, and keeps the latest ones for retransmission to subscribers that missed them, and for
+    catch-up of subscribers registering again. Sequence numbers are the offsets of the publications, they only grow
+
+    Attributes:
+        items: deque of NewsItem
+            latest publications, oldest first
+        sizes: deque of int
+            bytes of text of each publication in items
+        byte_count: int
+            bytes of text of all publications in items
+        capacity: int
+            max number of publications kept
+        max_bytes: int
+            max bytes of text kept, the newest publication is kept even if it is larger
+        next_seq: int
+            sequence number of the next publication
+        lock: Lock
+    """
+    def __init__(self, capacity=RING_SIZE, max_bytes=RING_BYTES):
+        self.items = deque()
+        self.sizes = deque()
+        self.byte_count = 0
+        self.capacity = max(1, int(capacity))
+        self.max_bytes = max(0, int(max_bytes))
+        self.next_seq = 1
+        self.lock = threading.Lock()
+
+    def append(self, items):
+        """
+        Numbers publications, and adds them to the ring, evicting the oldest ones
+        :param items: list of NewsItem
+        :return: list of int
+            consecutive sequence numbers of the items
+        """
+
+        with self.lock:
+            first = self.next_seq
+            for item in items:
+                size = len(item.source.encode('utf-8')) + len(item.headline.encode('utf-8'))
+                self.items.append(item)
+                self.sizes.append(size)
+                self.byte_count += size
+            while len(self.items) > self.capacity or (self.byte_count > self.max_bytes and len(self.items) > 1):
+                self.items.popleft()
+                self.byte_count -= self.sizes.popleft()
+            self.next_seq += len(items)
+        return list(range(first, first + len(items)))
+
+    def get_range(self, first, last):
+        """
+        Looks up publications by sequence number
+        :param first: int
+            first sequence number wanted
+        :param last: int
+            last sequence number wanted
+        :return: (list of (seq, NewsItem) still in the ring, first sequence number still in the ring)
+        """
+
+        with self.lock:
+            oldest = self.next_seq - len(self.items)
+            first = max(first, oldest)
+            last = min(last, self.next_seq - 1)
+            if first > last:
+                return [], oldest
+            return list(zip(range(first, last + 1), islice(self.items, first - oldest, last - oldest + 1))), oldest
+
+
+class FanoutEngine(object):
+    """
+    Sends publications to many subscribers. Publications are encoded and framed by the caller, once per codec, and
+    the engine sends the same buffer to every subscriber. Subscriber sets larger than chunk_size are split in chunks,
+    sent in parallel by a pool of worker threads
+
+    Attributes:
+        sock: UDP socket
+            socket publications are sent from
+        chunk_size: int
+            max number of subscribers per fan-out task
+        pool: ThreadPoolExecutor, or None
+            worker pool, None if every fan-out runs on the calling thread
+    """
+    def __init__(self, sock, workers=FANOUT_WORKERS, chunk_size=FANOUT_CHUNK):
+        self.sock = sock
+        self.chunk_size = max(1, int(chunk_size))
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fanout') if workers > 1 else None
+
+    def fanout(self, groups):
+        """
+        Sends frames to subscribers
+        :param groups: list of (frames, addresses)
+            every frame of a group is sent, in order, to every address of the group
+        :return: FanoutReport
+        """
+
+        start = time.perf_counter()
+        tasks = [(frames, addresses[i:i + self.chunk_size])
+                 for frames, addresses in groups for i in range(0, len(addresses), self.chunk_size)]
+        if self.pool is None or len(tasks) <= 1:
+            results = [self._send(frames, addresses) for frames, addresses in tasks]
+        else:
+            results = list(self.pool.map(lambda task: self._send(*task), tasks))
+
+        errors = [error for sent, failed, error in results if error is not None]
+        return FanoutReport(subscribers=sum(len(addresses) for frames, addresses in groups),
+                            sent=sum(sent for sent, failed, error in results),
+                            failed=sum(failed for sent, failed, error in results),
+                            elapsed=time.perf_counter() - start,
+                            error=errors[0] if len(errors) > 0 else None)
+
+    def _send(self, frames, addresses):
+        """
+        Sends frames to a chunk of subscribers
+        :param frames: list of bytes
+            framed datagrams
+        :param addresses: list of addresses
+        :return: (number of datagrams sent, number of datagrams failed, last error or None)
+        """
+
+        sendto = self.sock.sendto
+        sent = failed = 0
+        error = None
+        for address in addresses:
+            for frame in frames:
+                try:
+                    sendto(frame, address)
+                    sent += 1
+                except OSError as e:
+                    failed += 1
+                    error = e
+        return sent, failed, error
+
+
+class HostConnection(object):
+    """
+    A connection from a host, served by the selector loop
+
+    Attributes:
+        sock: non-blocking TCP socket
+        address: tuple (host, port)
+            address of the host
+        decoder: FrameDecoder
+            frames received, not handled yet
+        reply_codec: wire codec replies are sent with
+        outgoing: bytearray
+            framed replies not sent yet
+    """
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.decoder = transport.FrameDecoder()
+        self.reply_codec = wire_codec.get_codec(wire_codec.PICKLE)
+        self.outgoing = bytearray()
+
+
+class StreamConnection(object):
+    """
+    A connection from a stream subscriber, served by the selector loop. Publications are queued by the publishing
+    thread, and sent by the selector loop as fast as the subscriber reads them, so a slow subscriber never holds up
+    the fan-out to the others
+
+    Attributes:
+        sock: non-blocking TCP socket
+        address: tuple (host, port)
+            address of the subscriber's end of the connection
+        decoder: FrameDecoder
+            rpc frames received, not handled yet
+        subscription: Subscription, or None until the subscriber registers
+        queue: deque of bytes
+            frames not sent yet, oldest first
+        queued: int
+            bytes of the frames in queue
+        outgoing: memoryview, or None
+            rest of the bytes being sent
+        scheduled: bool
+            True while the connection waits for the selector loop to send its queue
+        overflowed: bool
+            True once the queue overflowed under the disconnect policy
+        closed: bool
+        lock: Lock
+            guards the queue
+    """
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.decoder = transport.FrameDecoder()
+        self.subscription = None
+        self.queue = deque()
+        self.queued = 0
+        self.outgoing = None
+        self.scheduled = False
+        self.overflowed = False
+        self.closed = False
+        self.lock = threading.Lock()
 
 
 class DailyNewsPublisher(object):
@@ -26,65 +464,565 @@ class DailyNewsPublisher(object):
     Publishes news messages to subscribers
 
     Attributes:
-         subscriptions: map {subscriber: datetime}
+         subscriptions: map {subscriber address: Subscription}
+         interests: InterestIndex
+            filtered subscriptions, by source and keyword
+         fanout_targets: list of (codec, [subscriber address]), or None
+            unfiltered subscriptions grouped by codec, rebuilt after subscriptions changed. Subscriptions are only
+            added or removed under publish_lock, so a fan-out never uses targets of removed subscriptions
          registration_socket: UDP socket
          publication_socket: TCP socket
+         fanout: FanoutEngine
+         reply_frames: map {(codec name, method, result): bytes}
+            framed registration replies, encoded once
+         selector: selector of the selector loop, None until serve is called
+         lease_duration: float
+            seconds a subscription lives without a heartbeat
+         leases: heap of (expiry time, sequence number, Subscription)
+            one entry per leased subscription. Heartbeats only move the expiry time of the subscription, the entry
+            is moved when it comes due
+         expired_count: int
+            number of subscriptions expired so far
+         ring: RetransmitRing
+            latest publications, by sequence number
+         epoch: int
+            identifies this run of the publisher, so subscribers can tell sequence numbers restarted
+         retransmit_count: int
+            number of publications retransmitted so far
+         publish_lock: Lock
+            held while publications are numbered and sent
+         linger: float
+            seconds publications wait for more items before they are sent, 0 to send them right away
+         datagram_budget: int
+            bytes a datagram packing several publications to a sequenced subscriber may take, 0 to send one
+            publication per datagram
+         coalesced: list of NewsItem
+            publications waiting to be sent by the coalescer thread
+         coalesce_queue: int
+            max publications waiting in coalesced
+         coalesce_refused: int
+            number of publications refused so far because coalesced was full
+         coalesce_ready: Condition
+            guards coalesced, and wakes up the coalescer thread
+         datagram_count: int
+            number of publication datagrams sent so far
+         stream_socket: TCP socket, or None
+            listens for stream subscribers on the registration port, None if stream subscriptions aren't served
+         stream_queue: int
+            bytes of frames queued for a stream subscriber before the overflow policy applies
+         stream_policy: str
+            DROP_OLDEST to drop the oldest frames queued for a stream subscriber that falls behind, or DISCONNECT
+            to close its connection
+         streams_ready: deque of StreamConnection
+            connections with frames queued since the selector loop last sent theirs
+         stream_dropped: int
+            number of frames dropped for stream subscribers falling behind so far
+         stream_disconnected: int
+            number of stream subscribers disconnected for falling behind so far
     """
-    def __init__(self, reg_port, pub_port):
+    def __init__(self, reg_port, pub_port, fanout_workers=FANOUT_WORKERS, lease_duration=LEASE_DURATION,
+                 linger=PUBLISH_LINGER, datagram_budget=DATAGRAM_BUDGET, stream_queue=STREAM_QUEUE,
+                 stream_policy=DROP_OLDEST, coalesce_queue=COALESCE_QUEUE):
+        if stream_policy not in (DROP_OLDEST, DISCONNECT):
+            raise ValueError('Unknown stream overflow policy: {}'.format(stream_policy))
         self.subscriptions = {}
+        self.lease_duration = lease_duration
+        self.leases = []
+        self.lease_sequence = 0
+        self.leases_lock = threading.Lock()
+        self.expired_count = 0
+        self.ring = RetransmitRing()
+        self.epoch = int(time.time() * 1000)
+        self.retransmit_count = 0
+        self.publish_lock = threading.Lock()
+        self.linger = max(0.0, float(linger))
+        self.datagram_budget = max(0, int(datagram_budget))
+        self.coalesced = []
+        self.coalesce_queue = max(1, int(coalesce_queue))
+        self.coalesce_refused = 0
+        self.coalesce_ready = threading.Condition()
+        self.datagram_count = 0
+        if self.linger > 0:
+            threading.Thread(target=self.run_coalescer, args=(), daemon=True).start()
+        self.interests = InterestIndex()
+        self.fanout_targets = None
         self.registration_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.publication_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.registration_address = ('localhost', reg_port)
         self.publication_address = ('localhost', pub_port)
+        self.fanout = FanoutEngine(self.registration_socket, fanout_workers)
+        self.reply_frames = {}
+        self.selector = None
+        self.stream_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.stream_queue = max(0, int(stream_queue))
+        self.stream_policy = stream_policy
+        self.streams_ready = deque()
+        self.stream_dropped = 0
+        self.stream_disconnected = 0
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+
+    def serve(self):
+        """
+        Runs the UDP register listener and the TCP publication server on one selector loop, on the calling thread,
+        instead of a thread per datagram and per connection. Stream subscribers connect over TCP to the
+        registration port, and are served by the same loop
+        """
+
+        self.registration_socket.bind(self.registration_address)
+        self.registration_socket.setblocking(False)
+        self.registration_reader = transport.DatagramReader(self.registration_socket)
+
+        #Connections from the host are long-lived, so allow rebinding while old ones are in TIME_WAIT
+        self.publication_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.publication_socket.bind(self.publication_address)
+        self.publication_socket.listen(BACKLOG)
+        self.publication_socket.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.registration_socket, selectors.EVENT_READ, self.on_registration_ready)
+        self.selector.register(self.publication_socket, selectors.EVENT_READ, self.on_accept_ready)
+
+        #Publishing threads wake the loop up through the socket pair to send what they queued on streams
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ, self.on_wakeup)
+        if self.stream_socket is not None:
+            self.stream_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.stream_socket.bind(self.registration_address)
+            self.stream_socket.listen(BACKLOG)
+            self.stream_socket.setblocking(False)
+            self.selector.register(self.stream_socket, selectors.EVENT_READ, self.on_stream_accept)
+        next_sweep = time.monotonic() + SWEEP_INTERVAL
+        while True:
+            for key, events in self.selector.select(timeout=max(0.0, next_sweep - time.monotonic())):
+                #A handler failing on one connection or datagram must not stop the loop serving all the others
+                try:
+                    key.data(key.fileobj, events)
+                except Exception as e:
+                    print('failed to handle events of {}: {!r}'.format(key.fileobj, e))
+            if time.monotonic() >= next_sweep:
+                self.expire_subscriptions()
+                next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+    def on_registration_ready(self, sock, events):
+        """
+        Handles the registration datagrams waiting on the UDP socket, up to REGISTER_BATCH of them, then sends
+        all replies
+        :param sock: registration socket
+        :param events: selector events
+        """
+
+        replies = []
+        for i in range(REGISTER_BATCH):
+            try:
+                msg, client = self.registration_reader.recv_datagram()
+            except BlockingIOError:
+                break
+            except OSError as e:
+                print('failed to receive registration: {}'.format(e))
+                continue
+            replies.extend(self.answer_subscriber(client, msg))
+
+        for frame, address in replies:
+            try:
+                sock.sendto(frame, address)
+            except OSError as e:
+                print('failed to reply to {}: {}'.format(address, e))
+
+    def on_accept_ready(self, sock, events):
+        """
+        Accepts the pending connections from hosts, and adds them to the selector loop
+        :param sock: publication socket
+        :param events: selector events
+        """
+
+        while True:
+            try:
+                client, client_addr = sock.accept()
+            except BlockingIOError:
+                return
+            except OSError as e:
+                print('failed to accept connection: {}'.format(e))
+                return
+            client.setblocking(False)
+            connection = HostConnection(client, client_addr)
+            self.selector.register(client, selectors.EVENT_READ,
+                                   lambda sock, events, connection=connection:
+                                   self.on_host_ready(connection, events))
+
+    def on_host_ready(self, connection, events):
+        """
+        Reads the requests of a host connection and queues the replies, or sends queued replies, depending on the
+        selector events. Replies are sent in request order
+        :param connection: HostConnection
+        :param events: selector events
+        """
+
+        try:
+            if events & selectors.EVENT_READ:
+                data = connection.sock.recv(RECV_SZ)
+                if len(data) == 0:
+                    if connection.decoder.pending():
+                        print('connection from {} closed in the middle of a frame'.format(connection.address))
+                    self.close_host_connection(connection)
+                    return
+                for frame in connection.decoder.feed(data):
+                    self.handle_host_frame(connection, frame)
+
+            if len(connection.outgoing) > 0:
+                sent = connection.sock.send(connection.outgoing)
+                del connection.outgoing[:sent]
+        except BlockingIOError:
+            pass
+        except (OSError, ValueError) as e:
+            print('connection from {} failed: {}'.format(connection.address, e))
+            self.close_host_connection(connection)
+            return
+        except Exception as e:
+            print('bad request from {}: {!r}'.format(connection.address, e))
+            self.close_host_connection(connection)
+            return
+
+        #Wait for room to send the rest of the replies, and stop reading while too many are pending
+        wanted = selectors.EVENT_WRITE if len(connection.outgoing) > 0 else 0
+        if len(connection.outgoing) < MAX_OUTGOING:
+            wanted |= selectors.EVENT_READ
+        if wanted != self.selector.get_key(connection.sock).events:
+            self.selector.modify(connection.sock, wanted, self.selector.get_key(connection.sock).data)
+
+    def handle_host_frame(self, connection, frame):
+        """
+        Handles one frame received from a host, a hello frame or a request, and queues the reply. A request that
+        fails, e.g. on a malformed news item, is answered with False
+        :param connection: HostConnection
+        :param frame: bytes
+        """
+
+        if wire_codec.is_hello(frame):
+            connection.reply_codec = wire_codec.choose_codec(wire_codec.decode_hello(frame), wire_codec.PUBLISHER_HOP)
+            reply = wire_codec.encode_hello([connection.reply_codec.name])
+        else:
+            rpc = wire_codec.decode_any(frame, wire_codec.PUBLISHER_HOP)[1]
+            if not isinstance(rpc, tuple) or len(rpc) < 2:
+                raise ValueError('Malformed request {!r}'.format(rpc))
+            try:
+                result = self.dispatch_rpc(rpc[0], rpc[1])
+            except Exception as e:
+                print('failed request {} from {}: {!r}'.format(rpc[0], connection.address, e))
+                result = False
+            reply = connection.reply_codec.encode((rpc[2], result) if len(rpc) > 2 else result)
+        connection.outgoing += transport.encode_frame(reply)
+
+    def close_host_connection(self, connection):
+        """
+        Removes a host connection from the selector loop, and closes it
+        :param connection: HostConnection
+        """
+
+        self.selector.unregister(connection.sock)
+        connection.sock.close()
+
+    def on_stream_accept(self, sock, events):
+        """
+        Accepts the pending connections from stream subscribers, and adds them to the selector loop
+        :param sock: stream socket
+        :param events: selector events
+        """
+
+        while True:
+            try:
+                client, client_addr = sock.accept()
+            except BlockingIOError:
+                return
+            except OSError as e:
+                print('failed to accept stream: {}'.format(e))
+                return
+            client.setblocking(False)
+            connection = StreamConnection(client, client_addr)
+            self.selector.register(client, selectors.EVENT_READ,
+                                   lambda sock, events, connection=connection:
+                                   self.on_stream_ready(connection, events))
+
+    def on_stream_ready(self, connection, events):
+        """
+        Reads the rpcs of a stream subscriber, or sends its queued frames, depending on the selector events
+        :param connection: StreamConnection
+        :param events: selector events
+        """
+
+        if events & selectors.EVENT_READ:
+            try:
+                data = connection.sock.recv(RECV_SZ)
+                if len(data) == 0:
+                    self.close_stream(connection)
+                    return
+                frames = connection.decoder.feed(data)
+            except BlockingIOError:
+                frames = []
+            except OSError as e:
+                print('stream from {} failed: {}'.format(connection.address, e))
+                self.close_stream(connection)
+                return
+            for frame in frames:
+                self.answer_subscriber(connection.address, frame, connection)
+        self.flush_stream(connection)
+
+    def on_wakeup(self, sock, events):
+        """
+        Sends the frames publishing threads queued on streams
+        :param sock: reading end of the wake-up socket pair
+        :param events: selector events
+        """
+
+        try:
+            while len(sock.recv(RECV_SZ)) > 0:
+                pass
+        except BlockingIOError:
+            pass
+        while len(self.streams_ready) > 0:
+            connection = self.streams_ready.popleft()
+            with connection.lock:
+                connection.scheduled = False
+            self.flush_stream(connection)
+
+    def queue_stream(self, connection, frames):
+        """
+        Queues frames for a stream subscriber, to be sent by the selector loop. Can be called from any thread, it
+        never waits for the subscriber. Once the queue holds more than stream_queue bytes, the oldest frames are
+        dropped, the newest one always being kept, or the connection is closed, depending on the overflow policy
+        :param connection: StreamConnection
+        :param frames: list of bytes
+        """
+
+        with connection.lock:
+            if connection.closed:
+                return
+            connection.queue.extend(frames)
+            connection.queued += sum(len(frame) for frame in frames)
+            if self.stream_policy == DISCONNECT:
+                connection.overflowed = connection.overflowed or connection.queued > self.stream_queue
+            else:
+                while connection.queued > self.stream_queue and len(connection.queue) > 1:
+                    connection.queued -= len(connection.queue.popleft())
+                    self.stream_dropped += 1
+            wake = not connection.scheduled
+            connection.scheduled = True
+
+        if wake:
+            self.streams_ready.append(connection)
+            try:
+                self.wakeup_writer.send(b'\0')
+            except BlockingIOError:
+                pass    #the loop has wake-ups pending already
+
+    def flush_stream(self, connection):
+        """
+        Sends the frames queued for a stream subscriber, as much as the connection takes without waiting, and waits
+        for room to send the rest. Runs on the selector loop
+        :param connection: StreamConnection
+        """
+
+        if connection.closed:
+            return
+        if connection.overflowed:
+            print('disconnecting stream subscriber {}, {} bytes behind'.format(connection.address, connection.queued))
+            self.stream_disconnected += 1
+            self.close_stream(connection)
+            return
+
+        try:
+            while True:
+                if connection.outgoing is None:
+                    #Send the queued frames, up to RECV_SZ bytes of them, with one call
+                    with connection.lock:
+                        batch = []
+                        size = 0
+                        while len(connection.queue) > 0 and size < RECV_SZ:
+                            batch.append(connection.queue.popleft())
+                            size += len(batch[-1])
+                        connection.queued -= size
+                    if len(batch) == 0:
+                        break
+                    connection.outgoing = memoryview(b''.join(batch))
+                sent = connection.sock.send(connection.outgoing)
+                connection.outgoing = connection.outgoing[sent:] if sent < len(connection.outgoing) else None
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            print('stream to {} failed: {}'.format(connection.address, e))
+            self.close_stream(connection)
+            return
+
+        wanted = selectors.EVENT_READ | (selectors.EVENT_WRITE if connection.outgoing is not None else 0)
+        key = self.selector.get_key(connection.sock)
+        if wanted != key.events:
+            self.selector.modify(connection.sock, wanted, key.data)
+
+    def close_stream(self, connection):
+        """
+        Removes a stream subscriber's connection from the selector loop, closes it, and ends its subscription,
+        unless the subscriber registered again since
+        :param connection: StreamConnection
+        """
+
+        with connection.lock:
+            connection.closed = True
+            connection.queue.clear()
+            connection.queued = 0
+        self.selector.unregister(connection.sock)
+        connection.sock.close()
+
+        subscription = connection.subscription
+        if subscription is None:
+            return
+        with self.publish_lock:
+            removed = self.subscriptions.get(subscription.address) is subscription
+            if removed:
+                del self.subscriptions[subscription.address]
+                self.interests.remove(subscription)
+                self.fanout_targets = None
+        if removed:
+            print('stream subscriber {} disconnected, {} live'.format(subscription.address, len(self.subscriptions)))
 
     def start_register_server(self):
         """
-        Starts UDP register listener and registers subscribers that connect
+        Starts UDP register listener and registers subscribers that connect, handling each datagram on its own
+        thread. serve runs the listener on the selector loop instead, and also serves stream subscribers
         """
 
         self.registration_socket.bind(self.registration_address)
+        reader = transport.DatagramReader(self.registration_socket)
 
         while True:
-            msg, client = self.registration_socket.recvfrom(BUF_SZ)
-            th = threading.Thread(target=self.handle_rpc_from_subscriber, args=(client, msg))
+            try:
+                msg, client = reader.recv_datagram()
+            except OSError as e:
+                print('failed to receive registration: {}'.format(e))
+                continue
+            th = threading.Thread(target=self.handle_rpc_from_subscriber, args=(client, bytes(msg)))
             th.start()
 
     def start_publication_server(self):
         """
         Starts TCP publication server, which listens for RPCs
-        from the host
+        from the host, handling each connection on its own thread. serve runs the server on the selector loop instead
         """
 
+        #Connections from the host are long-lived, so allow rebinding while old ones are in TIME_WAIT
+        self.publication_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.publication_socket.bind(self.publication_address)
         self.publication_socket.listen(BACKLOG)
 
         while True:
             client, client_addr = self.publication_socket.accept()
-            th = threading.Thread(target=self.handle_rpc_from_host, args=(client,))
+            th = threading.Thread(target=self.handle_rpc_from_host, args=(client, client_addr))
             th.start()
 
-    def handle_rpc_from_host(self, client):
+    def handle_rpc_from_host(self, client, client_addr=None):
         """
-        Handles incoming rpc for tcp connection from host
+        Handles incoming rpcs for tcp connection from host. The connection is kept open for any number of
+        pipelined requests, each sent as a frame. A request tagged with a request id (method, arg1, request_id) is
+        answered with (request_id, result), an untagged one (method, arg1) with the bare result. A request that fails,
+        e.g. on a malformed news item, is answered with False, a malformed request closes the connection, like
+        handle_host_frame does
         :param client: connecting client
+        :param client_addr: address of the client, for messages
         """
 
-        rpc = client.recv(BUF_SZ)
-        method, arg1 = pickle.loads(rpc)
-        result = self.dispatch_rpc(method, arg1)
-        client.sendall(pickle.dumps(result))
+        reader = transport.FrameReader(client)
+        reply_codec = wire_codec.get_codec(wire_codec.PICKLE)
+        with client:
+            while True:
+                try:
+                    rpc = reader.recv_frame()
+                    if rpc is None:
+                        return
+                    codec = wire_codec.server_hello(client, rpc, wire_codec.PUBLISHER_HOP)
+                    if codec is not None:
+                        reply_codec = codec
+                        continue
+                    rpc = wire_codec.decode_any(rpc, wire_codec.PUBLISHER_HOP)[1]
+                    if not isinstance(rpc, tuple) or len(rpc) < 2:
+                        raise ValueError('Malformed request {!r}'.format(rpc))
+                except (OSError, ValueError) as e:
+                    print('connection from {} failed: {}'.format(client_addr, e))
+                    return
+
+                try:
+                    result = self.dispatch_rpc(rpc[0], rpc[1])
+                except Exception as e:
+                    print('failed request {} from {}: {!r}'.format(rpc[0], client_addr, e))
+                    result = False
+                reply = (rpc[2], result) if len(rpc) > 2 else result
+                try:
+                    transport.send_frame(client, reply_codec.encode(reply))
+                except OSError:
+                    return
 
     def handle_rpc_from_subscriber(self, client, msg):
         """
-        Handles incoming rpc for UDP connection from subscriber
+        Handles incoming rpc for UDP connection from subscriber. The reply uses the codec the subscriber
+        registered with
         :param client: connecting client
         :param: msg: any
             argument for rpc
         """
 
-        args = pickle.loads(msg)
-        method, result, sub_addr = self.dispatch_rpc(args[0], args[1])
-        self.registration_socket.sendto(pickle.dumps((method, result)), sub_addr)
+        for frame, address in self.answer_subscriber(client, msg):
+            try:
+                self.registration_socket.sendto(frame, address)
+            except OSError as e:
+                print('failed to reply to {}: {}'.format(address, e))
+
+    def answer_subscriber(self, client, msg, stream=None):
+        """
+        Dispatches an rpc datagram from a subscriber, and builds the reply, in the codec the subscriber registered
+        with. Replies are the same for every subscriber of a codec, so each is encoded once. The replies to a stream
+        subscriber are queued on its connection
+        :param client: address the datagram came from
+        :param msg: bytes-like rpc datagram payload
+        :param stream: StreamConnection the rpc came on, None for a datagram
+        :return: list of (reply frame, subscriber address), empty if the request is invalid, or the subscriber
+            gets its replies on a stream. A nack is answered with the retransmitted publications
+        """
+
+        try:
+            args = wire_codec.decode_any(msg, wire_codec.SUBSCRIBER_HOP)[1]
+            if args[0] == REGISTER and stream is not None:
+                method, result, subscription = self.register(args[1], stream)
+            else:
+                method, result, subscription = self.dispatch_rpc(args[0], args[1])
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            print('invalid request from {}: {}'.format(client, e))
+            return []
+
+        if subscription is None:
+            return []
+        if method == NACK:
+            frames = result
+        elif method == REGISTER and subscription.sequenced:
+            #Tell a sequenced subscriber where its publications start, so it can tell if the first ones are lost,
+            #then catch it up
+            message = (method, result, subscription.start_seq, self.epoch)
+            frames = [transport.encode_datagram(subscription.codec.encode(message))] + subscription.replay
+            subscription.replay = []
+        elif method == HEARTBEAT and result == 'Renewed' and subscription.sequenced:
+            #Tell a sequenced subscriber the last publication sent to it, so it can tell if the last ones are lost,
+            #which no later publication reveals
+            message = (method, result, self.last_sent(subscription), self.epoch)
+            frames = [transport.encode_datagram(subscription.codec.encode(message))]
+        else:
+            key = (subscription.codec.name, method, result)
+            frame = self.reply_frames.get(key)
+            if frame is None:
+                frame = transport.encode_datagram(subscription.codec.encode((method, result)))
+                self.reply_frames[key] = frame
+            frames = [frame]
+
+        if subscription.stream is not None:
+            self.queue_stream(subscription.stream, frames)
+            return []
+        return [(frame, subscription.sockaddr) for frame in frames]
 
     def dispatch_rpc(self, method, arg1):
         """
@@ -99,37 +1037,617 @@ class DailyNewsPublisher(object):
 
         if method == PUBLISH:
             return self.publish(arg1)
+        elif method == PUBLISH_BATCH:
+            return self.publish_batch(arg1)
         elif method == REGISTER:
             return self.register(arg1)
+        elif method == HEARTBEAT:
+            return self.heartbeat(arg1)
+        elif method == NACK:
+            return self.nack(arg1)
+        elif method == STATS:
+            return self.stats()
 
-    def register(self, sub_address):
+    def register(self, request, stream=None):
         """
         Registers subscriber
-        :param sub_address: client address
-            Client wanting publications
-        :return: (method, result str, address of subscriber)
+        :param request: client address, or dict
+            Client wanting publications. A bare (host, port) address registers a legacy subscriber, using the
+            compatibility codec, for all news. A dict holds the 'address' and the 'codec' name the subscriber
+            wants, and optionally lists of 'sources' and 'keywords' filters. A subscriber with filters only gets
+            news from one of its sources, or with one of its keywords in the headline.
+
+            A subscriber registering again can send the sequence number of the last publication it got as 'since',
+            and the 'epoch' it came from, to be caught up on the publications it missed that are still in the ring.
+            Offsets from another epoch are from before the publisher restarted, so it is caught up on all of them
+        :param stream: StreamConnection the request came on, None for a datagram. A stream subscriber gets its
+            publications on the connection, and its subscription lasts as long as the connection, without heartbeats
+        :return: (method, result str, Subscription)
+        """
+
+        if isinstance(request, dict):
+            sub_address = tuple(request['address'])
+            codec = wire_codec.choose_codec([request.get('codec', wire_codec.PICKLE)], wire_codec.SUBSCRIBER_HOP)
+            sources = normalize_filters(request.get('sources', ()))
+            keywords = normalize_keywords(request.get('keywords', ()))
+            since = request.get('since')
+            if since is not None:
+                since = 0 if request.get('epoch', self.epoch) != self.epoch else max(0, int(since))
+        else:
+            sub_address = tuple(request)
+            codec = wire_codec.get_codec(wire_codec.PICKLE)
+            sources = keywords = frozenset()
+            since = None
+
+        #Subscribers registering with a dict send heartbeats, unless they have a stream, legacy subscribers never
+        #expire
+        sequenced = isinstance(request, dict)
+        expires = time.monotonic() + self.lease_duration if sequenced and stream is None else None
+
+        print('registering {}subscription for {} ({}){}'.format(
+            'stream ' if stream is not None else '', sub_address, codec.name,
+            ' sources: {} keywords: {}'.format(sorted(sources), sorted(keywords)) if sources or keywords else ''))
+        subscription = Subscription(sub_address, codec, sources, keywords, expires, sequenced, stream)
+        if stream is not None:
+            stream.subscription = subscription
+
+        #The subscription is added between two publications, so it gets every publication after start_seq. Replace
+        #any previous registration of the same address, with its filters. Its lease entry is dropped when it comes due
+        with self.publish_lock:
+            current = self.ring.next_seq - 1
+            subscription.start_seq = subscription.last_seq = current
+            if since is not None and since < current and subscription.sequenced:
+                subscription.start_seq = since
+                subscription.replay, subscription.last_seq = self.retransmit(subscription, since + 1, current)
+            previous = self.subscriptions.get(sub_address)
+            if previous is not None:
+                self.interests.remove(previous)
+            self.interests.add(subscription)
+            self.subscriptions[sub_address] = subscription
+            self.fanout_targets = None
+        if expires is not None:
+            with self.leases_lock:
+                self.lease_sequence += 1
+                heapq.heappush(self.leases, (expires, self.lease_sequence, subscription))
+        return REGISTER, 'Registered', subscription
+
+    def heartbeat(self, request):
+        """
+        Renews the lease of a subscription
+        :param request: dict, or client address
+            dict holding the 'address' and the 'codec' of the subscriber, or its bare (host, port) address
+        :return: (method, result str, Subscription)
+            'Renewed', or 'Unknown' if the subscription expired or the publisher restarted, in which case the
+            subscriber registers again. An unknown subscriber gets an unregistered Subscription to reply to. The
+            reply to a sequenced subscriber also carries the last publication sent to it, and the epoch
+        """
+
+        if isinstance(request, dict):
+            sub_address = tuple(request['address'])
+            codec = wire_codec.choose_codec([request.get('codec', wire_codec.PICKLE)], wire_codec.SUBSCRIBER_HOP)
+        else:
+            sub_address = tuple(request)
+            codec = wire_codec.get_codec(wire_codec.PICKLE)
+
+        subscription = self.subscriptions.get(sub_address)
+        if subscription is None:
+            return HEARTBEAT, 'Unknown', Subscription(sub_address, codec)
+        if subscription.expires is not None:
+            subscription.expires = time.monotonic() + self.lease_duration
+        return HEARTBEAT, 'Renewed', subscription
+
+    def last_sent(self, subscription):
+        """
+        :param subscription: Subscription
+        :return: int
+            sequence number of the last publication sent to the subscriber, the latest one unless it is filtered
+        """
+
+        return subscription.last_seq if subscription.filtered else max(subscription.start_seq, self.ring.next_seq - 1)
+
+    def nack(self, request):
+        """
+        Retransmits publications a subscriber missed, from the retransmit ring. Only the publications the
+        subscriber wants are sent, each carrying the sequence number of the one before it. If the ring no longer
+        holds some of them, the subscriber is told they are gone with a (nack, (first, last)) notice
+        :param request: dict
+            'address' of the subscriber, and the 'first' and 'last' sequence numbers it missed
+        :return: (method, list of frames, Subscription, or None if there is nothing to retransmit)
+        """
+
+        subscription = self.subscriptions.get(tuple(request['address']))
+        if subscription is None or not subscription.sequenced:
+            return NACK, [], None
+        return NACK, self.retransmit(subscription, int(request['first']), int(request['last']))[0], subscription
+
+    def retransmit(self, subscription, first, last):
+        """
+        Encodes the publications from first to last a subscriber wants, from the retransmit ring, packed into
+        datagrams. The first one carries first - 1 as previous sequence number. If the ring no longer holds some of
+        them, they are announced with a (nack, (first, last)) notice
+        :param subscription: Subscription
+        :param first: int
+        :param last: int
+        :return: (list of frames, sequence number of the last publication sent or announced, first - 1 if none)
+        """
+
+        available, oldest = self.ring.get_range(first, last)
+        codec = subscription.codec
+        frames = []
+        if first < oldest:
+            gone = (NACK, (first, min(last, oldest - 1)))
+            frames.append(transport.encode_datagram(codec.encode(gone)))
+        entries = []
+        prev = min(max(first, oldest), last + 1) - 1
+        for seq, item in available:
+            if subscription.matches(item):
+                entries.append((item, seq, prev))
+                prev = seq
+        packed, failed = self.pack_publications(codec, entries, subscription.stream is not None)
+        frames.extend(packed)
+        self.retransmit_count += len(entries) - len(failed)
+        return frames, prev
+
+    def pack_publications(self, codec, entries, stream=False):
+        """
+        Encodes publications to a sequenced subscriber, packing as many as fit in the datagram budget into each
+        datagram. A datagram holding one publication is (publish, item, seq, prev, epoch), one holding several is
+        (publish_batch, (epoch, [(item, seq, prev)]))
+        :param codec: wire codec
+        :param entries: list of (NewsItem, seq, prev), in sequence order
+        :param stream: True to encode frames for stream subscribers, packed up to STREAM_BUDGET, with no size limit
+            on a single publication
+        :return: (list of frames, set of the sequence numbers of the publications that can't be sent)
+        """
+
+        encode = transport.encode_frame if stream else transport.encode_datagram
+        #Publications are packed by their size before compression, so a datagram stays within the budget whatever
+        #they compress to
+        plain = codec.inner if isinstance(codec, wire_codec.CompressedCodec) else codec
+        budget = (STREAM_BUDGET if stream else self.datagram_budget) - transport.HEADER.size - \
+            len(plain.encode((PUBLISH_BATCH, (self.epoch, []))))
+        chunks = []
+        size = 0
+        failed = set()
+        for item, seq, prev in entries:
+            try:
+                entry = (codec.wire_item(item), seq, prev)
+                entry_size = len(plain.encode(entry))
+            except Exception as e:
+                print('failed to publish news {}: {!r}'.format(item, e))
+                failed.add(seq)
+                continue
+            if len(chunks) == 0 or size + entry_size > budget:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(entry)
+            size += entry_size
+
+        frames = []
+        for chunk in chunks:
+            if len(chunk) == 1:
+                message = (PUBLISH,) + chunk[0] + (self.epoch,)
+            else:
+                message = (PUBLISH_BATCH, (self.epoch, chunk))
+            try:
+                frames.append(encode(codec.encode(message)))
+            except Exception as e:
+                print('failed to publish news {}: {}'.format(chunk[0][0] if len(chunk) == 1 else chunk, e))
+                failed.update(seq for wire_item, seq, prev in chunk)
+        return frames, failed
+
+    def encode_publication(self, codec, item, seq, prev):
+        """
+        Encodes and frames a publication datagram
+        :param codec: wire codec
+        :param item: NewsItem
+        :param seq: int
+            sequence number of the item
+        :param prev: int, or None
+            sequence number of the previous publication sent to the subscriber. None for legacy subscribers, whose
+            publications are (publish, item) only
+        :return: bytes
+        """
+
+        if prev is None:
+            message = (PUBLISH, codec.wire_item(item))
+        else:
+            message = (PUBLISH, codec.wire_item(item), seq, prev, self.epoch)
+        return transport.encode_datagram(codec.encode(message))
+
+    def run_coalescer(self):
+        """
+        Sends the publications waiting in coalesced. Once an item is waiting, lingers for more, up to linger seconds
+        or COALESCE_MAX items, so a burst of items shares datagrams
+        """
+
+        while True:
+            with self.coalesce_ready:
+                while len(self.coalesced) == 0:
+                    self.coalesce_ready.wait()
+                deadline = time.monotonic() + self.linger
+                while len(self.coalesced) < COALESCE_MAX:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.coalesce_ready.wait(remaining)
+                items = self.coalesced
+                self.coalesced = []
+            try:
+                self.send_publications(items)
+            except Exception as e:
+                print('failed to send {} coalesced publications: {!r}'.format(len(items), e))
+
+    def expire_subscriptions(self):
+        """
+        Removes the subscriptions whose lease expired. Only the lease entries that came due are looked at: an entry
+        whose subscription was renewed is pushed back with the new expiry time, an entry whose subscription was
+        replaced or removed is dropped
+        :return: int
+            number of subscriptions expired
+        """
+
+        now = time.monotonic()
+        expired = []
+        with self.leases_lock:
+            while len(self.leases) > 0 and self.leases[0][0] <= now:
+                expires, sequence, subscription = heapq.heappop(self.leases)
+                if self.subscriptions.get(subscription.address) is not subscription:
+                    continue
+                if subscription.expires > now:
+                    heapq.heappush(self.leases, (subscription.expires, sequence, subscription))
+                    continue
+                expired.append(subscription)
+
+        if len(expired) == 0:
+            return 0
+        #A subscription may have been replaced since its entry was looked at
+        with self.publish_lock:
+            expired = [subscription for subscription in expired
+                       if self.subscriptions.get(subscription.address) is subscription]
+            for subscription in expired:
+                del self.subscriptions[subscription.address]
+                self.interests.remove(subscription)
+            self.fanout_targets = None
+        if len(expired) > 0:
+            self.expired_count += len(expired)
+            print('expired {} subscriptions, {} live'.format(len(expired), len(self.subscriptions)))
+        return len(expired)
+
+    def stats(self):
+        """
+        Counters of the subscriptions
+        :return: dict
+            number of live subscriptions, of subscriptions expired so far, of publications so far, of publication
+            datagrams sent so far, of publications retransmitted so far, of frames dropped for stream subscribers
+            falling behind so far, of stream subscribers disconnected for it so far, and of publications refused
+            because the coalescer queue was full so far, and the bytes and time spent by the compressed codecs, by hop
+        """
+
+        return {'subscribers': len(self.subscriptions), 'expired': self.expired_count,
+                'published': self.ring.next_seq - 1, 'datagrams': self.datagram_count,
+                'retransmitted': self.retransmit_count, 'stream_dropped': self.stream_dropped,
+                'stream_disconnected': self.stream_disconnected, 'coalesce_refused': self.coalesce_refused,
+                'compression': wire_codec.compression_stats()}
+
+    def subscriber_count(self):
+        """
+        :return: number of live subscriptions
+        """
+
+        return len(self.subscriptions)
+
+    def get_fanout_targets(self):
+        """
+        Groups the unfiltered subscriptions, which get all news, by codec, by whether they are sequenced, and by
+        whether they have a stream
+        :return: list of (codec, sequenced, stream, [subscriber address, or StreamConnection for a stream])
         """
 
-        print('registering subscription for {}'.format(sub_address))
-        self.subscriptions[sub_address] = datetime.utcnow()
-        return REGISTER, 'Registered', sub_address
+        targets = self.fanout_targets
+        if targets is None:
+            groups = {}
+            for subscription in list(self.subscriptions.values()):
+                if subscription.filtered:
+                    continue
+                codec = subscription.codec
+                stream = subscription.stream is not None
+                key = (codec.name, subscription.sequenced, stream)
+                groups.setdefault(key, (codec, subscription.sequenced, stream, []))[3].append(
+                    subscription.stream if stream else subscription.sockaddr)
+            targets = list(groups.values())
+            self.fanout_targets = targets
+        return targets
 
-    def publish(self, xml_str):
+    def publish(self, news):
         """
         Publishes news to subscribers
-        :param xml_str: byte str
-            news as xml string
+        :param news: NewsItem, or xml string
+            news item
         :return: boolean
         """
 
-        if len(self.subscriptions) == 0:
+        return self.publish_batch([news])[0]
+
+    def publish_batch(self, news_items):
+        """
+        Publishes several news items to subscribers. With a linger, the items are handed to the coalescer thread,
+        which sends them with the items arriving within the linger, otherwise they are sent right away.
+
+        Under a linger, the results tell whether each item was accepted, not whether it was sent: True once the item
+        is queued for the coalescer thread, False if coalesce_queue items are waiting already. The caller doesn't
+        wait, as it may be the selector loop, and can publish refused items again later, like the host does
+        :param news_items: list
+            news items, as NewsItems or xml strings
+        :return: list
+            result of publishing each item, or of queueing it under a linger, in the same order
+        """
+
+        if self.subscriber_count() == 0:
+            return [False] * len(news_items)
+
+        items = [wire_codec.as_news_item(news) for news in news_items]
+        if self.linger == 0:
+            return self.send_publications(items)
+        with self.coalesce_ready:
+            accepted = items[:max(0, self.coalesce_queue - len(self.coalesced))]
+            if len(accepted) > 0:
+                self.coalesced.extend(accepted)
+                self.coalesce_ready.notify()
+            refused = len(items) - len(accepted)
+            self.coalesce_refused += refused
+        if refused > 0:
+            print('publication queue full, {} news items refused'.format(refused))
+        return [True] * len(accepted) + [False] * refused
+
+    def send_publications(self, items):
+        """
+        Sends news items to subscribers, in one fan-out. Each message is encoded and framed once per codec, not once
+        per subscriber. Unfiltered subscribers get all items, filtered subscribers are found through the interest
+        index.
+
+        Items are numbered and kept in the retransmit ring. Each publication to a sequenced subscriber carries its
+        sequence number, and that of the previous publication sent to the subscriber, so the subscriber can detect
+        a lost datagram even if it only gets some of the items. Publications to a sequenced subscriber are packed
+        into datagrams up to the datagram budget, legacy subscribers get one datagram per item. Publications to
+        stream subscribers are packed into larger frames, and queued on their connections
+        :param items: list of NewsItem
+        :return: list
+            result of publishing each item, in the same order
+        """
+
+        if len(items) == 0:
+            return []
+
+        #Publications are numbered and sent under one lock, so each subscriber gets them in sequence order
+        with self.publish_lock:
+            seqs = self.ring.append(items)
+            results = [True] * len(items)
+            frames = {}
+
+            def get_frames(codec, indexes, prev, stream):
+                #Frames of some items for one codec, chained by their previous sequence number (None for legacy
+                #subscribers). Frames are encoded once, and an item that can't be sent is left out
+                key = (codec.name, tuple(indexes), prev, stream)
+                if key in frames:
+                    return frames[key]
+                if prev is None:
+                    frames[key] = []
+                    for i in indexes:
+                        try:
+                            frames[key].append(self.encode_publication(codec, items[i], seqs[i], None))
+                        except Exception as e:
+                            print('failed to publish news {}: {}'.format(items[i], e))
+                            results[i] = False
+                else:
+                    entries = []
+                    for i in indexes:
+                        entries.append((items[i], seqs[i], prev))
+                        prev = seqs[i]
+                    frames[key], failed = self.pack_publications(codec, entries, stream)
+                    for seq in failed:
+                        results[seq - seqs[0]] = False
+                return frames[key]
+
+            #Unfiltered subscribers get every item. Datagram groups go to the fan-out engine, stream groups are
+            #queued on their connections
+            groups = []
+            streams = []
+            for codec, sequenced, stream, targets in self.get_fanout_targets():
+                (streams if stream else groups).append(
+                    (get_frames(codec, range(len(items)), seqs[0] - 1 if sequenced else None, stream), targets))
+
+            #Filtered subscribers wanting the same items with the same codec, and the same previous sequence number,
+            #share a group, so every subscriber is in one group, and gets its items in order
+            filtered = {}
+            for address, indexes in self.interests.match(items).items():
+                subscription = self.subscriptions.get(address)
+                if subscription is None:
+                    continue
+                prev = subscription.last_seq if subscription.sequenced else None
+                stream = subscription.stream is not None
+                key = (subscription.codec.name, tuple(indexes), prev, stream)
+                filtered.setdefault(key, (subscription.codec, []))[1].append(
+                    subscription.stream if stream else subscription.sockaddr)
+                subscription.last_seq = seqs[indexes[-1]]
+            for (name, indexes, prev, stream), (codec, targets) in filtered.items():
+                (streams if stream else groups).append((get_frames(codec, indexes, prev, stream), targets))
+
+            report = self.fanout.fanout(groups)
+            self.datagram_count += report.sent
+            stream_count = 0
+            for frames, connections in streams:
+                for connection in connections:
+                    self.queue_stream(connection, frames)
+                stream_count += len(connections)
+        print('published {} news items to {} subscribers in {} datagrams{} in {:.1f} ms'.format(
+            len(items), report.subscribers + stream_count, report.sent,
+            ' and {} streams'.format(stream_count) if stream_count > 0 else '', report.elapsed * 1000))
+        if report.failed > 0:
+            print('failed to send {} of {} datagrams: {}'.format(report.failed, report.sent + report.failed,
+                                                                 report.error))
+        return results
+
+class ShardedPublisher(DailyNewsPublisher):
+    """
+    Publisher with its subscribers sharded across worker processes, so fan-out isn't bound to the one core the GIL
+    lets a process use. This process is the coordinator: it serves registrations and host connections like
+    DailyNewsPublisher, routes each subscriber rpc to the shard owning the subscriber (by hash of its address), and
+    hands each publication to every shard, which fans it out to its own subscribers.
+
+    Shards number publications themselves, as they all get the same ones in the same order, and publish their
+    counters to shared memory, so the coordinator knows them without asking.
+
+    Attributes:
+         shards: list of (Process, Connection, Lock)
+            worker processes, and the pipes publications and rpcs are sent to them on
+         counters: shared Array of int
+            SHARD_STATS counters of each shard, one after the other
+    """
+    def __init__(self, reg_port, pub_port, shards=None, lease_duration=LEASE_DURATION,
+                 linger=PUBLISH_LINGER, datagram_budget=DATAGRAM_BUDGET):
+        #One shard per core by default, counted when the publisher starts
+        if shards is None:
+            shards = multiprocessing.cpu_count()
+        #Spawned worker processes only inherit their own end of their pipe, so they see the coordinator go away
+        context = multiprocessing.get_context('spawn')
+        epoch = int(time.time() * 1000)
+        self.counters = context.Array('q', max(1, shards) * len(SHARD_STATS), lock=False)
+        self.shards = []
+        for index in range(max(1, shards)):
+            connection, shard_connection = context.Pipe()
+            process = context.Process(target=run_shard, daemon=True, args=(
+                index, shard_connection, self.counters, epoch, lease_duration, datagram_budget))
+            process.start()
+            shard_connection.close()
+            self.shards.append((process, connection, threading.Lock()))
+        self.codec = wire_codec.get_codec(wire_codec.BINARY)
+
+        super().__init__(reg_port, pub_port, 1, lease_duration, linger, datagram_budget)
+        self.epoch = epoch
+        #Shards hold the subscriptions, and only send datagrams, so stream subscribers need an unsharded publisher
+        self.stream_socket.close()
+        self.stream_socket = None
+
+    def answer_subscriber(self, client, msg):
+        """
+        Forwards an rpc datagram from a subscriber to the shard owning the subscriber, which replies itself
+        :param client: address the datagram came from
+        :param msg: bytes-like rpc datagram payload
+        :return: empty list
+        """
+
+        try:
+            request = wire_codec.decode_any(msg, wire_codec.SUBSCRIBER_HOP)[1][1]
+            address = tuple(request['address'] if isinstance(request, dict) else request)
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            print('invalid request from {}: {}'.format(client, e))
+            return []
+
+        self.forward(hash(address) % len(self.shards), (FORWARD, bytes(msg), tuple(client)))
+        return []
+
+    def send_publications(self, items):
+        """
+        Hands news items to every shard, to be sent to their subscribers
+        :param items: list of NewsItem
+        :return: list
+            result of publishing each item, in the same order
+        """
+
+        if len(items) == 0:
+            return []
+        frame = self.codec.encode((PUBLISH_BATCH, items, None))
+        #Every shard gets the items, even if one can't be reached
+        forwarded = [self.forward(index, frame) for index in range(len(self.shards))]
+        results = [all(forwarded)] * len(items)
+        print('handed {} news items to {} shards'.format(len(items), len(self.shards)))
+        return results
+
+    def forward(self, index, message):
+        """
+        Sends a message to a shard
+        :param index: int
+            shard number
+        :param message: tuple, or its encoding with the binary codec
+        :return: True, if the message was sent
+        """
+
+        process, connection, lock = self.shards[index]
+        if isinstance(message, tuple):
+            message = self.codec.encode(message)
+        try:
+            with lock:
+                connection.send_bytes(message)
+            return True
+        except OSError as e:
+            print('failed to reach shard {}: {}'.format(index, e))
             return False
 
-        for subscriber in self.subscriptions:
-            print('publishing news to {}'.format(subscriber))
-            self.registration_socket.sendto(pickle.dumps((PUBLISH, xml_str)), subscriber)
+    def stats(self):
+        """
+        Counters of the subscriptions, summed over the shards
+        :return: dict
+            SHARD_STATS counters, and the number of shards
+        """
+
+        totals = {name: sum(self.counters[index * len(SHARD_STATS) + i] for index in range(len(self.shards)))
+                  for i, name in enumerate(SHARD_STATS)}
+        #Every shard numbers all publications
+        totals['published'] //= len(self.shards)
+        totals['shards'] = len(self.shards)
+        return totals
 
-        return True
+    def subscriber_count(self):
+        """
+        :return: number of live subscriptions, as last published by the shards
+        """
+
+        return sum(self.counters[index * len(SHARD_STATS)] for index in range(len(self.shards)))
+
+
+def run_shard(index, connection, counters, epoch, lease_duration, datagram_budget):
+    """
+    Runs a shard of a ShardedPublisher, in a worker process. Handles the publications and subscriber rpcs the
+    coordinator sends, expires subscriptions, and publishes the counters of the shard to shared memory. Returns once
+    the coordinator is gone
+    :param index: int
+        shard number
+    :param connection: Connection
+        pipe from the coordinator
+    :param counters: shared Array of int
+        SHARD_STATS counters of every shard
+    :param epoch: int
+        epoch of the coordinator
+    :param lease_duration: float
+    :param datagram_budget: int
+    """
+
+    shard = DailyNewsPublisher(0, 0, 1, lease_duration, linger=0, datagram_budget=datagram_budget)
+    shard.epoch = epoch
+    codec = wire_codec.get_codec(wire_codec.BINARY)
+    next_sweep = time.monotonic() + SWEEP_INTERVAL
+    while True:
+        try:
+            if connection.poll(max(0.0, next_sweep - time.monotonic())):
+                method, arg1, arg2 = codec.decode(connection.recv_bytes())
+                if method == PUBLISH_BATCH:
+                    shard.send_publications(arg1)
+                elif method == FORWARD:
+                    for frame, address in shard.answer_subscriber(tuple(arg2), arg1):
+                        try:
+                            shard.registration_socket.sendto(frame, address)
+                        except OSError as e:
+                            print('failed to reply to {}: {}'.format(address, e))
+        except (EOFError, OSError):
+            return
+        if time.monotonic() >= next_sweep:
+            shard.expire_subscriptions()
+            next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+        stats = shard.stats()
+        for i, name in enumerate(SHARD_STATS):
+            counters[index * len(SHARD_STATS) + i] = stats[name]
 
 
 if __name__ == '__main__':
@@ -139,15 +1657,19 @@ if __name__ == '__main__':
 
     if len(sys.argv) < 3:
         print('Please enter the registration and publication ports for this node.')
-        print("Usage: python3 daily_news_provider.py <registration port> <publication port>")
+        print("Usage: python3 daily_news_provider.py <registration port> <publication port> [<fan-out workers> "
+              "[<shard processes>]]")
         print("For example: python3 daily_news_provider.py 50414 50500")
         exit()
 
     reg_port = int(sys.argv[1])
     pub_port = int(sys.argv[2])
+    fanout_workers = int(sys.argv[3]) if len(sys.argv) > 3 else FANOUT_WORKERS
+    shards = int(sys.argv[4]) if len(sys.argv) > 4 else 0
 
-    dnp = DailyNewsPublisher(reg_port, pub_port)
-
-    threading.Thread(target=dnp.start_register_server, args=()).start()
-    threading.Thread(target=dnp.start_publication_server, args=()).start()
+    if shards > 0:
+        dnp = ShardedPublisher(reg_port, pub_port, shards)
+    else:
+        dnp = DailyNewsPublisher(reg_port, pub_port, fanout_workers)
+    dnp.serve()
 
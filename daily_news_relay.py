@@ -0,0 +1,105 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Arielle Wilson and Aacer Daken
+:Version: 1.0
+Description: Relays daily news from an upstream publisher to its own subscribers, so publishers can be arranged in a
+tree, each node only sending to its children
+"""
+
+import sys
+import threading
+
+import daily_news_provider
+import daily_news_subscriber
+import wire_codec
+
+
+class RelaySubscriber(daily_news_subscriber.DailyNewsSubscriber):
+    """
+    Upstream subscription of a relay, handing the news it gets to the relay instead of printing them
+
+    Attributes:
+        relay: DailyNewsRelay
+            relay re-publishing the news
+    """
+
+    def __init__(self, relay, my_port, pub_port, codec=wire_codec.BINARY, sources=(), keywords=()):
+        """
+        :param relay: relay re-publishing the news
+        :param my_port: port publications from upstream are received on
+        :param pub_port: registration port of the upstream publisher
+        :param codec: name of the wire codec to receive publications with
+        :param sources: news sources wanted, all sources if empty
+        :param keywords: words wanted in headlines
+        """
+
+        super().__init__(my_port, pub_port, codec, sources, keywords)
+        self.relay = relay
+
+    def consume(self, items):
+        """
+        Re-publishes a batch of news items downstream
+        :param items: list of NewsItem
+        """
+
+        self.relay.publish_batch(items)
+
+    def print_registration_confirmation(self, result):
+        """
+        Prints that registration upstream was successful
+        :param result: str
+        """
+
+        print('relay registered upstream: {}'.format(result))
+
+
+class DailyNewsRelay(daily_news_provider.DailyNewsPublisher):
+    """
+    Publisher getting its news from an upstream publisher, as a subscriber, and re-publishing them to its own
+    subscribers. Upstream publications arrive in order, with the lost ones retransmitted, and are numbered again for
+    the relay's subscribers
+
+    Attributes:
+        upstream: RelaySubscriber
+            subscription to the upstream publisher
+    """
+
+    def __init__(self, reg_port, upstream_port, listen_port, codec=wire_codec.BINARY, sources=(), keywords=(),
+                 **kwargs):
+        """
+        :param reg_port: registration port of the relay
+        :param upstream_port: registration port of the upstream publisher
+        :param listen_port: port publications from upstream are received on
+        :param codec: name of the wire codec to receive upstream publications with
+        :param sources: news sources relayed, all sources if empty
+        :param keywords: words wanted in relayed headlines
+        :param kwargs: other DailyNewsPublisher arguments
+        """
+
+        super().__init__(reg_port, 0, **kwargs)
+        self.upstream = RelaySubscriber(self, listen_port, upstream_port, codec, sources, keywords)
+
+    def serve(self):
+        """
+        Subscribes upstream, on another thread, and serves the relay's subscribers on the selector loop
+        """
+
+        threading.Thread(target=self.upstream.run, args=(), daemon=True).start()
+        super().serve()
+
+
+if __name__ == '__main__':
+    """
+    Relay driver
+    """
+
+    if len(sys.argv) < 4:
+        print('Please enter the registration port of this node, the registration port of the upstream publisher and '
+              'the port to receive its news on.')
+        print("Usage: python3 daily_news_relay.py <registration port> <upstream registration port> <listener port>")
+        print("For example: python3 daily_news_relay.py 50614 50414 50620")
+        exit()
+
+    relay = DailyNewsRelay(int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]))
+    relay.serve()
@@ -6,16 +6,46 @@ This is free and unencumbered software released into the public domain.
 Description: Subscribes to daily news from RSS feed
 """
 
-import pickle
+import json
+import os
 import socket
+import sqlite3
 import sys
+import threading
+import time
+from collections import deque
 from xml.etree.ElementTree import Element, SubElement, tostring, fromstring
 
+import transport
+import wire_codec
+
 REGISTER_ADD = ('localhost', 50414)
 BASE_PORT = 50420
 REGISTER = 'register'
 PUBLISH = 'publish'
-BUF_SZ = 4096
+PUBLISH_BATCH = 'publish_batch'
+HEARTBEAT = 'heartbeat'
+NACK = 'nack'
+RENEW_INTERVAL = 10.0   # seconds between heartbeats, well within the publisher's lease
+NACK_TIMEOUT = 0.2      # seconds to wait for retransmissions before asking again
+NACK_RETRIES = 3        # nacks sent for a gap before its publications are given up as lost
+RECONNECT_DELAY = 1.0   # seconds to wait before connecting a lost stream again
+DRAIN_MAX = 256         # max datagrams received without waiting, before the timers are looked at again
+QUEUE_SIZE = 10000      # news items waiting for the consumer, beyond which a UDP subscriber drops new ones
+CONSUMER_BATCH = 256    # max news items handed to the sink at a time
+DEDUP_SIZE = 100000     # publications last stored, checked for duplicates
+TAIL_BLOCK = 64 * 1024  # bytes read at a time from the end of the store log
+SOURCES_FLAG = '--sources'
+KEYWORDS_FLAG = '--keywords'
+SINCE_FLAG = '--since'
+TRANSPORT_FLAG = '--transport'
+CODEC_FLAG = '--codec'
+SINK_FLAG = '--sink'
+STORE_FLAG = '--store'
+FILE_SINK = 'file:'
+SQLITE_SINK = 'sqlite:'
+UDP = 'udp'
+TCP = 'tcp'
 
 
 class DailyNewsSubscriber(object):
@@ -27,35 +57,416 @@ class DailyNewsSubscriber(object):
             publishers address that subscriber sends address to
         address: tuple (host, port)
             Listener address for publications
+        codec: wire codec publications are received with
+        sources: list of str
+            news sources wanted, all sources if empty
+        keywords: list of str
+            words wanted in headlines
+        renew_interval: float
+            seconds between heartbeats renewing the subscription
+        since: int, or None
+            sequence number of the last publication received before this run, to be caught up from
+        epoch: int, or None
+            run of the publisher the sequence numbers come from
+        last_seq: int, or None
+            sequence number of the last publication delivered, None before the first one
+        pending: dict
+            publications received after a gap, by sequence number, as (previous sequence number, item)
+        gap_deadline: float, or None
+            time.monotonic() time the missing publications are asked for again, None if there is no gap
+        nack_attempts: int
+            nacks sent again for the current gap
+        nacked_seq: int
+            highest sequence number asked for so far
+        nack_count, lost_count, duplicate_count: int
+            nacks sent, sequence numbers given up as lost, and duplicate publications dropped so far
+        stream: bool
+            True to receive publications on a TCP connection to the publisher, instead of UDP datagrams
+        connection: TCP socket, or None
+            connection to the publisher of a stream subscriber, None while it isn't connected
+        sink: callable
+            takes a list of NewsItem, consume if None was given
+        queue_size: int
+            max news items waiting for the consumer
+        inbox: deque
+            news items received, waiting for the consumer, as NewsItems or xml strings
+        inbox_ready: Condition
+            guards inbox, and wakes up the consumer, or the receiver of a stream subscriber waiting for room
+        dropped_count: int
+            news items dropped because inbox was full
+        store: SubscriberStore, or None
+            record of the news items consumed, dropping duplicates and keeping the offset to resume from
     """
 
-    def __init__(self, my_port, pub_port):
+    def __init__(self, my_port, pub_port, codec=wire_codec.BINARY, sources=(), keywords=(),
+                 renew_interval=RENEW_INTERVAL, since=None, stream=False, sink=None, queue_size=QUEUE_SIZE,
+                 store=None):
         """
-        :param node_id: Id of subscriber node
+        :param my_port: port publications are received on
+        :param pub_port: registration port of the publisher
+        :param codec: name of the wire codec to receive publications with. The compatibility codec registers
+            like a legacy subscriber
+        :param sources: news sources wanted (e.g. ['Reuters', 'BBC'])
+        :param keywords: words or phrases wanted in headlines (e.g. ['election', 'New York']). With no sources and
+            no keywords, all news is received, otherwise only news from one of the sources or with one of the
+            keywords
+        :param renew_interval: seconds between heartbeats. Legacy subscribers (compatibility codec, no filters)
+            don't send heartbeats, as the publisher never expires them
+        :param since: sequence number of the last publication received, to get the publications after it the
+            publisher still holds. A subscriber registering again always asks to be caught up
+        :param stream: True to receive publications on one TCP connection to the registration port, with no size
+            limit and flow control. The subscription lasts as long as the connection, so no heartbeats are sent
+        :param sink: callable taking a list of NewsItem, called by the consumer thread with the news received, in
+            batches of up to CONSUMER_BATCH items (e.g. FileSink, SqliteSink). Prints them if None
+        :param queue_size: max news items received and waiting for the sink. Once it is reached, a UDP subscriber
+            drops new items, a stream subscriber stops reading from its connection
+        :param store: SubscriberStore the news items are recorded in once the sink took them. Publications already
+            in it are dropped as duplicates, and without since, the subscriber resumes after the last one it recorded
         """
 
+        if store is not None and since is None:
+            since = store.seq
+
         self.publisher = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.address = ('localhost', my_port)
         self.publisher_addr = ('localhost', pub_port)
+        self.codec = wire_codec.get_codec(codec, wire_codec.SUBSCRIBER_HOP)
+        self.sources = list(sources)
+        self.keywords = list(keywords)
+        self.renew_interval = renew_interval
+        self.since = since
+        self.stream = stream
+        self.connection = None
+        self.sink = sink if sink is not None else self.consume
+        self.queue_size = max(1, int(queue_size))
+        self.inbox = deque()
+        self.inbox_ready = threading.Condition()
+        self.dropped_count = 0
+        self.consumer = None
+        self.store = store
+        self.legacy = self.codec.name == wire_codec.PICKLE and len(self.sources) == 0 and len(self.keywords) == 0 \
+            and since is None and not stream
+        self.epoch = store.epoch if store is not None and since == store.seq else None
+        self.last_seq = None
+        self.pending = {}
+        self.gap_deadline = None
+        self.nack_attempts = 0
+        self.nacked_seq = 0
+        self.nack_count = 0
+        self.lost_count = 0
+        self.duplicate_count = 0
 
     def run(self):
         """
-        Register with publisher and Bind to UDP publisher socket to listen for news
+        Register with publisher and Bind to UDP publisher socket to listen for news. Sends a heartbeat every
+        renew_interval seconds, so the publisher keeps the subscription, and asks again for missing publications
+        every NACK_TIMEOUT seconds. A stream subscriber receives on its connection instead.
+
+        This thread only receives: once a datagram arrives, the ones already waiting are received too, and the news
+        items are queued for the consumer thread, which hands them to the sink
         """
 
+        self.start_consumer()
+        if self.stream:
+            return self.run_stream()
+
         self.publisher.bind(self.address)
         self.register()
+        reader = transport.DatagramReader(self.publisher)
+        next_renewal = time.monotonic() + self.renew_interval
 
         while True:
-            method, result = pickle.loads(self.publisher.recv(BUF_SZ))
-            self.handle_result(method, result)
+            timeout = None
+            if not self.legacy:
+                now = time.monotonic()
+                if now >= next_renewal:
+                    self.heartbeat()
+                    next_renewal = now + self.renew_interval
+                if self.gap_deadline is not None and now >= self.gap_deadline:
+                    self.check_gap()
+                deadline = next_renewal if self.gap_deadline is None else min(next_renewal, self.gap_deadline)
+                timeout = max(0.001, deadline - now)
+            self.publisher.settimeout(timeout)
+            try:
+                msg, publisher = reader.recv_datagram()
+            except socket.timeout:
+                continue
+            except OSError as e:
+                print('failed to receive from publisher: {}'.format(e))
+                continue
+            self.handle_datagram(msg)
+
+            #Drain the datagrams already waiting, before the kernel buffer overflows
+            self.publisher.setblocking(False)
+            for i in range(DRAIN_MAX):
+                try:
+                    msg, publisher = reader.recv_datagram()
+                except BlockingIOError:
+                    break
+                except OSError as e:
+                    print('failed to receive from publisher: {}'.format(e))
+                    continue
+                self.handle_datagram(msg)
+
+    def handle_datagram(self, msg):
+        """
+        Decodes and handles a message from the publisher. A malformed message is dropped, so it doesn't stop the
+        receiving thread
+        :param msg: bytes-like message
+        """
+
+        try:
+            args = wire_codec.decode_any(msg, wire_codec.SUBSCRIBER_HOP)[1]
+            if not isinstance(args, tuple) or len(args) < 2:
+                raise ValueError('malformed message {!r}'.format(args))
+            self.handle_message(args)
+        except (ValueError, TypeError, IndexError, KeyError) as e:
+            print('failed to receive from publisher: {}'.format(e))
+
+    def run_stream(self):
+        """
+        Connects to the publisher's registration port over TCP, registers on the connection, and receives
+        publications from it, asking again for missing publications every NACK_TIMEOUT seconds. If the connection is
+        lost, connects again after RECONNECT_DELAY seconds, and registers to be caught up from the last publication
+        received
+        """
+
+        while True:
+            try:
+                self.connection = socket.create_connection(self.publisher_addr)
+                self.register()
+                reader = transport.FrameReader(self.connection)
+                while True:
+                    if self.gap_deadline is not None and time.monotonic() >= self.gap_deadline:
+                        self.check_gap()
+                    self.connection.settimeout(
+                        None if self.gap_deadline is None else max(0.001, self.gap_deadline - time.monotonic()))
+                    try:
+                        msg = reader.recv_frame()
+                    except socket.timeout:
+                        continue
+                    if msg is None:
+                        raise transport.FrameError('Connection closed by the publisher')
+                    self.handle_datagram(msg)
+            except OSError as e:
+                print('lost stream to publisher: {}'.format(e))
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            time.sleep(RECONNECT_DELAY)
+
+    def handle_message(self, args):
+        """
+        Handles a message from the publisher
+        :param args: tuple
+            decoded message, its method first
+        """
+
+        if args[0] == PUBLISH and len(args) == 5:
+            self.receive([args[1:4]], args[4])
+        elif args[0] == REGISTER and len(args) == 4:
+            if not is_seq(args[2]):
+                raise ValueError('malformed registration {!r}'.format(args))
+            self.start(args[2], args[3])
+            self.handle_result(args[0], args[1])
+        elif args[0] == HEARTBEAT and len(args) == 4:
+            self.handle_result(args[0], args[1])
+            self.catch_up(args[2], args[3])
+        else:
+            self.handle_result(args[0], args[1])
+
+    def send_rpc(self, message):
+        """
+        Sends an rpc to the publisher, on the stream if there is one, otherwise as a datagram
+        :param message: tuple (method, request)
+        """
+
+        payload = self.codec.encode(message)
+        if self.connection is not None:
+            transport.send_frame(self.connection, payload)
+        else:
+            transport.send_datagram(self.publisher, payload, self.publisher_addr)
 
     def register(self):
         """
         RPC to publisher register
         """
 
-        self.publisher.sendto(pickle.dumps((REGISTER, self.address)), self.publisher_addr)
+        if self.legacy:
+            request = self.address
+        else:
+            request = {'address': self.address, 'codec': self.codec.name}
+            if len(self.sources) > 0:
+                request['sources'] = self.sources
+            if len(self.keywords) > 0:
+                request['keywords'] = self.keywords
+            #Ask to be caught up from the last publication received
+            since = self.last_seq if self.last_seq is not None else self.since
+            if since is not None:
+                request['since'] = since
+                if self.epoch is not None:
+                    request['epoch'] = self.epoch
+        self.send_rpc((REGISTER, request))
+
+    def heartbeat(self):
+        """
+        RPC to publisher heartbeat, renewing the subscription
+        """
+
+        request = {'address': self.address, 'codec': self.codec.name}
+        try:
+            self.send_rpc((HEARTBEAT, request))
+        except OSError as e:
+            print('failed to send heartbeat: {}'.format(e))
+
+    def nack(self, first, last):
+        """
+        RPC to publisher nack, asking for the publications from first to last again
+        :param first: int
+        :param last: int
+        """
+
+        request = {'address': self.address, 'codec': self.codec.name, 'first': first, 'last': last}
+        self.nack_count += 1
+        try:
+            self.send_rpc((NACK, request))
+        except OSError as e:
+            print('failed to send nack: {}'.format(e))
+
+    def start(self, seq, epoch):
+        """
+        Sets where publications start, from the reply to a registration
+        :param seq: int
+            sequence number of the last publication before the subscription
+        :param epoch: int
+            run of the publisher
+        """
+
+        if epoch != self.epoch:
+            self.reset(epoch)
+        if self.last_seq is None:
+            self.last_seq = seq
+
+    def reset(self, epoch):
+        """
+        Forgets the sequence numbers of a previous run of the publisher
+        :param epoch: int
+        """
+
+        self.epoch = epoch
+        self.last_seq = None
+        self.pending = {}
+        self.gap_deadline = None
+        self.nack_attempts = 0
+        self.nacked_seq = 0
+
+    def receive(self, entries, epoch):
+        """
+        Delivers sequenced publications in order. A publication whose previous sequence number wasn't delivered
+        yet is held until the missing ones are retransmitted, or given up
+        :param entries: list of (item, seq, prev)
+            publications from one datagram: the NewsItem or xml string, its sequence number, and the sequence number
+            of the previous publication sent to this subscriber
+        :param epoch: int
+            run of the publisher, a new one restarts the sequence numbers
+        """
+
+        entries = list(entries)
+        if not all(isinstance(entry, tuple) and len(entry) == 3 and is_news(entry[0]) and is_seq(entry[1]) and
+                   is_seq(entry[2]) for entry in entries):
+            raise ValueError('malformed publications {!r}'.format(entries))
+        if epoch != self.epoch:
+            self.reset(epoch)
+
+        for item, seq, prev in entries:
+            if self.last_seq is None or prev <= self.last_seq < seq:
+                self.last_seq = seq
+                self.handle_result(PUBLISH, item)
+            elif seq <= self.last_seq or seq in self.pending:
+                self.duplicate_count += 1
+            else:
+                self.pending[seq] = (prev, item)
+        self.flush_pending()
+
+    def flush_pending(self):
+        """
+        Delivers the held publications that follow the last one delivered, and asks for the ones that went missing
+        since the last nack. The ones already asked for are asked again by check_gap, if they don't come in time
+        """
+
+        delivered = False
+        while len(self.pending) > 0:
+            seq = min(self.pending)
+            prev, item = self.pending[seq]
+            if prev > self.last_seq:
+                break
+            del self.pending[seq]
+            if seq > self.last_seq:
+                self.last_seq = seq
+                self.handle_result(PUBLISH, item)
+                delivered = True
+            else:
+                self.duplicate_count += 1
+
+        if len(self.pending) == 0:
+            self.gap_deadline = None
+            self.nack_attempts = 0
+            return
+        if delivered:
+            self.gap_deadline = time.monotonic() + NACK_TIMEOUT
+            self.nack_attempts = 0
+        prev = self.pending[min(self.pending)][0]
+        if prev > self.nacked_seq:
+            self.nack(max(self.last_seq, self.nacked_seq) + 1, prev)
+            self.nacked_seq = prev
+            self.gap_deadline = time.monotonic() + NACK_TIMEOUT
+
+    def catch_up(self, seq, epoch):
+        """
+        Asks for the publications after the last one received, up to the last one the publisher sent, which were
+        lost with no later publication to reveal the gap. Asked again on every heartbeat until they come
+        :param seq: int
+            sequence number of the last publication the publisher sent to this subscriber
+        :param epoch: int
+        """
+
+        if not is_seq(seq):
+            raise ValueError('malformed heartbeat reply {!r}'.format(seq))
+        if epoch != self.epoch or self.last_seq is None:
+            return
+        received = max(self.pending, default=self.last_seq)
+        if seq > received:
+            self.nack(received + 1, seq)
+
+    def check_gap(self):
+        """
+        Asks again for the publications missing before the first held one, or gives them up as lost after
+        NACK_RETRIES more nacks
+        """
+
+        if len(self.pending) == 0:
+            self.gap_deadline = None
+            return
+        prev = self.pending[min(self.pending)][0]
+        if self.nack_attempts >= NACK_RETRIES:
+            print('gave up on publications {} to {}'.format(self.last_seq + 1, prev))
+            self.skip_to(prev)
+            return
+        self.nack_attempts += 1
+        self.gap_deadline = time.monotonic() + NACK_TIMEOUT
+        self.nack(self.last_seq + 1, prev)
+        self.nacked_seq = max(self.nacked_seq, prev)
+
+    def skip_to(self, seq):
+        """
+        Gives up the publications up to seq as lost, and delivers the held ones that follow
+        :param seq: int
+        """
+
+        if self.last_seq is not None and seq > self.last_seq:
+            self.lost_count += seq - self.last_seq
+            self.last_seq = seq
+            self.flush_pending()
 
     def handle_result(self, method, result):
         """
@@ -65,20 +476,125 @@ class DailyNewsSubscriber(object):
         """
 
         if method == PUBLISH:
-            self.parse_xml(result)  # arg1 is xml string
+            if not is_news(result):
+                raise ValueError('malformed publication {!r}'.format(result))
+            self.deliver(result)
+        elif method == PUBLISH_BATCH:
+            #Several sequenced publications packed in one datagram
+            epoch, entries = result
+            self.receive(entries, epoch)
         elif method == REGISTER:
             return self.print_registration_confirmation(result)
+        elif method == NACK:
+            #The publisher no longer holds these publications
+            if not isinstance(result, tuple) or len(result) != 2 or not is_seq(result[1]):
+                raise ValueError('malformed nack notice {!r}'.format(result))
+            print('publications {} to {} are no longer available'.format(*result))
+            self.skip_to(result[1])
+        elif method == HEARTBEAT and result == 'Unknown':
+            #The subscription expired, or the publisher restarted
+            print('subscription unknown to publisher, registering again')
+            self.register()
+
+    def deliver(self, item):
+        """
+        Queues a news item for the consumer thread. If the queue is full, a UDP subscriber drops the item, a stream
+        subscriber waits for room, which stops it reading from its connection, so the publisher holds the news.
+        With a store, publications already recorded are dropped as duplicates
+        :param item: NewsItem, or xml string
+        """
+
+        #Sequenced publications are delivered right after last_seq moved to them
+        entry = (item, self.epoch, self.last_seq)
+        if self.store is not None and self.store.recorded(self.epoch, self.last_seq):
+            self.duplicate_count += 1
+            return
+        with self.inbox_ready:
+            if len(self.inbox) >= self.queue_size:
+                if not self.stream:
+                    self.dropped_count += 1
+                    if self.dropped_count == 1 or self.dropped_count % 1000 == 0:
+                        print('news queue full, {} items dropped so far'.format(self.dropped_count))
+                    return
+                while len(self.inbox) >= self.queue_size:
+                    self.inbox_ready.wait()
+            self.inbox.append(entry)
+            if len(self.inbox) == 1:
+                self.inbox_ready.notify_all()
+
+    def start_consumer(self):
+        """
+        Starts the consumer thread, unless it runs already
+        """
+
+        if self.consumer is None:
+            self.consumer = threading.Thread(target=self.run_consumer, args=(), daemon=True)
+            self.consumer.start()
+
+    def run_consumer(self):
+        """
+        Hands the queued news items to the sink, up to CONSUMER_BATCH at a time, parsing the xml strings of the
+        compatibility codec first. The batches the sink took are recorded in the store
+        """
+
+        while True:
+            with self.inbox_ready:
+                while len(self.inbox) == 0:
+                    self.inbox_ready.wait()
+                full = len(self.inbox) >= self.queue_size
+                batch = [self.inbox.popleft() for i in range(min(len(self.inbox), CONSUMER_BATCH))]
+                if full:
+                    self.inbox_ready.notify_all()
+
+            items = []
+            entries = []
+            for item, epoch, seq in batch:
+                try:
+                    item = item if isinstance(item, wire_codec.NewsItem) else self.parse_xml(item)
+                except (ValueError, SyntaxError, IndexError) as e:
+                    print('failed to parse news {}: {}'.format(item, e))
+                    continue
+                items.append(item)
+                entries.append((item, epoch, seq))
+            try:
+                self.sink(items)
+            except Exception as e:
+                print('failed to consume {} news items: {}'.format(len(items), e))
+                continue
+            if self.store is not None:
+                try:
+                    self.store.append(entries)
+                except OSError as e:
+                    print('failed to store {} news items: {}'.format(len(entries), e))
+
+    def consume(self, items):
+        """
+        Default sink, printing news items
+        :param items: list of NewsItem
+        """
+
+        for item in items:
+            self.print_news(item)
 
     def parse_xml(self, data):
         """
         Parases xml string from publisher
         :param data: xml byte string
+        :return: NewsItem
         """
 
         root = fromstring(data)
         source = root[0].text
         headline = root[1].text
-        print('{}: {}'.format(source, headline))
+        return wire_codec.NewsItem(source, headline)
+
+    def print_news(self, item):
+        """
+        Prints a news item
+        :param item: NewsItem
+        """
+
+        print('{}: {}'.format(item.source, item.headline))
 
     def print_registration_confirmation(self, result):
         """
@@ -89,20 +605,329 @@ class DailyNewsSubscriber(object):
         print(result)
 
 
+class FileSink(object):
+    """
+    Sink appending news items to a text file, one 'source: headline' line each
+
+    Attributes:
+        path: str
+            path of the file
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, items):
+        """
+        Appends a batch of news items, with one write
+        :param items: list of NewsItem
+        """
+
+        with open(self.path, 'a', encoding='utf-8') as news_file:
+            news_file.write(''.join('{}: {}\n'.format(item.source, item.headline) for item in items))
+
+
+class SqliteSink(object):
+    """
+    Sink inserting news items into a SQLite table, one transaction per batch. The connection is opened by the
+    consumer thread, on the first batch
+
+    Attributes:
+        path: str
+            path of the database
+        table: str
+            name of the table, created if it doesn't exist
+        connection: sqlite3 Connection, or None before the first batch
+    """
+
+    def __init__(self, path, table='news'):
+        self.path = path
+        self.table = table
+        self.connection = None
+
+    def __call__(self, items):
+        """
+        Inserts a batch of news items
+        :param items: list of NewsItem
+        """
+
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS {} (id INTEGER PRIMARY KEY, source TEXT, '
+                                    'headline TEXT, received TEXT)'.format(self.table))
+        with self.connection:
+            self.connection.executemany('INSERT INTO {} (source, headline, received) VALUES (?, ?, '
+                                        'CURRENT_TIMESTAMP)'.format(self.table),
+                                        [(item.source, item.headline) for item in items])
+
+
+def is_seq(value):
+    """
+    :param value: any
+    :return: True, if value can be a sequence number
+    """
+
+    return type(value) is int and value >= 0
+
+
+def is_news(value):
+    """
+    :param value: any
+    :return: True, if value can be a news item, a NewsItem or an xml string
+    """
+
+    return isinstance(value, (wire_codec.NewsItem, str, bytes))
+
+
+class SubscriberStore(object):
+    """
+    Local append-only record of the news items a subscriber consumed, one json line each, with the epoch and
+    sequence number it was published with. A publication is identified by its epoch and sequence number, so a
+    headline published again is kept, while a publication received again, e.g. caught up after a crash, is a
+    duplicate. Duplicates are dropped against a bounded set of the most recent publications, so memory doesn't grow
+    with uptime, and unsequenced news items are never dropped. A publication is only remembered once it is written,
+    and the log and the offset are synced to disk, so an item lost before it was stored is taken again. The offset
+    file holds the last publication recorded and the length of the log then, so a restart only reads the offset and
+    the end of the log, never the whole history
+
+    Attributes:
+        path: str
+            path of the log, the offset is kept in path + '.offset'
+        dedup_size: int
+            max publications remembered
+        seen: set of tuple (epoch, seq)
+            the last dedup_size publications recorded
+        recent: deque of tuple (epoch, seq)
+            publications in seen, oldest first
+        epoch: int, or None
+            run of the publisher of the last sequenced item recorded
+        seq: int, or None
+            sequence number of the last sequenced item recorded, where the subscriber resumes
+        log: file, or None before the first append
+    """
+
+    def __init__(self, path, dedup_size=DEDUP_SIZE):
+        """
+        Opens the store, reading the offset and the end of the log
+        :param path: path of the log
+        :param dedup_size: max publications remembered to drop duplicates
+        """
+
+        self.path = path
+        self.dedup_size = max(1, int(dedup_size))
+        self.seen = set()
+        self.recent = deque()
+        self.epoch = None
+        self.seq = None
+        self.log = None
+        self.load()
+
+    def load(self):
+        """
+        Reads the offset, catches up with the records appended after it was saved, and remembers the publications
+        of the last dedup_size records. A record cut short by a crash is truncated
+        """
+
+        position = 0
+        try:
+            with open(self.offset_path(), encoding='utf-8') as offset_file:
+                offset = json.load(offset_file)
+            self.epoch, self.seq, position = offset['epoch'], offset['seq'], offset['position']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print('failed to read offset of {}: {}'.format(self.path, e))
+
+        try:
+            with open(self.path, 'rb+') as log:
+                size = log.seek(0, os.SEEK_END)
+                log.seek(min(position, size))
+                end = log.tell()
+                for line in log:
+                    if not line.endswith(b'\n'):
+                        break
+                    end += len(line)
+                    record = self.parse(line)
+                    if record is not None and record['seq'] is not None:
+                        self.epoch, self.seq = record['epoch'], record['seq']
+                if end < size:
+                    log.truncate(end)
+                for line in self.read_tail(log, end):
+                    record = self.parse(line)
+                    if record is not None and record['seq'] is not None:
+                        self.remember((record['epoch'], record['seq']))
+        except FileNotFoundError:
+            pass
+
+    def read_tail(self, log, end):
+        """
+        Reads the last dedup_size lines of the log, going back from its end one block at a time
+        :param log: log file, opened in binary
+        :param end: position of the end of the last complete line
+        :return: list of bytes
+        """
+
+        blocks = []
+        start = end
+        lines = 0
+        while start > 0 and lines <= self.dedup_size:
+            size = min(TAIL_BLOCK, start)
+            start -= size
+            log.seek(start)
+            blocks.append(log.read(size))
+            lines += blocks[-1].count(b'\n')
+        tail = b''.join(reversed(blocks)).split(b'\n')[:-1]
+        #Unless the log was read from its start, the first line read is only the end of a line
+        return tail[-self.dedup_size:] if start == 0 else tail[1:][-self.dedup_size:]
+
+    def parse(self, line):
+        """
+        Parses a record of the log
+        :param line: bytes
+        :return: dict, or None if the record is malformed
+            epoch and sequence number of the record
+        """
+
+        try:
+            record = json.loads(line)
+            return {'epoch': record['epoch'], 'seq': record['seq']}
+        except (ValueError, KeyError, TypeError) as e:
+            print('failed to read record of {}: {}'.format(self.path, e))
+            return None
+
+    def remember(self, publication):
+        """
+        Remembers a publication, forgetting the oldest one beyond dedup_size
+        :param publication: tuple (epoch, seq)
+        """
+
+        self.seen.add(publication)
+        self.recent.append(publication)
+        if len(self.recent) > self.dedup_size:
+            self.seen.discard(self.recent.popleft())
+
+    def recorded(self, epoch, seq):
+        """
+        Tells if a publication is recorded already
+        :param epoch: int, or None
+        :param seq: int, or None if the news item wasn't sequenced
+        :return: bool
+            False for an unsequenced news item
+        """
+
+        return seq is not None and (epoch, seq) in self.seen
+
+    def append(self, entries):
+        """
+        Records news items at the end of the log, syncs it, and saves the offset after them. The publications are
+        remembered once they are on disk, and the ones recorded already are skipped
+        :param entries: list of (item, epoch, seq)
+            NewsItem, with the epoch and sequence number it was published with, or None if it wasn't sequenced
+        """
+
+        entries = [(item, epoch, seq) for item, epoch, seq in entries if not self.recorded(epoch, seq)]
+        if len(entries) == 0:
+            return
+        if self.log is None:
+            self.log = open(self.path, 'ab')
+        records = []
+        for item, epoch, seq in entries:
+            records.append(json.dumps({'epoch': epoch, 'seq': seq, 'source': item.source,
+                                       'headline': item.headline}) + '\n')
+        self.log.write(''.join(records).encode('utf-8'))
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        for item, epoch, seq in entries:
+            if seq is not None:
+                self.epoch, self.seq = epoch, seq
+                self.remember((epoch, seq))
+        self.save_offset(self.log.tell())
+
+    def save_offset(self, position):
+        """
+        Replaces the offset file, in one rename, synced to disk with the directory holding it
+        :param position: int
+            length of the log up to the offset
+        """
+
+        temporary = self.offset_path() + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as offset_file:
+            json.dump({'epoch': self.epoch, 'seq': self.seq, 'position': position}, offset_file)
+            offset_file.flush()
+            os.fsync(offset_file.fileno())
+        os.replace(temporary, self.offset_path())
+        if hasattr(os, 'O_DIRECTORY'):
+            #Directories can't be opened to be synced on Windows
+            directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+    def offset_path(self):
+        """
+        :return: str
+            path of the offset file
+        """
+
+        return self.path + '.offset'
+
+
+def make_sink(spec):
+    """
+    Builds a sink from its command line spec
+    :param spec: str
+        'file:<path>' or 'sqlite:<path>'
+    :return: FileSink or SqliteSink
+    """
+
+    if spec.startswith(FILE_SINK):
+        return FileSink(spec[len(FILE_SINK):])
+    if spec.startswith(SQLITE_SINK):
+        return SqliteSink(spec[len(SQLITE_SINK):])
+    raise ValueError('Unknown sink {}'.format(spec))
+
+
 if __name__ == '__main__':
     """
     Subscriber driver that takes subscriber node id
     """
 
-    if len(sys.argv) < 3:
+    if len(sys.argv) < 3 or len(sys.argv) % 2 == 0 or \
+            any(flag not in (SOURCES_FLAG, KEYWORDS_FLAG, SINCE_FLAG, TRANSPORT_FLAG, CODEC_FLAG, SINK_FLAG,
+                             STORE_FLAG) for flag in sys.argv[3::2]) or \
+            any(not value.startswith((FILE_SINK, SQLITE_SINK)) for flag, value in zip(sys.argv[3::2], sys.argv[4::2])
+                if flag == SINK_FLAG) or \
+            any(value not in (UDP, TCP) for flag, value in zip(sys.argv[3::2], sys.argv[4::2])
+                if flag == TRANSPORT_FLAG) or \
+            any(value not in wire_codec.CODECS for flag, value in zip(sys.argv[3::2], sys.argv[4::2])
+                if flag == CODEC_FLAG):
         print('Please enter the port for this node and the port of the publisher')
-        print("Usage: python3 daily_news_subscriber.py <port of this node> <port of publisher>")
+        print("Usage: python3 daily_news_subscriber.py <port of this node> <port of publisher> "
+              "[{} <source,source,...>] [{} <word,word,...>] [{} <offset>] [{} {}|{}] [{} {}] "
+              "[{} {}<path>|{}<path>] [{} <path>]".format(SOURCES_FLAG, KEYWORDS_FLAG, SINCE_FLAG, TRANSPORT_FLAG,
+                                                          UDP, TCP, CODEC_FLAG, '|'.join(wire_codec.CODECS),
+                                                          SINK_FLAG, FILE_SINK, SQLITE_SINK, STORE_FLAG))
         print("For example: python3 daily_news_subscriber.py 50421 50414")
+        print("Or: python3 daily_news_subscriber.py 50421 50414 {} Reuters,BBC".format(SOURCES_FLAG))
         exit()
 
     my_port = int(sys.argv[1])
     pub_port = int(sys.argv[2])
+    filters = {SOURCES_FLAG: [], KEYWORDS_FLAG: [], SINCE_FLAG: [], TRANSPORT_FLAG: [UDP],
+               CODEC_FLAG: [wire_codec.BINARY], SINK_FLAG: [], STORE_FLAG: []}
+    for flag, values in zip(sys.argv[3::2], sys.argv[4::2]):
+        if flag in (SINK_FLAG, STORE_FLAG):
+            filters[flag].append(values)
+        else:
+            filters[flag].extend(value for value in values.split(',') if len(value) > 0)
+    since = int(filters[SINCE_FLAG][-1]) if len(filters[SINCE_FLAG]) > 0 else None
 
-    subscriber = DailyNewsSubscriber(my_port, pub_port)
+    subscriber = DailyNewsSubscriber(my_port, pub_port, codec=filters[CODEC_FLAG][-1],
+                                     sources=filters[SOURCES_FLAG], keywords=filters[KEYWORDS_FLAG], since=since,
+                                     stream=filters[TRANSPORT_FLAG][-1] == TCP,
+                                     sink=make_sink(filters[SINK_FLAG][-1]) if len(filters[SINK_FLAG]) > 0 else None,
+                                     store=SubscriberStore(filters[STORE_FLAG][-1]) if len(filters[STORE_FLAG]) > 0
+                                     else None)
     subscriber.run()
 
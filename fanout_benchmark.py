@@ -0,0 +1,133 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Aacer Daken and Arielle Wilson
+:Filename: fanout_benchmark.py
+:Version: 1.0
+Description: Benchmark of the publisher fan-out. Publishes one news item to a large set of subscribers, the way the
+original publisher did (a pickle.dumps, a sendto to a host name and a console line per subscriber), and with the
+FanoutEngine (one encoded frame per codec, resolved addresses, a worker pool for large sets). Then publishes through
+DailyNewsPublisher to subscribers filtering on a source, of which only a few match. Last, publishes a burst of items,
+one datagram per item, and coalesced into datagrams within the MTU budget.
+
+The subscribers are a few local UDP sockets, each standing in for many subscribers.
+
+Usage:
+    python3 fanout_benchmark.py [<number of subscribers>]
+"""
+import contextlib
+import io
+import pickle
+import socket
+import sys
+import time
+
+import daily_news_provider
+import transport
+import wire_codec
+
+SUBSCRIBERS = 10000
+SINKS = 16
+MATCHING = 0.01                 #Share of the filtered subscribers wanting the published source
+BURST = 200                     #Items in a burst
+BURST_SUBSCRIBERS = 100         #Subscribers getting the burst
+
+
+def legacy_publish(sock, xml_str, addresses) -> None:
+    """
+    Publishes an item the way DailyNewsPublisher.publish originally did
+    Args:
+        sock: UDP socket
+        xml_str: News item as an XML string
+        addresses: (host, port) addresses of the subscribers
+
+    Returns: None
+
+    """
+    for address in addresses:
+        print('publishing news to {}'.format(address))
+        sock.sendto(pickle.dumps((daily_news_provider.PUBLISH, xml_str)), address)
+
+
+def measure(name, publish) -> None:
+    """
+    Measures and prints the time of one publish, with the console output captured
+    Args:
+        name: Name of the fan-out
+        publish: Function publishing one item
+
+    Returns: None
+
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        publish()
+        elapsed = time.perf_counter() - start
+    print('{:<40} {:>10.1f}'.format(name, elapsed * 1000))
+
+
+def run(count) -> None:
+    """
+    Runs the benchmark
+    Args:
+        count: Number of subscribers
+
+    Returns: None
+
+    """
+    sinks = []
+    for i in range(SINKS):
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.bind(('localhost', 0))
+        sinks.append(sink)
+    addresses = [('localhost', sinks[i % SINKS].getsockname()[1]) for i in range(count)]
+    sockaddrs = [daily_news_provider.resolve(address) for address in addresses]
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    item = wire_codec.NewsItem('BBC', 'Elections are underway in Seattle')
+    binary = wire_codec.get_codec(wire_codec.BINARY)
+    frame = transport.encode_datagram(binary.encode((daily_news_provider.PUBLISH, item)))
+
+    print('Publishing one item to {} subscribers'.format(count))
+    print('{:<40} {:>10}'.format('fan-out', 'time (ms)'))
+    measure('original (pickle per subscriber)', lambda: legacy_publish(sock, wire_codec.to_xml(item), addresses))
+    for workers in (1, daily_news_provider.FANOUT_WORKERS):
+        engine = daily_news_provider.FanoutEngine(sock, workers)
+        measure('FanoutEngine, {} worker(s)'.format(workers), lambda: engine.fanout([([frame], sockaddrs)]))
+
+    #Filtered subscribers: a few want BBC, the others want another source each
+    with contextlib.redirect_stdout(io.StringIO()):
+        publisher = daily_news_provider.DailyNewsPublisher(0, 0, linger=0)
+        matching = max(1, int(count * MATCHING))
+        for i in range(count):
+            source = 'BBC' if i < matching else 'source{}'.format(i)
+            address = ('localhost', 1024 + i % 64000)
+            publisher.register({'address': address, 'codec': wire_codec.BINARY, 'sources': [source]})
+    measure('filtered, {} of {} matching'.format(matching, count), lambda: publisher.publish(item))
+    publisher.registration_socket.close()
+    publisher.publication_socket.close()
+
+    print('Publishing a burst of {} items to {} subscribers'.format(BURST, BURST_SUBSCRIBERS))
+    print('{:<40} {:>10} {:>10}'.format('publication', 'time (ms)', 'datagrams'))
+    items = [wire_codec.NewsItem('BBC', 'Burst headline number {}'.format(i)) for i in range(BURST)]
+    for name, budget in (('one per item', 0), ('coalesced, {} bytes'.format(daily_news_provider.DATAGRAM_BUDGET),
+                                               daily_news_provider.DATAGRAM_BUDGET)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            publisher = daily_news_provider.DailyNewsPublisher(0, 0, linger=0, datagram_budget=budget)
+            for i in range(BURST_SUBSCRIBERS):
+                address = ('localhost', sinks[i % SINKS].getsockname()[1] if i < SINKS else 1024 + i)
+                publisher.register({'address': address, 'codec': wire_codec.BINARY})
+            start = time.perf_counter()
+            publisher.publish_batch(items)
+            elapsed = time.perf_counter() - start
+        print('{:<40} {:>10.1f} {:>10}'.format(name, elapsed * 1000, publisher.stats()['datagrams']))
+        publisher.registration_socket.close()
+        publisher.publication_socket.close()
+
+    for sink in sinks:
+        sink.close()
+    sock.close()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else SUBSCRIBERS)
@@ -0,0 +1,108 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Aacer Daken and Arielle Wilson
+:Filename: host_test_automation.py
+:Version: 1.0
+Description: Test driver for the database of news_host. Runs each check against a database in a temporary directory,
+and exits with status 1 if any check fails.
+
+Usage:
+    python3 host_test_automation.py
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+import news_host
+
+TABLE_NAME = 'news'
+GOOD_POST = ('BBC', 'Elections in Egypt')
+BAD_POST = (None, 'Hurricane in Cambodia')     #Rejected by the NOT NULL constraint of news_source
+MALFORMED_POST = ('BBC',)                       #Fails to unpack, with a ValueError rather than a sqlite3.Error
+WRITE_TIMEOUT = 5.0                             #Max seconds a write may take
+
+
+def count_rows(db_name) -> int:
+    """
+    Args:
+        db_name: Path of the database
+
+    Returns: Number of rows of the news table
+
+    """
+    db_connection = sqlite3.connect(db_name)
+    count = db_connection.execute('SELECT COUNT(*) FROM {}'.format(TABLE_NAME)).fetchone()[0]
+    db_connection.close()
+    return count
+
+
+def check_mixed_batch(database) -> str:
+    """
+    A batch holding a bad post is rolled back as a whole, and the next batch is still added
+    Args:
+        database: Empty NewsHost.SqlDb
+
+    Returns: Error message, or None if the check passed
+
+    """
+    try:
+        database.add_entries([GOOD_POST, GOOD_POST, BAD_POST, GOOD_POST])
+        return 'batch with a bad post was added'
+    except sqlite3.Error:
+        pass
+    if count_rows(database.db_name) != 0:
+        return '{} rows of the failed batch were committed'.format(count_rows(database.db_name))
+    if len(database.add_entries([GOOD_POST, GOOD_POST])) != 2 or count_rows(database.db_name) != 2:
+        return 'batch after the failed batch was not added'
+    return None
+
+
+def check_writer_survives(database) -> str:
+    """
+    A write failing with an error other than a sqlite3.Error fails its caller, and the writer thread goes on with the
+    next writes
+    Args:
+        database: Empty NewsHost.SqlDb
+
+    Returns: Error message, or None if the check passed
+
+    """
+    try:
+        database.add_entries([GOOD_POST, MALFORMED_POST])
+        return 'batch with a malformed post was added'
+    except ValueError:
+        pass
+    if not database.mark_published([], wait=False).done.wait(WRITE_TIMEOUT):
+        return 'writer thread stopped after the malformed post'
+    if database.add_entry(*GOOD_POST) != 1 or count_rows(database.db_name) != 1:
+        return 'post after the malformed post was not added'
+    return None
+
+
+CHECKS = [check_mixed_batch, check_writer_survives]
+
+
+def run() -> bool:
+    """
+    Runs the checks, each with a new database
+
+    Returns: True if all checks passed
+
+    """
+    passed = True
+    with tempfile.TemporaryDirectory() as directory:
+        for index, check in enumerate(CHECKS):
+            database = news_host.NewsHost.SqlDb(os.path.join(directory, '{}.db'.format(index)), TABLE_NAME)
+            try:
+                error = check(database)
+            finally:
+                database.close()
+            print('{:<40} {}'.format(check.__name__, 'ok' if error is None else 'FAILED: ' + error))
+            passed = passed and error is None
+    return passed
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run() else 1)
@@ -0,0 +1,189 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Aacer Daken and Arielle Wilson
+:Filename: ingest_benchmark.py
+:Version: 1.0
+Description: Posting throughput of a reporter. Runs a news host, in its threaded and its asyncio mode, with a database
+in a temporary directory and no publisher, and posts news with a new connection per post, with add_post one at a
+time on the reporter's connection, with pipelined add_post requests, and with add_posts batches. Reports the posts
+per second of each.
+
+Usage:
+    python3 ingest_benchmark.py [<number of posts>]
+"""
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import news_host
+import news_reporter
+import wire_codec
+
+POSTS = 2000
+WINDOW = 64                     #Pipelined add_post requests in flight
+PUB_PORT = 51497                #Closed port standing in for the publisher, the host keeps the posts queued
+STOP_POLL = 0.05                #Seconds between two checks whether the asyncio host is to stop
+
+
+def post_connection_per_post(port, posts) -> None:
+    """
+    Posts with a new reporter, and so a new connection, per post
+    Args:
+        port: Port of the host
+        posts: List of (source, headline) tuples
+
+    Returns: None
+
+    """
+    for source, headline in posts:
+        reporter = news_reporter.Reporter(serv_port=port)
+        reporter.add_post(source, headline)
+        reporter.close()
+
+
+def post_sequential(reporter, posts) -> None:
+    """
+    Posts one at a time, waiting for each reply, on the reporter's connection
+    Args:
+        reporter: Reporter
+        posts: List of (source, headline) tuples
+
+    Returns: None
+
+    """
+    for source, headline in posts:
+        reporter.add_post(source, headline)
+
+
+def post_pipelined(reporter, posts) -> None:
+    """
+    Posts with up to WINDOW add_post requests in flight on the reporter's connection
+    Args:
+        reporter: Reporter
+        posts: List of (source, headline) tuples
+
+    Returns: None
+
+    """
+    in_flight = []
+    for source, headline in posts:
+        if len(in_flight) == WINDOW:
+            reporter.wait_reply(in_flight.pop(0))
+        in_flight.append(reporter.submit(news_reporter.Reporter.ADD_POST,
+                                         reporter.codec.wire_item(wire_codec.NewsItem(source, headline))))
+    for reply in in_flight:
+        reporter.wait_reply(reply)
+
+
+def post_batches(reporter, posts) -> None:
+    """
+    Posts with add_posts batches
+    Args:
+        reporter: Reporter
+        posts: List of (source, headline) tuples
+
+    Returns: None
+
+    """
+    ids = reporter.add_posts(posts)
+    if None in ids:
+        raise RuntimeError('{} posts not added'.format(ids.count(None)))
+
+
+def serve_threaded(host, count) -> list:
+    """
+    Measures a host in its threaded mode, and waits for its RPC workers to be done with the requests, so the host
+    has nothing left to print
+    Args:
+        host: NewsHost
+        count: Number of posts per way of posting
+
+    Returns: List of (name, posts per second) tuples
+
+    """
+    threading.Thread(target=host.listen, args=(), daemon=True).start()
+    rows = measure(host, count)
+    host.rpc_requests.join()
+    return rows
+
+
+def serve_async(host, count) -> list:
+    """
+    Measures a host in its asyncio mode, then stops its event loop, with the sender retrying the closed publisher
+    port, and waits for the loop's thread to end, so the host has nothing left to print
+    Args:
+        host: NewsHost
+        count: Number of posts per way of posting
+
+    Returns: List of (name, posts per second) tuples
+
+    """
+    stop = threading.Event()
+
+    async def serve_until_stopped():
+        serving = asyncio.create_task(host._serve_async())
+        while not stop.is_set():
+            await asyncio.sleep(STOP_POLL)
+        serving.cancel()
+
+    thread = threading.Thread(target=asyncio.run, args=(serve_until_stopped(),), daemon=True)
+    thread.start()
+    try:
+        return measure(host, count)
+    finally:
+        stop.set()
+        thread.join()
+
+
+def measure(host, count) -> list:
+    """
+    Measures the throughput of each way of posting to a host
+    Args:
+        host: NewsHost serving
+        count: Number of posts per way of posting
+
+    Returns: List of (name, posts per second) tuples
+
+    """
+    port = host.listener_addr[1]
+    rows = []
+    for name, post in (('connection per post', post_connection_per_post), ('add_post', post_sequential),
+                       ('pipelined add_post', post_pipelined), ('add_posts', post_batches)):
+        posts = [('bench', '{} {}'.format(name, i)) for i in range(count)]
+        reporter = news_reporter.Reporter(serv_port=port)
+        start = time.perf_counter()
+        post(port if post is post_connection_per_post else reporter, posts)
+        rows.append((name, count / (time.perf_counter() - start)))
+        reporter.close()
+    return rows
+
+
+def run(count) -> None:
+    """
+    Runs the benchmark
+    Args:
+        count: Number of posts per way of posting
+
+    Returns: None
+
+    """
+    print('Posting {} news posts each way'.format(count))
+    print('{:<22} {:>14} {:>14}'.format('', 'threaded /s', 'asyncio /s'))
+    results = []
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        os.chdir(directory)
+        for serve in (serve_threaded, serve_async):
+            results.append(serve(news_host.NewsHost(pub_port=PUB_PORT), count))
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    for (name, threaded), (name, asyncio_mode) in zip(*results):
+        print('{:<22} {:>14.0f} {:>14.0f}'.format(name, threaded, asyncio_mode))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else POSTS)
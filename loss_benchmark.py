@@ -0,0 +1,128 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Aacer Daken and Arielle Wilson
+:Filename: loss_benchmark.py
+:Version: 1.0
+Description: Delivery over a lossy network. Runs a publisher whose socket drops a share of the datagrams it sends
+(transport.LossySocket), publications, replies and retransmissions alike, with a sequenced subscriber, which asks
+for the missing publications with nacks, and a legacy subscriber, which doesn't. Publishes a number of news items,
+and reports how many each subscriber got, and whether in order.
+
+Also the automated check of gap detection, nacks and retransmission: exits with status 1 unless the sequenced
+subscriber got every item, once and in order.
+
+Usage:
+    python3 loss_benchmark.py [<number of items> [<loss rate>]]
+"""
+import contextlib
+import io
+import sys
+import threading
+import time
+
+import daily_news_provider
+import daily_news_subscriber
+import transport
+import wire_codec
+
+ITEMS = 2000
+LOSS_RATE = 0.05                #Share of the publications dropped
+SEED = 5520                     #Seed of the drops, so runs are repeatable
+BATCH = 10                      #Items published per fan-out
+REG_PORT = 50914                #Registration port of the publisher
+SEQUENCED_PORT = 50916          #Port of the sequenced subscriber
+LEGACY_PORT = 50917             #Port of the legacy subscriber
+SETTLE_TIMEOUT = 5.0            #Seconds to wait for the retransmissions after the last publication
+RENEW_INTERVAL = 0.5            #Seconds between heartbeats of the sequenced subscriber, replies reveal lost last items
+
+
+class CollectingSubscriber(daily_news_subscriber.DailyNewsSubscriber):
+    """
+    Subscriber keeping the headlines it gets, instead of printing them
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Constructor, see DailyNewsSubscriber"""
+        super().__init__(*args, **kwargs)
+        self.headlines = []
+
+    def print_news(self, item):
+        """
+        Keeps a news item
+        Args:
+            item: NewsItem
+        """
+        self.headlines.append(item.headline)
+
+
+def report(name, subscriber, expected) -> None:
+    """
+    Prints what a subscriber got
+    Args:
+        name: Name of the subscriber
+        subscriber: CollectingSubscriber
+        expected: Headlines published, in order
+
+    Returns: None
+
+    """
+    headlines = list(subscriber.headlines)
+    in_order = headlines == sorted(headlines, key=expected.index)
+    print('{:<12} {:>10} {:>10} {:>9} {:>8} {:>8}'.format(
+        name, len(headlines), len(expected) - len(set(headlines)), 'yes' if in_order else 'no',
+        subscriber.nack_count, subscriber.lost_count))
+
+
+def run(count, loss_rate) -> bool:
+    """
+    Runs the benchmark
+    Args:
+        count: Number of news items
+        loss_rate: Share of the publications dropped
+
+    Returns: True if the sequenced subscriber got every item, once and in order
+
+    """
+    console = sys.stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        publisher = daily_news_provider.DailyNewsPublisher(REG_PORT, 0)
+        lossy = transport.LossySocket(publisher.registration_socket, loss_rate, SEED)
+        publisher.registration_socket = publisher.fanout.sock = lossy
+        threading.Thread(target=publisher.serve, args=(), daemon=True).start()
+
+        sequenced = CollectingSubscriber(SEQUENCED_PORT, REG_PORT, wire_codec.BINARY, renew_interval=RENEW_INTERVAL)
+        legacy = CollectingSubscriber(LEGACY_PORT, REG_PORT, wire_codec.PICKLE)
+        for subscriber in (sequenced, legacy):
+            threading.Thread(target=subscriber.run, args=(), daemon=True).start()
+        while len(publisher.subscriptions) < 2:
+            time.sleep(0.01)
+
+        expected = ['headline {}'.format(i) for i in range(count)]
+        items = [wire_codec.NewsItem('BBC', headline) for headline in expected]
+        for i in range(0, count, BATCH):
+            publisher.publish_batch(items[i:i + BATCH])
+            time.sleep(0.001)
+
+        #Lost last items are only seen by the sequenced subscriber on its next heartbeat reply
+        deadline = time.monotonic() + SETTLE_TIMEOUT
+        while len(sequenced.headlines) < count and time.monotonic() < deadline:
+            time.sleep(0.1)
+        stats = publisher.stats()
+
+    print('{} items, {:.0%} loss, {} datagrams dropped, {} retransmitted'.format(
+        count, loss_rate, lossy.dropped, stats['retransmitted']), file=console)
+    print('{:<12} {:>10} {:>10} {:>9} {:>8} {:>8}'.format(
+        'subscriber', 'received', 'missing', 'in order', 'nacks', 'lost'), file=console)
+    with contextlib.redirect_stdout(console):
+        report('sequenced', sequenced, expected)
+        report('legacy', legacy, expected)
+
+    complete = sequenced.headlines == expected
+    print('sequenced delivery {}'.format('complete' if complete else 'INCOMPLETE'))
+    return complete
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run(int(sys.argv[1]) if len(sys.argv) > 1 else ITEMS,
+                      float(sys.argv[2]) if len(sys.argv) > 2 else LOSS_RATE) else 1)
@@ -9,23 +9,45 @@ Description: Host server application for submitting news posts for publishing. T
 persistent database, to store news posts, and retrieve any unpublished posts in case of failures
 
 Usage:
-    python3 news_host.py <publisher hostname> <publisher port>
+    python3 news_host.py <publisher hostname> <publisher port> [--asyncio]
     e.g: python3 news_host.py localhost 50123
+
+    --asyncio runs the listener, the reporter connections and the sender to the publisher on one asyncio event loop,
+    instead of a thread per reporter connection
 """
+import asyncio
+import collections
+import concurrent.futures
 import datetime
-import pickle
+import itertools
+import queue
 import socket
 import sqlite3
 import threading
 import time
 import sys
-import xml.etree.ElementTree
 
-DB_MUTEX = threading.Lock()     #Mutex for protecting the database, and treating it as a critical section
-QUEUE_MUTEX = threading.Lock()  #Mutex for protecting the send queue, and treating it as a critical section
-BUF_SZ = 4096                   #Buffer size for receiving messages
+import transport
+import wire_codec
+
 DB_NAME = 'lab6.db'             #Database name/path
 TABLE_NAME = 'news'             #Name of table in database hosting the news posts
+DB_WRITE_BATCH = 256            #Max number of writes grouped into a single database transaction
+DB_COMMIT_DELAY = 0.002         #Max seconds the database writer waits for more writes before committing a group
+SQL_MAX_PARAMS = 900            #Max number of parameters bound in one SQL statement
+RECOVERY_PAGE_SZ = 500          #Number of unpublished entries reloaded from the database at a time
+QUEUE_HIGH_WATERMARK = 4096     #Max number of news items held in memory before new items are spilled to the database
+QUEUE_LOW_WATERMARK = 1024      #Number of queued news items the send queue drains to before reloading spilled items
+MAX_SPILL_BACKLOG = 100000      #Number of spilled news items at which the host asks reporters to retry later
+SEND_BACKOFF_MIN = 0.1          #Initial seconds to wait before retrying, when the publisher is unreachable
+SEND_BACKOFF_MAX = 10.0         #Max seconds to wait before retrying, when the publisher is unreachable
+PUBLISH_WINDOW = 256            #Max number of news items in flight on the publisher connection
+PUBLISH_BATCH_SZ = 64           #Max number of news items carried by one publish_batch request
+PUBLISH_LINGER = 0.005          #Max seconds the sender waits for more items to fill a publish_batch request
+LISTEN_BACKLOG = 1024           #Max number of pending reporter connections in asyncio mode
+RPC_QUEUE_SZ = 4096             #Max number of tagged requests waiting for an RPC worker, beyond which reading stops
+ASYNCIO_FLAG = '--asyncio'      #Command line flag selecting the asyncio server mode
+COMPRESS_FLAG = '--compress'    #Command line flag offering the compressed binary codec to the publisher first
 
 class NewsHost(object):
     """
@@ -34,44 +56,149 @@ class NewsHost(object):
     """
 
     ADD_POST = 'add_post'       #RPC name for adding posts
+    ADD_POSTS = 'add_posts'     #RPC name for adding several posts at once
     PUBLISH = 'publish'         #RPC name for publishing posts
-    SOURCE_TAG = 'source'       #XML tag for source identification
-    Headline_TAG = 'headline'   #XML tag for headline identification
-    ROOT_TAG = 'news'           #XML tag for the root of the XML file/string
+    PUBLISH_BATCH = 'publish_batch' #RPC name for publishing several posts at once
+    STATS = 'stats'             #RPC name for querying the send queue counters
+    RETRY_LATER = 'retry_later' #add_post result when the host is saturated
+    BAD_REQUEST = 'bad request' #Result of a request that failed, e.g. on a malformed news item
 
 
-    def __init__(self, pub_addr = 'localhost', pub_port = 50500, listener_port = 0):
+    def __init__(self, pub_addr = 'localhost', pub_port = 50500, listener_port = 0,
+                 db_batch = DB_WRITE_BATCH, db_commit_delay = DB_COMMIT_DELAY, publish_window = PUBLISH_WINDOW,
+                 publish_batch = PUBLISH_BATCH_SZ, publish_linger = PUBLISH_LINGER,
+                 codecs = wire_codec.DEFAULT_CODECS, queue_high = QUEUE_HIGH_WATERMARK,
+                 queue_low = QUEUE_LOW_WATERMARK, max_backlog = MAX_SPILL_BACKLOG):
         """
         Constructor for the news_host
         Args:
             pub_addr: Hostname of publisher to be contacted for sending data
             pub_port: Port number for the publisher to be contacted for sending data
+            listener_port: Port number to listen on for reporters
+            db_batch: Max number of database writes committed together in one transaction
+            db_commit_delay: Max seconds a database write waits for others to join its transaction
+            publish_window: Max number of news items in flight on the publisher connection
+            publish_batch: Max number of news items carried by one publish_batch request
+            publish_linger: Max seconds the sender waits for more items to fill a publish_batch request
+            codecs: Wire codecs offered to the publisher, in order of preference
+            queue_high: Max number of news items held in memory before new items are spilled to the database
+            queue_low: Number of queued news items the send queue drains to before reloading spilled items
+            max_backlog: Number of spilled news items at which add_post asks reporters to retry later
         """
         self.listener, self.listener_addr = NewsHost.start_listener(port = int(listener_port))
-        self.database = self.SqlDb(DB_NAME, TABLE_NAME)
-        self.send_queue = {}
+        self.database = self.SqlDb(DB_NAME, TABLE_NAME, max_batch=db_batch, max_commit_delay=db_commit_delay)
+        self.send_queue = self.DeliveryQueue(queue_high, queue_low, max_backlog)
         self.publisher_addr = pub_addr
         self.publisher_port = int(pub_port)
+        self.publish_window = max(1, int(publish_window))
+        self.publish_batch = max(1, int(publish_batch))
+        self.publish_linger = max(0.0, float(publish_linger))
+        self.codecs = tuple(codecs)
+        self.publish_requests = {}
+        self.request_ids = itertools.count(1)
+        self.publisher_link = None
+        self.send_backoff = SEND_BACKOFF_MIN
+        self.publish_rejected = threading.Event()
+        #Tagged requests of a connection are handled concurrently by the RPC workers, so a reporter can have several
+        #of them in flight. Once RPC_QUEUE_SZ requests wait, connections stop being read until the workers catch up
+        self.rpc_requests = queue.Queue(RPC_QUEUE_SZ)
+        self.rpc_workers = []
 
     def handle_rpc(self, client) -> None:
         """
-        Handles incoming RPC calls from other nodes
+        Handles incoming RPC calls from other nodes. The connection is kept open for any number of requests, each sent
+        as a frame. A request tagged with a request ID (method, arg1, request_id) is answered with (request_id, result),
+        as soon as it is handled, so tagged requests are handled concurrently by the RPC workers. An untagged one
+        (method, arg1) is answered with the bare result, in order. While the queue of the RPC workers is full, the
+        connection isn't read, so reporters sending faster than requests are handled wait in TCP flow control.
+
+        If the first frame is a hello frame, replies use the codec negotiated with it, otherwise the compatibility
+        codec (pickle + XML). Requests of either codec are accepted
         Args:
             client: client: Client socket connection
 
         Returns: None
 
         """
+        reader = transport.FrameReader(client)
+        reply_codec = wire_codec.get_codec(wire_codec.PICKLE)
+        send_lock = threading.Lock()
+        with client:
+            while True:
+                # Receive the next message from client, and decode it
+                try:
+                    rpc = reader.recv_frame()
+                    if rpc is None:
+                        return
+                    codec = wire_codec.server_hello(client, rpc, wire_codec.REPORTER_HOP)
+                    if codec is not None:
+                        reply_codec = codec
+                        continue
+                    rpc = wire_codec.decode_any(rpc, wire_codec.REPORTER_HOP)[1]
+                    client_addr = client.getpeername()
+                except (OSError, ValueError) as excpt:
+                    print('Failed to receive RPC. {}'.format(excpt))
+                    return
+                self._print_recv_rpc(client_addr, (rpc[0], rpc[1]))
+
+                # Invoke the method for the given RPC request and send response to client
+                if len(rpc) > 2:
+                    self.rpc_requests.put((client, send_lock, reply_codec, client_addr, rpc))
+                elif not self._answer_rpc(client, send_lock, reply_codec, client_addr, rpc):
+                    return
+
+    def _run_rpc_worker(self) -> None:
+        """
+        RPC worker loop, answering the tagged requests handed over by the connections. rpc_requests.join() waits for
+        the requests queued so far to be answered
 
-        # Receive the message from client, and marshal it
-        rpc = client.recv(BUF_SZ)
-        method, arg1 = pickle.loads(rpc)
-        self._print_recv_rpc(client.getpeername(),(method, arg1))
+        Returns: None
 
-        # Invoke the method for the given RPC request and send response to client
-        result = self.dispatch_rpc(method, arg1)
-        client.sendall(pickle.dumps(result))
-        self._print_sent_rpc(client.getpeername(), result)
+        """
+        while True:
+            self._answer_rpc(*self.rpc_requests.get())
+            self.rpc_requests.task_done()
+
+    def _answer_rpc(self, client, send_lock, reply_codec, client_addr, rpc) -> bool:
+        """
+        Invokes the method for an RPC request, and sends the response to the client
+        Args:
+            client: Client socket connection
+            send_lock: Lock serializing the responses sent on the connection
+            reply_codec: Codec of the responses
+            client_addr: Address of the client
+            rpc: (method, arg1) or (method, arg1, request_id) tuple
+
+        Returns: True, if the response was sent
+
+        """
+        result = self._dispatch_safely(client_addr, rpc)
+        reply = (rpc[2], result) if len(rpc) > 2 else result
+        try:
+            with send_lock:
+                transport.send_frame(client, reply_codec.encode(reply))
+        except OSError as excpt:
+            print('Failed to send RPC response. {}'.format(excpt))
+            return False
+        self._print_sent_rpc(client_addr, reply)
+        return True
+
+    def _dispatch_safely(self, client_addr, rpc):
+        """
+        Invokes the method requested by RPC, answering a request that fails with (False, BAD_REQUEST), so a
+        malformed request neither kills the thread handling it nor leaves the client without a reply
+        Args:
+            client_addr: Address of the client
+            rpc: (method, arg1) or (method, arg1, request_id) tuple
+
+        Returns: The return value from the method, or (False, BAD_REQUEST)
+
+        """
+        try:
+            return self.dispatch_rpc(rpc[0], rpc[1])
+        except Exception as excpt:
+            print('Failed RPC {} from {}. {!r}'.format(rpc[0], client_addr, excpt))
+            return False, NewsHost.BAD_REQUEST
 
     def dispatch_rpc(self, method, arg1):
         """
@@ -86,21 +213,40 @@ class NewsHost(object):
 
         #If RPC requesting to add a new news post ('add_post')
         if method == NewsHost.ADD_POST:
-            #Extract information from XML string (news source, news headline)
-            news_src = xml.etree.ElementTree.fromstring(arg1).find(NewsHost.SOURCE_TAG).text
-            news_headline = xml.etree.ElementTree.fromstring(arg1).find(NewsHost.Headline_TAG).text
+            #Turn the post away if too many posts are waiting in the database only, the reporter retries later
+            if not self.send_queue.admit():
+                return False, NewsHost.RETRY_LATER
+
+            #Extract information from the news item (news source, news headline). Items received with the
+            #compatibility codec are XML strings, parsed once here
+            item = wire_codec.as_news_item(arg1)
 
             #Invoke the add_post method, with provided information to commit data to Database
-            result = self.add_post(news_src, news_headline)
+            result = self.add_post(item.source, item.headline)
 
-            #Add news post to send queue, to send to publisher
-            QUEUE_MUTEX.acquire()
-            self.send_queue[result[1]] = arg1
-            QUEUE_MUTEX.release()
+            #Add news post to send queue, which wakes up the sender. If the queue is full, the post stays in the
+            #database only, and the sender reloads it later
+            if not self.send_queue.put(result[1], item):
+                print('Send queue full, post {} spilled to the database'.format(result[1]))
 
             #return the result to caller
             return result
 
+        #If RPC requesting to add several news posts at once ('add_posts'), committed in one transaction
+        elif method == NewsHost.ADD_POSTS:
+            if not self.send_queue.admit():
+                return False, NewsHost.RETRY_LATER
+            items = [wire_codec.as_news_item(item) for item in arg1]
+            result = self.add_posts(items)
+            for id, item in zip(result[1], items):
+                if not self.send_queue.put(id, item):
+                    print('Send queue full, post {} spilled to the database'.format(id))
+            return result
+
+        #If RPC requesting the send queue counters ('stats')
+        elif method == NewsHost.STATS:
+            return self.stats()
+
     def add_post(self, source, news) -> (bool, int):
         """
         Adds a new news topic to the database
@@ -108,94 +254,376 @@ class NewsHost(object):
         :param news: The actual news header to be added (e.g. 'Midterm elections are underway in U.S.A.')
         :return: True, if topic is added successfully, along with ID of entry in database
         """
-        #Lock database using mutex from any modification
-        DB_MUTEX.acquire()
         # print('DEBUG: add to file {}: {}'.format(source, news))
 
-        #Add post to database, then release DB lock
+        #Add post to database. The database writer serializes and group-commits writes, so no lock is needed
         id = self.database.add_entry(source, news)
-        DB_MUTEX.release()
 
         #return entry id in DB
         return True, id
 
+    def add_posts(self, items) -> (bool, list):
+        """
+        Adds several news topics to the database, in one transaction
+        :param items: List of news items
+        :return: True, if the topics are added successfully, along with the IDs of their entries, in the same order
+        """
+        return True, self.database.add_entries([(item.source, item.headline) for item in items])
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the send queue: its depth, whether it is spilling, and how many posts were spilled,
+        reloaded, or turned away, and the bytes and time spent by the compressed codecs, by hop of the host
+        Returns: Dictionary of counters
+
+        """
+        stats = self.send_queue.stats()
+        stats['compression'] = wire_codec.compression_stats()
+        return stats
+
     def send_news(self) -> None:
         """
         Sends news in send_queue to publisher.
 
-        Send queue is appended everytime a news post is added, or on boot if there are any entries in DB that haven't
-        been published. Once published, item is removed from the queue
+        On boot, entries in DB that haven't been published are reloaded into the send queue a page at a time, as are
+        entries spilled while the send queue was full. Send queue is appended everytime a news post is added, which
+        wakes up the sender. Items are sent in ID order over one long-lived connection, in publish_batch requests of
+        up to publish_batch items, with up to publish_window items in flight. Items are removed from the queue once
+        the publisher acknowledges them. While the publisher is unreachable or rejects items, the sender backs off
+        exponentially
         Returns: None
 
         """
 
-        #Get list of unpublished entries from the database
-        unpublished_list = self.database.get_unpublished()
+        #Infinite loop that blocks until an item is queued, and sends it to publisher
+        while True:
 
-        #For each item in tha unpublished list, add to the send_queue in XML format
-        for item in unpublished_list:
-            self.send_queue[item[0]] = '<{}><{}>{}</{}><{}>{}</{}></{}>'.format(NewsHost.ROOT_TAG,
-                                                                                NewsHost.SOURCE_TAG,
-                                                                                item[1],
-                                                                                NewsHost.SOURCE_TAG,
-                                                                                NewsHost.Headline_TAG,
-                                                                                item[2],
-                                                                                NewsHost.Headline_TAG,
-                                                                                NewsHost.ROOT_TAG)
+            #Reload spilled entries a page at a time once the queue has drained, so memory use doesn't depend on the
+            #size of the backlog
+            while self.send_queue.needs_reload():
+                self._reload_page()
+
+            #Back off if the publisher rejected an item or the connection dropped
+            if self.publish_rejected.is_set():
+                time.sleep(self.send_backoff)
+                self.publish_rejected.clear()
+
+            #(Re)connect to the publisher if needed
+            if self.publisher_link is None or self.publisher_link.closed:
+                try:
+                    self.publisher_link = self.PublisherLink((self.publisher_addr, self.publisher_port),
+                                                             self._on_publish_reply, self._on_publisher_closed,
+                                                             self.codecs)
+                    self.send_backoff = SEND_BACKOFF_MIN
+                except OSError as excpt:
+                    print('Failed to connect to publisher. {}'.format(excpt))
+                    self._back_off()
+                    continue
+
+            #Block until an item is queued and the window has room, linger for more items, then send the batch
+            batch = self.send_queue.take_batch(self.publish_batch, self.publish_window, self.publish_linger)
+            if len(batch) == 0:
+                continue
+            if self.publisher_link.closed:
+                #The link was lost while the batch was taken, put it back for the next link
+                self.send_queue.requeue([id for id, item in batch])
+                continue
+            request_id, send_msg = self._next_publish_request(batch)
+            try:
+                self._print_sent_rpc(self.publisher_link.address, send_msg)
+                self.publisher_link.send(request_id, send_msg)
+            except OSError as excpt:
+                #Closing the link requeues the items in flight
+                print('Failed to send queue to publisher. {}'.format(excpt))
+                self.publisher_link.close()
+            except Exception as excpt:
+                self._drop_unencodable(request_id, batch, excpt)
 
-        #Infinite loop that checks if new items have been added to the queue, and sends them to publisher
-        while True:
+    def _reload_page(self) -> None:
+        """
+        Reads the next page of unpublished entries after the reload cursor of the send queue from the database, and
+        loads it into the send queue
+
+        Returns: None
+
+        """
+        cursor, state = self.send_queue.reload_position()
+        page = self.database.get_unpublished(cursor, RECOVERY_PAGE_SZ)
+        self.send_queue.load_page([(id, wire_codec.NewsItem(source, headline)) for id, source, headline in page],
+                                  len(page) < RECOVERY_PAGE_SZ, state)
+
+    def _next_publish_request(self, batch) -> tuple:
+        """
+        Registers a publish_batch request for a batch taken from the send queue
+        Args:
+            batch: List of (id, item) tuples
+
+        Returns: (request ID, RPC) tuple
+
+        """
+        request_id = next(self.request_ids)
+        self.publish_requests[request_id] = [id for id, item in batch]
+        return request_id, (NewsHost.PUBLISH_BATCH, [self.publisher_link.codec.wire_item(item) for id, item in batch])
+
+    def _drop_unencodable(self, request_id, batch, excpt) -> None:
+        """
+        Handles a publish_batch request that couldn't be encoded. The posts the codec can't encode would fail every
+        batch they are in, even after a restart, so they are dropped: marked as published without being sent. The
+        others are queued again
+        Args:
+            request_id: Request ID of the publish_batch request
+            batch: List of (id, item) tuples of the request
+            excpt: Exception raised encoding the request
+
+        Returns: None
+
+        """
+        self.publish_requests.pop(request_id, None)
+        codec = self.publisher_link.codec
+        dropped = []
+        for id, item in batch:
             try:
+                codec.encode((NewsHost.PUBLISH_BATCH, [codec.wire_item(item)]))
+            except Exception:
+                dropped.append(id)
+        print('Dropping posts {} that can\'t be sent to the publisher. {!r}'.format(dropped, excpt))
+        if len(dropped) > 0:
+            self.send_queue.ack(dropped)
+            write = self.database.mark_published(dropped, wait=False)
+            write.add_done_callback(lambda: self.send_queue.settle(dropped))
+        requeued = [id for id, item in batch if id not in dropped]
+        if len(requeued) > 0:
+            self.send_queue.requeue(requeued)
+
+    def _on_publish_reply(self, request_id, results) -> None:
+        """
+        Handles the publisher's reply to a publish_batch request. Runs on the publisher link's reader thread
+        Args:
+            request_id: Request ID of the publish_batch request
+            results: Publisher's response, a list holding the result of each item in the batch
 
-                #For each item in the send_queue, publish the news item to publisher
-                QUEUE_MUTEX.acquire()
-                send_queue_snapshot = self.send_queue.copy()
-                QUEUE_MUTEX.release()
-                for id, item in send_queue_snapshot.items():
-                    send_msg = (NewsHost.PUBLISH, item)
-
-                    #Create socket, then send message, and receive response
-                    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client:
-                        client.connect((self.publisher_addr, self.publisher_port))
-                        client.sendall(pickle.dumps(send_msg))
-                        self._print_sent_rpc(client.getpeername(), send_msg)
-                        recv_msg = pickle.loads(client.recv(BUF_SZ))
-                        self._print_recv_rpc(client.getpeername(), recv_msg)
-                        client.close()
-
-                        #If publisher's response is not success, then exit the loop and try again later
-                        if recv_msg is not True:
-                            break
-
-                        #If publisher's response is success, then mark the data as published in database
-                        else:
-                            DB_MUTEX.acquire()
-                            self.database.update_entry_publishing_state(id, True)
-                            DB_MUTEX.release()
-
-                            #Remove data for send_queue, so that it is not sent again in next iteration
-                            QUEUE_MUTEX.acquire()
-                            self.send_queue.pop(id)
-                            QUEUE_MUTEX.release()
+        Returns: None
 
-            except OSError as excpt:
-                print('Failed to send queue to publisher. {}'.format(excpt))
-            time.sleep(1)
+        """
+        self._print_recv_rpc(self.publisher_link.address, (request_id, results))
+        ids = self.publish_requests.pop(request_id, [])
+        if type(results) is not list or len(results) != len(ids):
+            results = [False] * len(ids)
+
+        #Remove all acknowledged items from the queue, and mark them as published in database in one transaction.
+        #The reader doesn't wait for the commit, so that acknowledgements keep flowing. The queue forgets the items
+        #once committed, so they can't be reloaded in the meantime
+        published = [id for id, result in zip(ids, results) if result is True]
+        if len(published) > 0:
+            self.send_queue.ack(published)
+            write = self.database.mark_published(published, wait=False)
+            write.add_done_callback(lambda: self.send_queue.settle(published))
+            self.send_backoff = SEND_BACKOFF_MIN
+
+        #If publisher's response is not success, put the item back in the queue and try again later
+        rejected = [id for id, result in zip(ids, results) if result is not True]
+        if len(rejected) > 0:
+            self.send_queue.requeue(rejected)
+            self._back_off()
+
+    def _on_publisher_closed(self) -> None:
+        """
+        Handles the loss of the publisher connection, by putting the items in flight back in the queue
+
+        Returns: None
+
+        """
+        self.publish_requests.clear()
+        self.send_queue.requeue_in_flight()
+        self._back_off()
+
+    def _back_off(self) -> None:
+        """
+        Makes the sender wait before its next attempt, doubling the wait every time up to SEND_BACKOFF_MAX
+
+        Returns: None
+
+        """
+        self.publish_rejected.set()
+        self.send_backoff = min(self.send_backoff * 2, SEND_BACKOFF_MAX)
 
     def listen(self) -> None:
         """
-        Dispatch loop to listen to incoming RPCs. Each RPC is forked into its own thread for processing the RPC
+        Dispatch loop to listen to incoming connections. Each connection gets its own thread, reading the requests
+        pipelined on it for as long as the reporter keeps it open (see handle_rpc). Tagged requests are answered by a
+        pool of RPC workers, started here, untagged ones by the connection's thread
 
         Returns:None
 
         """
 
-        #infinite loop listening to incoming connection requests, and forking a thread to handle incoming RPC
+        #Each blocking add_post waits on a group commit, so let up to a full group of tagged requests wait at once
+        while len(self.rpc_workers) < self.database.max_batch:
+            self.rpc_workers.append(threading.Thread(target=self._run_rpc_worker, args=(), daemon=True))
+            self.rpc_workers[-1].start()
+
+        #infinite loop listening to incoming connections, and forking a thread to handle the RPCs of each
         while True:
             client, client_addr = self.listener.accept()
             handle_thread = threading.Thread(target=self.handle_rpc, args=(client,))
             handle_thread.start()
 
+    def serve_async(self) -> None:
+        """
+        Runs the host in asyncio mode: the listener, the RPC handling of every reporter connection and the sender
+        to the publisher all run on one event loop, instead of a thread per connection. Database work that blocks
+        runs on a thread pool executor
+
+        Returns: None
+
+        """
+        asyncio.run(self._serve_async())
+
+    async def _serve_async(self) -> None:
+        """
+        Coroutine starting the asyncio server and sender
+
+        Returns: None
+
+        """
+        #Each blocking add_post waits on a group commit, so let up to a full group of them wait at once
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=self.database.max_batch))
+
+        self.listener.setblocking(False)
+        server = await asyncio.start_server(self._handle_rpc_async, sock=self.listener, backlog=LISTEN_BACKLOG)
+        sender = asyncio.create_task(self._send_news_async())
+        async with server:
+            await server.serve_forever()
+        sender.cancel()
+
+    async def _handle_rpc_async(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Handles incoming RPC calls on one reporter connection, like handle_rpc does, on the event loop
+        Args:
+            reader: asyncio StreamReader of the connection
+            writer: asyncio StreamWriter of the connection
+
+        Returns: None
+
+        """
+        client_addr = writer.get_extra_info('peername')
+        reply_codec = wire_codec.get_codec(wire_codec.PICKLE)
+        drain_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                # Receive the next message from client, and decode it
+                rpc = await transport.read_frame(reader)
+                if rpc is None:
+                    return
+                if wire_codec.is_hello(rpc):
+                    reply_codec = wire_codec.choose_codec(wire_codec.decode_hello(rpc), wire_codec.REPORTER_HOP)
+                    transport.write_frame(writer, wire_codec.encode_hello([reply_codec.name]))
+                    continue
+                rpc = wire_codec.decode_any(rpc, wire_codec.REPORTER_HOP)[1]
+                self._print_recv_rpc(client_addr, (rpc[0], rpc[1]))
+
+                # Invoke the method for the given RPC request on the executor, and send response to client. Tagged
+                # requests are answered by their own task, as soon as they are handled
+                if len(rpc) > 2:
+                    task = asyncio.create_task(
+                        self._answer_rpc_async(writer, drain_lock, reply_codec, client_addr, rpc))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                else:
+                    await self._answer_rpc_async(writer, drain_lock, reply_codec, client_addr, rpc)
+        except (OSError, ValueError) as excpt:
+            print('Failed to handle RPC. {}'.format(excpt))
+        finally:
+            if len(tasks) > 0:
+                await asyncio.wait(tasks)
+            writer.close()
+
+    async def _answer_rpc_async(self, writer: asyncio.StreamWriter, drain_lock: asyncio.Lock, reply_codec, client_addr,
+                                rpc) -> None:
+        """
+        Invokes the method for an RPC request on the executor, and sends the response to the client, like _answer_rpc
+        Args:
+            writer: asyncio StreamWriter of the connection
+            drain_lock: Lock serializing the waits for the connection to drain
+            reply_codec: Codec of the responses
+            client_addr: Address of the client
+            rpc: (method, arg1) or (method, arg1, request_id) tuple
+
+        Returns: None
+
+        """
+        result = await asyncio.get_running_loop().run_in_executor(None, self._dispatch_safely, client_addr, rpc)
+        reply = (rpc[2], result) if len(rpc) > 2 else result
+        try:
+            transport.write_frame(writer, reply_codec.encode(reply))
+            async with drain_lock:
+                await writer.drain()
+        except OSError as excpt:
+            print('Failed to send RPC response. {}'.format(excpt))
+            return
+        self._print_sent_rpc(client_addr, reply)
+
+    async def _send_news_async(self) -> None:
+        """
+        Sends news in send_queue to publisher, like send_news does, on the event loop
+
+        Returns: None
+
+        """
+        loop = asyncio.get_running_loop()
+
+        #The queue is filled from executor threads, so they wake up the sender through the event loop
+        queue_changed = asyncio.Event()
+        self.send_queue.add_listener(lambda: loop.call_soon_threadsafe(queue_changed.set))
+
+        while True:
+            #Reload spilled entries a page at a time once the queue has drained, reading the database on the executor
+            while self.send_queue.needs_reload():
+                await loop.run_in_executor(None, self._reload_page)
+
+            #Back off if the publisher rejected an item or the connection dropped
+            if self.publish_rejected.is_set():
+                await asyncio.sleep(self.send_backoff)
+                self.publish_rejected.clear()
+
+            #(Re)connect to the publisher if needed
+            if self.publisher_link is None or self.publisher_link.closed:
+                try:
+                    self.publisher_link = await self.AsyncPublisherLink.open(
+                        (self.publisher_addr, self.publisher_port), self._on_publish_reply,
+                        self._on_publisher_closed, self.codecs)
+                    self.send_backoff = SEND_BACKOFF_MIN
+                except OSError as excpt:
+                    print('Failed to connect to publisher. {}'.format(excpt))
+                    self._back_off()
+                    continue
+
+            #Linger for a batch to fill up, then take what can be sent. If nothing can, wait for the queue to change
+            queue_changed.clear()
+            if 0 < self.send_queue.pending_len() < self.publish_batch and self.publish_linger > 0:
+                await asyncio.sleep(self.publish_linger)
+            batch = self.send_queue.take_batch(self.publish_batch, self.publish_window, 0, block=False)
+            if len(batch) == 0:
+                await queue_changed.wait()
+                continue
+            if self.publisher_link.closed:
+                #The link was lost while the sender lingered, put the batch back for the next link
+                self.send_queue.requeue([id for id, item in batch])
+                continue
+
+            request_id, send_msg = self._next_publish_request(batch)
+            try:
+                self._print_sent_rpc(self.publisher_link.address, send_msg)
+                await self.publisher_link.send(request_id, send_msg)
+            except OSError as excpt:
+                #Closing the link requeues the items in flight
+                print('Failed to send queue to publisher. {}'.format(excpt))
+                await self.publisher_link.close()
+            except Exception as excpt:
+                self._drop_unencodable(request_id, batch, excpt)
+
     @staticmethod
     def start_listener(host = 'localhost', port = 0):
         """
@@ -212,6 +640,8 @@ class NewsHost(object):
 
         #Create TCP/IP socket, bind socket to host and port, then start listening
         srv_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        #Reporters keep their connections open, so a host restarting after a crash finds its port in TIME_WAIT
+        srv_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         srv_socket.bind((host, port))
         srv_socket.listen()
 
@@ -250,19 +680,561 @@ class NewsHost(object):
         """Helper method to print the current timestamp"""
         return datetime.datetime.now().strftime('%H:%M:%S.%f')
 
+    class DeliveryQueue(object):
+        """
+        Bounded window of news items waiting to be sent to the publisher. Putting an item wakes up a waiting sender.
+
+        Items taken by the sender stay in flight until they are acknowledged, or requeued at the front of the queue.
+
+        Every item is stored in the database before it is put, so the window is bounded by spilling: once
+        high_watermark items are queued or in flight, new items are only kept in the database. The sender reloads them
+        lazily, a page at a time in ID order, whenever the queue has drained to low_watermark, until it has caught up
+        with the database. The queue starts out spilling, so entries left unpublished before a boot are reloaded the
+        same way. Reloaded items are held in their own lane, and the lane holding the lowest ID is served first
+        """
+        LIVE = 'live'               #New items are queued
+        SPILLING = 'spilling'       #New items are left in the database, to be reloaded
+        CATCHING_UP = 'catching_up' #New items are queued, while the last spilled items are reloaded
+
+        def __init__(self, high_watermark = QUEUE_HIGH_WATERMARK, low_watermark = QUEUE_LOW_WATERMARK,
+                     max_backlog = MAX_SPILL_BACKLOG):
+            """
+            Constructor
+            Args:
+                high_watermark: Max number of items queued or in flight before new items are spilled
+                low_watermark: Number of queued items the queue drains to before spilled items are reloaded
+                max_backlog: Number of spilled items not reloaded yet at which new posts are turned away
+            """
+            self.high_watermark = max(1, int(high_watermark))
+            self.low_watermark = min(max(0, int(low_watermark)), self.high_watermark - 1)
+            self.max_backlog = max(1, int(max_backlog))
+            self.items = collections.deque()
+            self.reloaded = collections.deque()
+            self.in_flight = collections.OrderedDict()
+            self.settling = set()       #IDs of acknowledged items, until they are committed as published
+            self.known = set()          #IDs of all items held: queued, in flight or settling
+            self.state = self.SPILLING
+            self.reload_cursor = 0      #Every unpublished entry up to this ID is held, or was reloaded
+            self.settled_in_read = None #IDs settled while a page is being read, so they aren't reloaded
+            self.spill_backlog = 0      #Number of spilled items not reloaded yet
+            self.spilled_count = 0
+            self.reloaded_count = 0
+            self.turned_away_count = 0
+            self.ready = threading.Condition()
+            self.listeners = []
+
+        def add_listener(self, listener) -> None:
+            """
+            Registers a function called, with the queue locked, whenever the queue changes. Lets a sender that
+            can't block on the condition, e.g. one running on an event loop, be woken up
+            Args:
+                listener: Function taking no arguments, which must not block
+
+            Returns: None
+
+            """
+            with self.ready:
+                self.listeners.append(listener)
+
+        def _notify(self) -> None:
+            """Wakes up the senders waiting on the queue. Called with the queue locked"""
+            self.ready.notify_all()
+            for listener in self.listeners:
+                listener()
+
+        def admit(self) -> bool:
+            """
+            Tells whether a new post can be accepted, i.e. the backlog of spilled items is below max_backlog. Posts
+            turned away are counted
+
+            Returns: True, if the post can be accepted
+
+            """
+            with self.ready:
+                if self.spill_backlog < self.max_backlog:
+                    return True
+                self.turned_away_count += 1
+                return False
+
+        def put(self, id, item) -> bool:
+            """
+            Appends an item to the queue, and wakes up the sender. If the window is full, the item is spilled instead:
+            it is left in the database, to be reloaded later
+            Args:
+                id: ID of the item in the database
+                item: The news item
+
+            Returns: True, if the item was queued, or False if it was spilled
+
+            """
+            with self.ready:
+                #Already held, or already covered by a read of the database
+                if id in self.known or id <= self.reload_cursor:
+                    return True
+                if self.state != self.SPILLING and len(self) >= self.high_watermark:
+                    self.state = self.SPILLING
+                    self._notify()
+                if self.state == self.SPILLING:
+                    self.spilled_count += 1
+                    self.spill_backlog += 1
+                    return False
+                self.items.append((id, item))
+                self.known.add(id)
+                self._notify()
+                return True
+
+        def needs_reload(self) -> bool:
+            """Tells whether the sender should reload the next page of spilled items from the database"""
+            return self.state != self.LIVE and self.pending_len() <= self.low_watermark
+
+        def reload_position(self) -> tuple:
+            """
+            Starts reading a page of spilled items
+            Returns: (cursor, state) tuple, the ID after which the next page of spilled items is read, and the state
+            of the queue when the read starts
+            """
+            with self.ready:
+                self.settled_in_read = set()
+                return self.reload_cursor, self.state
+
+        def load_page(self, page, exhausted, read_state) -> None:
+            """
+            Appends a page of items read from the database to the reload lane, skipping the items already held. Once
+            a read finds no more items, a spilling queue starts catching up, i.e. queueing new items again, and a
+            catching up queue goes live. One more read is needed to go live, as items may have been spilled between
+            the last read and the change of state
+            Args:
+                page: List of (id, item) tuples, in ID order, read after the reload cursor
+                exhausted: True, if the read returned fewer items than a page
+                read_state: State of the queue when the read started
+
+            Returns: None
+
+            """
+            with self.ready:
+                settled, self.settled_in_read = self.settled_in_read or set(), None
+                for id, item in page:
+                    if id in self.known or id in settled:
+                        continue
+                    self.reloaded.append((id, item))
+                    self.known.add(id)
+                    self.reloaded_count += 1
+                    self.spill_backlog = max(0, self.spill_backlog - 1)
+                if len(page) > 0:
+                    self.reload_cursor = page[-1][0]
+                if exhausted and self.state == read_state:
+                    self.state = self.CATCHING_UP if read_state == self.SPILLING else self.LIVE
+                self._notify()
+
+        def take_batch(self, max_items, max_in_flight, linger, block = True) -> list:
+            """
+            Blocks until the queue isn't empty and fewer than max_in_flight items are in flight, waits up to linger
+            seconds for max_items items to be queued, then moves up to max_items items from the head of the queue in
+            flight. Returns early if spilled items need to be reloaded
+            Args:
+                max_items: Max number of items taken
+                max_in_flight: Max number of items in flight
+                linger: Max seconds to wait for more items
+                block: If False, neither block nor linger, and return an empty list if no item can be taken
+
+            Returns: List of (id, item) tuples taken, in queue order
+
+            """
+            with self.ready:
+                if block:
+                    self.ready.wait_for(lambda: (self.pending_len() > 0 and len(self.in_flight) < max_in_flight) or
+                                        self.needs_reload())
+                else:
+                    linger = 0
+
+                #Linger for the batch to fill up
+                deadline = time.monotonic() + linger
+                while self.pending_len() < max_items and not self.needs_reload():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.ready.wait(remaining)
+
+                batch = []
+                while len(batch) < max_items and self.pending_len() > 0 and len(self.in_flight) < max_in_flight:
+                    lane = self._next_lane()
+                    id, item = lane.popleft()
+                    self.in_flight[id] = (item, lane)
+                    batch.append((id, item))
+                return batch
+
+        def _next_lane(self):
+            """Returns the lane whose head has the lowest ID, among the lanes that aren't empty"""
+            if len(self.reloaded) == 0:
+                return self.items
+            if len(self.items) == 0 or self.reloaded[0][0] < self.items[0][0]:
+                return self.reloaded
+            return self.items
+
+        def ack(self, ids) -> None:
+            """
+            Removes acknowledged items from the items in flight. They are still held, so that they aren't reloaded,
+            until settle is called once they are committed as published
+            Args:
+                ids: IDs of the items
+
+            Returns: None
+
+            """
+            with self.ready:
+                for id in ids:
+                    if self.in_flight.pop(id, None) is not None:
+                        self.settling.add(id)
+                self._notify()
+
+        def settle(self, ids) -> None:
+            """
+            Forgets acknowledged items, once they are committed as published
+            Args:
+                ids: IDs of the items
+
+            Returns: None
+
+            """
+            with self.ready:
+                for id in ids:
+                    if id in self.settling:
+                        self.settling.remove(id)
+                        self.known.discard(id)
+                        if self.settled_in_read is not None:
+                            self.settled_in_read.add(id)
+
+        def requeue(self, ids) -> None:
+            """
+            Puts items in flight back in the queue, each ahead of every queued item with a greater ID
+            Args:
+                ids: IDs of the items
+
+            Returns: None
+
+            """
+            with self.ready:
+                for id in ids:
+                    if id not in self.in_flight:
+                        continue
+                    item, lane = self.in_flight.pop(id)
+                    position = 0
+                    while position < len(lane) and lane[position][0] < id:
+                        position += 1
+                    lane.insert(position, (id, item))
+                self._notify()
+
+        def requeue_in_flight(self) -> None:
+            """
+            Puts all items in flight back at the front of the queue, in their original order
+
+            Returns: None
+
+            """
+            with self.ready:
+                while len(self.in_flight) > 0:
+                    id, (item, lane) = self.in_flight.popitem(last=True)
+                    lane.appendleft((id, item))
+                self._notify()
+
+        def pending_len(self) -> int:
+            """Number of items waiting to be taken"""
+            return len(self.items) + len(self.reloaded)
+
+        def stats(self) -> dict:
+            """
+            Returns: Dictionary of the queue depth, the state of the queue, and the spill counters
+            """
+            with self.ready:
+                return {'queued': self.pending_len(),
+                        'in_flight': len(self.in_flight),
+                        'state': self.state,
+                        'high_watermark': self.high_watermark,
+                        'low_watermark': self.low_watermark,
+                        'spilled': self.spilled_count,
+                        'reloaded': self.reloaded_count,
+                        'spill_backlog': self.spill_backlog,
+                        'turned_away': self.turned_away_count}
+
+        def __len__(self):
+            """Number of items waiting in the queue or in flight"""
+            return len(self.items) + len(self.reloaded) + len(self.in_flight)
+
+    class PublisherLink(object):
+        """
+        Long-lived connection to the publisher, carrying pipelined RPC requests. Each request is tagged with a
+        request ID, and a reader thread matches the publisher's replies to requests by that ID
+        """
+        def __init__(self, address, on_reply, on_closed, codecs = wire_codec.DEFAULT_CODECS):
+            """
+            Constructor, connects to the publisher, negotiates the wire codec and starts the reader thread
+            Args:
+                address: (host, port) of the publisher
+                on_reply: Function called as on_reply(request_id, result) for every reply
+                on_closed: Function called once the connection is lost or closed
+                codecs: Wire codecs offered to the publisher, in order of preference
+            """
+            self.address = address
+            self.on_reply = on_reply
+            self.on_closed = on_closed
+            self.closed = False
+            self.sock = socket.create_connection(address)
+            self.frame_reader = transport.FrameReader(self.sock)
+            try:
+                self.codec = wire_codec.client_hello(self.sock, self.frame_reader, codecs, wire_codec.PUBLISHER_HOP)
+            except OSError:
+                self.sock.close()
+                raise
+            self.reader = threading.Thread(target=self._read_loop, args=(), daemon=True)
+            self.reader.start()
+
+        def send(self, request_id, rpc) -> None:
+            """
+            Sends an RPC request without waiting for the reply
+            Args:
+                request_id: ID the reply will be tagged with
+                rpc: (method, arg1) tuple
+
+            Returns: None
+
+            """
+            method, arg1 = rpc
+            transport.send_frame(self.sock, self.codec.encode((method, arg1, request_id)))
+
+        def close(self) -> None:
+            """
+            Closes the connection, and waits until the reader thread has handled the closing
+
+            Returns: None
+
+            """
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            if threading.current_thread() is not self.reader:
+                self.reader.join()
+
+        def _read_loop(self) -> None:
+            """
+            Reader thread loop, passing each reply to on_reply until the connection is lost
+
+            Returns: None
+
+            """
+            try:
+                while True:
+                    reply = self.frame_reader.recv_frame()
+                    if reply is None:
+                        print('Connection to publisher closed')
+                        return
+                    request_id, result = wire_codec.decode_any(reply, wire_codec.PUBLISHER_HOP)[1]
+                    self.on_reply(request_id, result)
+            except (OSError, ValueError) as excpt:
+                print('Connection to publisher closed. {}'.format(excpt))
+            finally:
+                #Mark the link closed before the owner requeues the requests in flight, so the sender can't take the
+                #requeued items and send them on the dead link
+                self.closed = True
+                self.sock.close()
+                self.on_closed()
+
+    class AsyncPublisherLink(object):
+        """
+        asyncio version of PublisherLink: a long-lived, pipelined connection to the publisher, whose replies are read
+        by a task on the event loop
+        """
+        def __init__(self, address, on_reply, on_closed, reader, writer, codec):
+            """
+            Constructor. Use AsyncPublisherLink.open to connect
+            Args:
+                address: (host, port) of the publisher
+                on_reply: Function called as on_reply(request_id, result) for every reply
+                on_closed: Function called once the connection is lost or closed
+                reader: asyncio StreamReader of the connection
+                writer: asyncio StreamWriter of the connection
+                codec: Wire codec negotiated with the publisher
+            """
+            self.address = address
+            self.on_reply = on_reply
+            self.on_closed = on_closed
+            self.reader = reader
+            self.writer = writer
+            self.codec = codec
+            self.closed = False
+            self.reader_task = asyncio.create_task(self._read_loop())
+
+        @classmethod
+        async def open(cls, address, on_reply, on_closed, codecs = wire_codec.DEFAULT_CODECS):
+            """
+            Connects to the publisher and negotiates the wire codec
+            Args:
+                address: (host, port) of the publisher
+                on_reply: Function called as on_reply(request_id, result) for every reply
+                on_closed: Function called once the connection is lost or closed
+                codecs: Wire codecs offered to the publisher, in order of preference
+
+            Returns: The connected AsyncPublisherLink
+
+            """
+            reader, writer = await asyncio.open_connection(*address)
+            try:
+                codec = wire_codec.get_codec(wire_codec.PICKLE)
+                if list(codecs) != [wire_codec.PICKLE]:
+                    transport.write_frame(writer, wire_codec.encode_hello(codecs))
+                    reply = await transport.read_frame(reader)
+                    if reply is None or not wire_codec.is_hello(reply):
+                        raise transport.FrameError('Codec negotiation failed')
+                    codec = wire_codec.choose_codec(wire_codec.decode_hello(reply), wire_codec.PUBLISHER_HOP)
+            except OSError:
+                writer.close()
+                raise
+            return cls(address, on_reply, on_closed, reader, writer, codec)
+
+        async def send(self, request_id, rpc) -> None:
+            """
+            Sends an RPC request without waiting for the reply
+            Args:
+                request_id: ID the reply will be tagged with
+                rpc: (method, arg1) tuple
+
+            Returns: None
+
+            """
+            method, arg1 = rpc
+            transport.write_frame(self.writer, self.codec.encode((method, arg1, request_id)))
+            await self.writer.drain()
+
+        async def close(self) -> None:
+            """
+            Closes the connection, and waits until the reader task has handled the closing
+
+            Returns: None
+
+            """
+            self.writer.close()
+            await asyncio.gather(self.reader_task, return_exceptions=True)
+
+        async def _read_loop(self) -> None:
+            """
+            Reader task, passing each reply to on_reply until the connection is lost
+
+            Returns: None
+
+            """
+            try:
+                while True:
+                    reply = await transport.read_frame(self.reader)
+                    if reply is None:
+                        print('Connection to publisher closed')
+                        return
+                    request_id, result = wire_codec.decode_any(reply, wire_codec.PUBLISHER_HOP)[1]
+                    self.on_reply(request_id, result)
+            except (OSError, ValueError) as excpt:
+                print('Connection to publisher closed. {}'.format(excpt))
+            finally:
+                #Mark the link closed before the owner requeues the requests in flight, so the sender can't take the
+                #requeued items and send them on the dead link
+                self.closed = True
+                self.writer.close()
+                self.on_closed()
+
     class SqlDb(object):
         """
         SQLite Database object
+
+        All writes are handed to a single writer thread, which owns one persistent connection to the database (in
+        WAL mode), and commits the pending writes in groups, so that many writes share a single transaction/fsync
         """
-        def __init__(self, db_name, table_name):
+        def __init__(self, db_name, table_name, max_batch = DB_WRITE_BATCH, max_commit_delay = DB_COMMIT_DELAY):
             """
             Constructor
             Args:
                 db_name: Name of DB to be created/accessed
                 table_name: Name of table to be created/accessed
+                max_batch: Max number of writes committed together in one transaction
+                max_commit_delay: Max seconds the writer waits for more writes before committing a group
             """
             self.db_name = db_name
             self.table_name = table_name
+            self.max_batch = max(1, int(max_batch))
+            self.max_commit_delay = max(0.0, float(max_commit_delay))
+            self.write_queue = queue.Queue()
+
+            #Switch the database to WAL mode, so readers don't block the writer, then create or migrate the table once
+            db_connection = self.start_db_connection()
+            db_connection.execute('PRAGMA journal_mode=WAL')
+            db_cursor = db_connection.cursor()
+            self.create_table(db_cursor)
+            db_connection.commit()
+            self.migrate_table(db_cursor)
+            self.create_unpublished_index(db_cursor)
+            db_connection.commit()
+            db_cursor.close()
+            db_connection.close()
+
+            #Start the writer thread that owns the write connection
+            self.writer = threading.Thread(target=self._write_loop, args=(), daemon=True)
+            self.writer.start()
+
+        class PendingWrite(object):
+            """
+            A write waiting for the database writer thread. The caller blocks on wait() until the group holding the
+            write has been committed
+            """
+            def __init__(self, operation, args):
+                """
+                Constructor
+                Args:
+                    operation: Function to be run by the writer, called as operation(cursor, *args)
+                    args: Arguments of the operation
+                """
+                self.operation = operation
+                self.args = args
+                self.result = None
+                self.error = None
+                self.done = threading.Event()
+                self.callbacks = []
+                self.lock = threading.Lock()
+
+            def wait(self):
+                """
+                Blocks until the write is committed
+                Returns: The return value of the operation
+                """
+                self.done.wait()
+                if self.error is not None:
+                    raise self.error
+                return self.result
+
+            def add_done_callback(self, callback) -> None:
+                """
+                Registers a function called once the write is committed (or failed), on the writer thread. It is
+                called right away if the write is already done
+                Args:
+                    callback: Function taking no arguments
+
+                Returns: None
+
+                """
+                with self.lock:
+                    if not self.done.is_set():
+                        self.callbacks.append(callback)
+                        return
+                callback()
+
+            def finish(self) -> None:
+                """
+                Wakes up the caller waiting on the write, and runs the registered callbacks. Called by the writer thread
+
+                Returns: None
+
+                """
+                with self.lock:
+                    self.done.set()
+                    callbacks, self.callbacks = self.callbacks, []
+                for callback in callbacks:
+                    callback()
 
         def create_table(self, cursor: sqlite3.Cursor):
             """
@@ -274,14 +1246,52 @@ class NewsHost(object):
 
             """
             db_cursor = cursor
-            command = """ CREATE TABLE IF NOT EXISTS {} (
-                                            id int PRIMARY KEY NOT NULL,
-                                            news_source text NOT NULL,
-                                            news_header text NOT NULL,
-                                            event_time datetime NOT NULL,
-                                            is_published int NOT NULL
-                                        );""".format(self.table_name)
-            db_cursor.execute(command)
+            db_cursor.execute(self._create_table_command())
+
+        def migrate_table(self, cursor: sqlite3.Cursor):
+            """
+            Migrates a table created by older versions, where IDs were computed by the application (an 'int' primary
+            key), to a table where SQLite assigns the IDs (an 'INTEGER PRIMARY KEY', i.e. an alias of the rowid).
+            Existing IDs are preserved
+            Args:
+                cursor: Cursor object to be used in executing the SQL commands
+
+            Returns: None
+
+            """
+            db_cursor = cursor
+
+            #Nothing to do if the id column is already the rowid alias
+            columns = db_cursor.execute('PRAGMA table_info({})'.format(self.table_name)).fetchall()
+            id_type = [column[2] for column in columns if column[1] == 'id'][0]
+            if id_type.upper() == 'INTEGER':
+                return
+
+            #Copy the rows to a new table, all within a single transaction
+            print('Migrating table {} to database assigned IDs'.format(self.table_name))
+            old_table = '{}_old'.format(self.table_name)
+            db_cursor.executescript("""BEGIN;
+                                       ALTER TABLE {0} RENAME TO {1};
+                                       {2};
+                                       INSERT INTO {0} (id, news_source, news_header, event_time, is_published)
+                                            SELECT id, news_source, news_header, event_time, is_published FROM {1};
+                                       DROP TABLE {1};
+                                       COMMIT;""".format(self.table_name, old_table,
+                                                         self._create_table_command()))
+
+        def create_unpublished_index(self, cursor: sqlite3.Cursor):
+            """
+            Creates a partial index, if it doesn't exist, covering only the unpublished entries. The index stays as
+            small as the publishing backlog, and lets recovery find unpublished entries without a table scan
+            Args:
+                cursor: Cursor object to be used in executing the SQL command
+
+            Returns: None
+
+            """
+            command = 'CREATE INDEX IF NOT EXISTS {}_unpublished ON {} (id) WHERE is_published = 0'.format(
+                self.table_name, self.table_name)
+            cursor.execute(command)
 
         def add_entry(self, news_src, news_header) -> int:
             """
@@ -293,81 +1303,208 @@ class NewsHost(object):
             Returns: ID of the new entry created
 
             """
+            #Hand the insert to the writer thread, and block until it is committed
+            return self._submit(self._insert_entry, news_src, news_header).wait()
 
-            #Create connection and cursor for the database
-            db_connection = self.start_db_connection()
-            db_cursor = db_connection.cursor()
+        def add_entries(self, entries: list) -> list:
+            """
+            Adds several entries to the database, committed together
+            Args:
+                entries: List of (news source, news headline) tuples
 
-            #Create the table to be used
-            self.create_table(db_cursor)
+            Returns: List of IDs of the new entries created, in the same order as the entries
+
+            """
+            return self._submit(self._insert_entries, entries).wait()
+
+        def mark_published(self, ids: list, wait = True):
+            """
+            Marks several entries as published, in one transaction
+            Args:
+                ids: IDs of entries to be marked published
+                wait: If True, block until the update is committed
+
+            Returns: PendingWrite object of the update
+
+            """
+            write = self._submit(self._mark_published, list(ids))
+            if wait:
+                write.wait()
+            return write
+
+        def close(self) -> None:
+            """
+            Commits any pending writes and stops the writer thread
+
+            Returns: None
+
+            """
+            self.write_queue.put(None)
+            self.writer.join()
+
+        def _submit(self, operation, *args):
+            """
+            Queues a write for the writer thread
+            Args:
+                operation: Function to be run by the writer, called as operation(cursor, *args)
+                args: Arguments of the operation
+
+            Returns: PendingWrite object to wait on
+
+            """
+            write = self.PendingWrite(operation, args)
+            self.write_queue.put(write)
+            return write
 
-            #Query database to get the last ID used. If none, then next ID is 1, otherwise next ID is current ID + 1
-            command = ' SELECT id FROM {} WHERE id >= (SELECT MAX(id) FROM {})'.format(self.table_name, self.table_name)
-            id_list = db_cursor.execute(command).fetchall()
-            # print(id_list, len(id_list))
-            if len(id_list) == 0:
-                id = 1
-            else:
-                id = int(id_list[0][0]) + 1
+        def _create_table_command(self) -> str:
+            """
+            Returns: SQL command creating the news table, if it doesn't exist
+            """
+            return """ CREATE TABLE IF NOT EXISTS {} (
+                                            id INTEGER PRIMARY KEY,
+                                            news_source text NOT NULL,
+                                            news_header text NOT NULL,
+                                            event_time datetime NOT NULL,
+                                            is_published int NOT NULL
+                                        )""".format(self.table_name)
 
+        def _insert_entry(self, db_cursor: sqlite3.Cursor, news_src, news_header) -> int:
+            """
+            Inserts an entry into the table. Runs on the writer thread
+            Args:
+                db_cursor: Cursor of the writer connection
+                news_src: information to be added to the news source column
+                news_header: information to be added to the news headline column
 
-            #Insert data into the database
-            command = 'INSERT INTO {} VALUES(?, ?, ?, ?, ?)'.format(self.table_name)
-            data = (id, news_src, news_header, datetime.datetime.now(), False)
+            Returns: ID of the new entry created
+
+            """
+            #Insert data into the database, SQLite assigns the next ID (rowid)
+            command = 'INSERT INTO {} (news_source, news_header, event_time, is_published) ' \
+                      'VALUES(?, ?, ?, ?)'.format(self.table_name)
+            data = (news_src, news_header, datetime.datetime.now(), False)
             db_cursor.execute(command, data)
-            # print(db_cursor.execute('SELECT * FROM news').fetchall())
+            return db_cursor.lastrowid
 
-            #Commit DB changes and close connection
-            db_connection.commit()
-            db_cursor.close()
-            db_connection.close()
+        def _insert_entries(self, db_cursor: sqlite3.Cursor, entries: list) -> list:
+            """
+            Inserts several entries into the table. Runs on the writer thread
+            Args:
+                db_cursor: Cursor of the writer connection
+                entries: List of (news source, news headline) tuples
 
-            #Return the id of the newly created entry
-            return id
+            Returns: List of IDs of the new entries created
 
-        def update_entry_publishing_state(self, id: int, state: bool) -> None:
             """
-            Updates the state of 'is_published' of an entry in the DB table
+            return [self._insert_entry(db_cursor, news_src, news_header) for news_src, news_header in entries]
+
+        def _mark_published(self, db_cursor: sqlite3.Cursor, ids: list) -> None:
+            """
+            Marks several entries as published, with UPDATE ... WHERE id IN (...). Runs on the writer thread
             Args:
-                id: ID of entry to be modified
-                state: The requested state of the entry
+                db_cursor: Cursor of the writer connection
+                ids: IDs of entries to be marked published
 
             Returns: None
 
             """
+            #Stay below SQLite's limit on the number of host parameters in one statement
+            for start in range(0, len(ids), SQL_MAX_PARAMS):
+                chunk = ids[start:start + SQL_MAX_PARAMS]
+                command = 'UPDATE {} SET is_published = 1 WHERE id IN ({})'.format(self.table_name,
+                                                                                  ', '.join('?' * len(chunk)))
+                db_cursor.execute(command, chunk)
+
+        def _write_loop(self) -> None:
+            """
+            Writer thread loop. Waits for a write, gathers more writes until the batch is full or the commit delay
+            expires, then runs all of them in a single transaction
 
-            #Create connection and cursor for the db file
+            Returns: None
+
+            """
+            #The write connection is created here, as a SQLite connection may only be used by the thread creating it
             db_connection = self.start_db_connection()
-            db_cursor = db_connection.cursor()
+            stopping = False
+            while not stopping:
+                write = self.write_queue.get()
+                if write is None:
+                    break
+                group = [write]
+
+                #Gather more writes for the same transaction
+                deadline = time.monotonic() + self.max_commit_delay
+                while len(group) < self.max_batch:
+                    try:
+                        write = self.write_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if write is None:
+                        stopping = True
+                        break
+                    group.append(write)
+
+                self._commit_group(db_connection, group)
+            db_connection.close()
 
-            #Execute update command for the given item
-            command = 'UPDATE {} SET is_published = ? WHERE id = ?'.format(self.table_name)
-            data = (state, id)
-            db_cursor.execute(command, data)
-            # print(db_cursor.execute('SELECT * FROM news').fetchall())
+        def _commit_group(self, db_connection: sqlite3.Connection, group: list) -> None:
+            """
+            Runs a group of writes in one transaction, and wakes up their callers
+            Args:
+                db_connection: The writer connection
+                group: List of PendingWrite objects
 
-            #Commit changes and close connection
-            db_connection.commit()
-            db_cursor.close()
-            db_connection.close()
+            Returns: None
 
-        def get_unpublished(self) -> list:
             """
-            Queries for all unpublished items stored in the database
+            db_cursor = db_connection.cursor()
+            try:
+                #Each write runs in a savepoint of the group's transaction. A failing write is rolled back as a whole,
+                #e.g. all of an add_entries batch, and only fails its own caller, the rest of the group is committed
+                if not db_connection.in_transaction:
+                    db_cursor.execute('BEGIN')
+                for write in group:
+                    db_cursor.execute('SAVEPOINT write')
+                    try:
+                        write.result = write.operation(db_cursor, *write.args)
+                    except Exception as excpt:
+                        #Any error, e.g. a TypeError from a malformed entry, so the writer thread keeps running
+                        db_cursor.execute('ROLLBACK TO write')
+                        write.error = excpt
+                    db_cursor.execute('RELEASE write')
+                db_connection.commit()
+            except Exception as excpt:
+                db_connection.rollback()
+                for write in group:
+                    write.error = excpt
+            finally:
+                db_cursor.close()
+                for write in group:
+                    write.finish()
+
+        def get_unpublished(self, after_id = 0, limit = RECOVERY_PAGE_SZ) -> list:
+            """
+            Queries for a page of unpublished items stored in the database, in ID order
+            Args:
+                after_id: Only items with an ID greater than this are returned
+                limit: Max number of items returned
 
-            Returns: List containing all unpublished items
+            Returns: List containing (id, news source, news headline) of the unpublished items
 
             """
             #Create connection and cursor for DB
             db_connection = self.start_db_connection()
             db_cursor = db_connection.cursor()
 
-            #if table doesn't exist, create it, and query for unpublished items
-            self.create_table(db_cursor)
-            command = 'SELECT id, news_source, news_header FROM news WHERE is_published = FALSE'
+            #Query the partial index for the next page of unpublished items
+            command = 'SELECT id, news_source, news_header FROM {} WHERE is_published = 0 AND id > ? ORDER BY id ' \
+                      'LIMIT ?'.format(self.table_name)
+            page = db_cursor.execute(command, (after_id, limit)).fetchall()
 
-            #Return the list of unpublished items
-            return db_cursor.execute(command).fetchall()
+            #Close connection, and return the page of unpublished items
+            db_cursor.close()
+            db_connection.close()
+            return page
 
         def start_db_connection(self):
             """
@@ -401,10 +1538,16 @@ if __name__ == '__main__':
     print_welcome_message()
 
     #if insufficient command line arguments provided, print error and exit program gracefully
+    use_asyncio = ASYNCIO_FLAG in sys.argv[1:]
+    if use_asyncio:
+        sys.argv.remove(ASYNCIO_FLAG)
+    compress = COMPRESS_FLAG in sys.argv[1:]
+    if compress:
+        sys.argv.remove(COMPRESS_FLAG)
     if len(sys.argv) != 3:
         print('ERROR: Incorrect input arguments. Expecting daily_news_provider ADDRESS and PORT as input argument.')
         print('Expected format:')
-        print('python3 news_host.py <Provider address> <Provider Port>')
+        print('python3 news_host.py <Provider address> <Provider Port> [{}] [{}]'.format(ASYNCIO_FLAG, COMPRESS_FLAG))
         print('E.g.: python3 news_host.py localhost 50200')
         print_goodbye_message()
         exit(1)
@@ -419,9 +1562,14 @@ if __name__ == '__main__':
         exit(1)
 
     #Create news reporter object
-    host_srv = NewsHost(listener_port=listening_port, pub_port=pub_port)
-
-    #Create a thread for the listener and a thread for the news sender
-    threading.Thread(target=host_srv.listen, args=()).start()
-    threading.Thread(target=host_srv.send_news, args=()).start()
+    codecs = ((wire_codec.BINARY_ZLIB,) if compress else ()) + wire_codec.DEFAULT_CODECS
+    host_srv = NewsHost(listener_port=listening_port, pub_port=pub_port, codecs=codecs)
+
+    #Either run the listener and the news sender on one event loop, or create a thread for the listener and a thread
+    #for the news sender
+    if use_asyncio:
+        host_srv.serve_async()
+    else:
+        threading.Thread(target=host_srv.listen, args=()).start()
+        threading.Thread(target=host_srv.send_news, args=()).start()
 
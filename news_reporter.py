@@ -6,38 +6,57 @@ This is free and unencumbered software released into the public domain.
 :Version: 1.0
 Description: Client application for users to post news to RSS Feed
 """
+import concurrent.futures
 import datetime
-import pickle
+import itertools
 import socket
 import sys
+import threading
+import time
 
+import transport
+import wire_codec
 
-BUF_SZ = 4096
 CONN_TIMEOUT = 10
+RETRY_ATTEMPTS = 5              #Max number of times a post is retried when the host asks to retry later
+RETRY_BACKOFF_MIN = 0.5         #Initial seconds to wait before retrying a post
+RETRY_BACKOFF_MAX = 8.0         #Max seconds to wait before retrying a post
+COMPRESS_FLAG = '--compress'    #Command line flag selecting the compressed binary codec
+ADD_POSTS_BATCH = 256           #Max number of news posts carried by one add_posts request
+PIPELINE_WINDOW = 8             #Max number of add_posts requests in flight on the connection
 
 class Reporter(object):
     """
-    Reporter class collects news from user, reports it to the news host server
+    Reporter class collects news from user, reports it to the news host server, on one long-lived connection. RPCs
+    are tagged with request IDs, so several of them can be in flight at once, from one or several threads
     """
 
-    #Global "constants" to be used in creation of XML and sending RPCs
+    #Global "constants" to be used in sending RPCs
     ADD_POST = 'add_post'
-    SOURCE_TAG = 'source'
-    HEADLINE_TAG = 'headline'
+    ADD_POSTS = 'add_posts'
+    STATS = 'stats'
+    RETRY_LATER = 'retry_later'
 
-    def __init__(self, serv_host_name = 'localhost', serv_port = 50100):
+    def __init__(self, serv_host_name = 'localhost', serv_port = 50100, codec = wire_codec.BINARY):
         """
         Constructor
         Args:
             serv_host_name: Host name or IP address of host server
             serv_port: Port on host server to be contacted
+            codec: Name of the wire codec used to talk to the host server. The compatibility codec sends news
+                   posts as XML strings, like legacy reporters
         """
         self.server_host_name = serv_host_name
         self.server_port = int(serv_port)
+        self.codec = wire_codec.get_codec(codec, wire_codec.REPORTER_HOP)
+        self.request_ids = itertools.count(1)
+        self.connection = None
+        self.connection_lock = threading.Lock()
 
     def add_post(self, source, headline) -> bool:
         """
-        Adds a new news topic to the host
+        Adds a new news topic to the host. If the host is saturated and asks to retry later, the post is retried up
+        to RETRY_ATTEMPTS times, backing off exponentially
         Args:
             source: The source agency of the news (e.g. 'CNN', 'BBC', ...)
             headline: The actual news header to be added (e.g. 'Midterm elections are underway in U.S.A.')
@@ -45,57 +64,158 @@ class Reporter(object):
         Returns: True, if topic is added successfully, else False
 
         """
-        #Initialize XML helper object, and add news source and headline to XML file
-        xml_file = Reporter.XmlHelper()
-        xml_file.add_data(Reporter.SOURCE_TAG, source)
-        xml_file.add_data(Reporter.HEADLINE_TAG, headline)
+        #Make RPC call to server, with the news item as carried by the codec (an XML string in compatibility mode)
+        item = self.codec.wire_item(wire_codec.NewsItem(source, headline))
+        result = self.call_rpc(Reporter.ADD_POST, item)
+        backoff = RETRY_BACKOFF_MIN
+        for attempt in range(RETRY_ATTEMPTS):
+            if result != (False, Reporter.RETRY_LATER):
+                break
+            print('Host is busy, retrying in {} seconds'.format(backoff))
+            time.sleep(backoff)
+            backoff = min(backoff * 2, RETRY_BACKOFF_MAX)
+            result = self.call_rpc(Reporter.ADD_POST, item)
 
-        #Make RPC call to server
-        result = self.call_rpc(Reporter.ADD_POST, xml_file.get_xml())
         if type(result) is tuple and result[0] is True:
             print('Added news post successfully. Post ID: {}'.format(result[1]))
-            return result
+            return True
         else:
             print('Failed to add news post')
-            return result
+            return False
+
+    def add_posts(self, posts) -> list:
+        """
+        Adds several news topics to the host. The posts are sent in add_posts requests of up to ADD_POSTS_BATCH posts,
+        each committed in one transaction by the host, with up to PIPELINE_WINDOW requests in flight. Requests the
+        host asks to retry later are retried like add_post does
+        Args:
+            posts: List of (source, headline) tuples
+
+        Returns: List of the post IDs assigned, in the same order as the posts, with None for the posts not added
+
+        """
+        batches = [[self.codec.wire_item(wire_codec.NewsItem(source, headline)) for source, headline in
+                    posts[i:i + ADD_POSTS_BATCH]] for i in range(0, len(posts), ADD_POSTS_BATCH)]
+        results = [False] * len(batches)
+        waiting = list(range(len(batches)))
+        backoff = RETRY_BACKOFF_MIN
+        for attempt in range(RETRY_ATTEMPTS + 1):
+            #Keep up to PIPELINE_WINDOW requests in flight, sending the next one as soon as the oldest is answered
+            in_flight = []
+            for index in waiting:
+                if len(in_flight) == PIPELINE_WINDOW:
+                    self._collect(in_flight.pop(0), results)
+                in_flight.append((index, self.submit(Reporter.ADD_POSTS, batches[index])))
+            for request in in_flight:
+                self._collect(request, results)
+
+            waiting = [index for index in waiting if results[index] == (False, Reporter.RETRY_LATER)]
+            if len(waiting) == 0 or attempt == RETRY_ATTEMPTS:
+                break
+            print('Host is busy, retrying {} batches in {} seconds'.format(len(waiting), backoff))
+            time.sleep(backoff)
+            backoff = min(backoff * 2, RETRY_BACKOFF_MAX)
+
+        ids = []
+        for batch, result in zip(batches, results):
+            ids.extend(result[1] if type(result) is tuple and result[0] is True else [None] * len(batch))
+        print('Added {} of {} news posts'.format(sum(id is not None for id in ids), len(ids)))
+        return ids
+
+    def _collect(self, request, results) -> None:
+        """
+        Waits for the reply to an add_posts request
+        Args:
+            request: (index of the batch, Future of the reply) tuple
+            results: List the reply is stored in, at the index of the batch
+
+        Returns: None
+
+        """
+        index, reply = request
+        results[index] = self.wait_reply(reply)
+
+    def get_stats(self) -> dict:
+        """
+        Queries the host for the counters of its send queue (depth, spilled posts, ...)
+
+        Returns: Dictionary of counters, or False if the query failed
+
+        """
+        return self.call_rpc(Reporter.STATS, None)
 
     def call_rpc(self, method, arg1):
         """
-        Performs an RPC call to the remote server
+        Performs an RPC call to the remote server, and waits for its reply
         Args:
             method: name of method to be executed
             arg1: 1st argument of the method to be executed
 
-        Returns: Any
+        Returns: Any, or False if the call failed
+
+        """
+        return self.wait_reply(self.submit(method, arg1))
+
+    def submit(self, method, arg1) -> concurrent.futures.Future:
+        """
+        Sends an RPC request to the remote server, tagged with a new request ID, without waiting for its reply. The
+        connection to the server is opened again if it was lost
+        Args:
+            method: name of method to be executed
+            arg1: 1st argument of the method to be executed
+
+        Returns: Future of the reply
 
         """
         # Create tuple object for the message to be sent to remote server
         msg_to_send = (method, arg1)
-        recv_msg = False
-
         try:
-            # Create socket connection with host server
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as serv_sock:
-                serv_sock.connect((self.server_host_name, self.server_port))
-                serv_sock.settimeout(CONN_TIMEOUT)
+            with self.connection_lock:
+                if self.connection is None or self.connection.closed:
+                    self.connection = Reporter.HostConnection((self.server_host_name, self.server_port), self.codec)
+                connection = self.connection
+            return connection.send(next(self.request_ids), msg_to_send)
 
-                #Send RPC
-                serv_sock.sendall(pickle.dumps(msg_to_send))
-                #Debug print
-                Reporter._pr_sent_rpc(serv_sock, msg_to_send)
+        except OSError as excpt:
+            reply = concurrent.futures.Future()
+            reply.set_exception(excpt)
+            return reply
 
-                #Block on response
-                recv_msg = pickle.loads(serv_sock.recv(BUF_SZ))
-                Reporter._pr_recv_rpc(serv_sock, recv_msg)
+    def wait_reply(self, reply: concurrent.futures.Future):
+        """
+        Waits for the reply to an RPC request. If none comes within CONN_TIMEOUT, only this request fails: its reply
+        is ignored if it comes later, and the other requests in flight on the connection carry on
+        Args:
+            reply: Future of the reply, as returned by submit
 
-                #Close socket
-                serv_sock.close()
-            return recv_msg
+        Returns: Any, or False if the call failed
 
-        except OSError as excpt:
+        """
+        try:
+            return reply.result(timeout=CONN_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            print('Submitting news post failed. No reply from host in {} seconds'.format(CONN_TIMEOUT))
+            with self.connection_lock:
+                connection = self.connection
+            if connection is not None:
+                connection.forget(reply)
+            return False
+        except (OSError, ValueError) as excpt:
             print('Submitting news post failed. {}'.format(excpt))
             return False
 
+    def close(self) -> None:
+        """
+        Closes the connection to the host
+
+        Returns: None
+
+        """
+        with self.connection_lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
     def run_ui(self) -> None:
         """
         UI for reporter, provide prompts to the user
@@ -166,31 +286,118 @@ class Reporter(object):
         """Helper method to print the current timestamp"""
         return datetime.datetime.now().strftime('%H:%M:%S.%f')
 
-    class XmlHelper(object):
-        """Helper class to create XML strings"""
-        def __init__(self):
-            self.xml_string = '<news>'  #init the XML string
+    class HostConnection(object):
+        """
+        Long-lived connection to the host, carrying pipelined RPC requests. Each request is tagged with a request ID,
+        and a reader thread matches the host's replies to requests by that ID
+        """
+        def __init__(self, address, codec):
+            """
+            Constructor, connects to the host, sends the hello frame negotiating the codec and starts the reader
+            thread. The host's hello frame is skipped by the reader, so no round trip is needed before the first RPC
+            Args:
+                address: (host, port) of the host server
+                codec: Wire codec of the requests
+            """
+            self.codec = codec
+            self.pending = {}
+            self.lock = threading.Lock()
+            self.closed = False
+            self.sock = socket.create_connection(address, CONN_TIMEOUT)
+            self.sock.settimeout(None)
+            self.frame_reader = transport.FrameReader(self.sock)
+            try:
+                if codec.name != wire_codec.PICKLE:
+                    transport.send_frame(self.sock, wire_codec.encode_hello([codec.name]))
+            except OSError:
+                self.sock.close()
+                raise
+            self.reader = threading.Thread(target=self._read_loop, args=(), daemon=True)
+            self.reader.start()
+
+        def send(self, request_id, rpc) -> concurrent.futures.Future:
+            """
+            Sends an RPC request without waiting for the reply
+            Args:
+                request_id: ID the reply will be tagged with
+                rpc: (method, arg1) tuple
+
+            Returns: Future of the reply
 
-        def add_data(self, tag, data) -> None:
             """
-            Adds data to XML string
-            :param
-            tag: XML tag for the data to be added
-                data: data to be added to XML string
+            method, arg1 = rpc
+            reply = concurrent.futures.Future()
+            with self.lock:
+                if self.closed:
+                    raise transport.FrameError('Connection closed by host')
+                self.pending[request_id] = reply
+                try:
+                    transport.send_frame(self.sock, self.codec.encode((method, arg1, request_id)))
+                except OSError:
+                    del self.pending[request_id]
+                    raise
+                #Debug print, before the reader thread can close the socket
+                Reporter._pr_sent_rpc(self.sock, rpc)
+            return reply
+
+        def forget(self, reply: concurrent.futures.Future) -> None:
+            """
+            Stops waiting for the reply to a request, so a reply coming later is dropped by the reader thread
+            Args:
+                reply: Future of the reply, as returned by send
 
-            Returns:None
+            Returns: None
 
             """
-            #Append new information to XML string
-            self.xml_string = self.xml_string + '<{}>{}</{}>'.format(tag, data, tag)
+            with self.lock:
+                for request_id, request in self.pending.items():
+                    if request is reply:
+                        del self.pending[request_id]
+                        break
 
-        def get_xml(self) -> str:
+        def close(self) -> None:
             """
-            Finalize XML file and returns string representation
-            Returns: String representation of XML file
+            Closes the connection. The requests in flight fail
+
+            Returns: None
+
+            """
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+        def _read_loop(self) -> None:
+            """
+            Reader thread loop, setting the reply of each request until the connection is lost, then failing the
+            requests still in flight
+
+            Returns: None
 
             """
-            return self.xml_string + '</news>'
+            excpt = transport.FrameError('Connection closed by host')
+            try:
+                while True:
+                    reply = self.frame_reader.recv_frame()
+                    if reply is None:
+                        break
+                    if wire_codec.is_hello(reply):
+                        continue
+                    request_id, result = wire_codec.decode_any(reply, wire_codec.REPORTER_HOP)[1]
+                    Reporter._pr_recv_rpc(self.sock, result)
+                    with self.lock:
+                        request = self.pending.pop(request_id, None)
+                    if request is not None:
+                        request.set_result(result)
+            except (OSError, ValueError) as error:
+                excpt = transport.FrameError('Connection to host lost. {}'.format(error))
+            finally:
+                with self.lock:
+                    self.closed = True
+                    pending, self.pending = self.pending, {}
+                self.sock.close()
+                for request in pending.values():
+                    request.set_exception(excpt)
 
 def print_welcome_message():
     """Prints a welcome message on console"""
@@ -215,11 +422,14 @@ if __name__ == '__main__':
     print_welcome_message()
 
     #if insufficient command line arguments provided, print error and exit program gracefully
+    compress = COMPRESS_FLAG in sys.argv[1:]
+    if compress:
+        sys.argv.remove(COMPRESS_FLAG)
     if len(sys.argv) != 2 and len(sys.argv) not in range(4, sys.maxsize):
         print('ERROR: Incorrect input arguments. Expecting news_host PORT as input argument.')
         print('Expected format:')
-        print('python3 news_reporter.py <Node Port> [optional: <news source e.g. CNN> '
-              '<news header>]')
+        print('python3 news_reporter.py <Node Port> [{}] [optional: <news source e.g. CNN> '
+              '<news header>]'.format(COMPRESS_FLAG))
         print('E.g.: python3 news_reporter.py 50100')
         print_goodbye_message()
         exit(1)
@@ -233,7 +443,7 @@ if __name__ == '__main__':
         exit(1)
 
     #Create news reporter object
-    news_reporter = Reporter(serv_port=host_port)
+    news_reporter = Reporter(serv_port=host_port, codec=wire_codec.BINARY_ZLIB if compress else wire_codec.BINARY)
 
     #if only host address and port provided, run the UI to prompt the user for the news
     if len(sys.argv) < 4:
@@ -0,0 +1,124 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Aacer Daken and Arielle Wilson
+:Filename: register_benchmark.py
+:Version: 1.0
+Description: Benchmark of the publisher's registration throughput, as in a registration storm after a fleet of
+subscribers restarts. Measures registrations/sec with the original thread per datagram register server, and with
+the selector loop.
+
+Each of a number of client sockets keeps a few registrations outstanding, and sends the next one as soon as a
+reply comes back.
+
+Usage:
+    python3 register_benchmark.py [<number of registrations>]
+"""
+import contextlib
+import io
+import selectors
+import socket
+import sys
+import threading
+import time
+
+import daily_news_provider
+import transport
+import wire_codec
+
+REGISTRATIONS = 20000
+CLIENTS = 64                    #Number of client sockets
+OUTSTANDING = 4                 #Registrations outstanding per client socket
+IDLE_TIMEOUT = 2.0              #Seconds without replies after which the remaining registrations count as lost
+THREADED_PORT = 50914           #Registration port of the thread per datagram publisher
+SELECTOR_PORT = 50915           #Registration port of the selector loop publisher
+
+
+def storm(port, count) -> tuple:
+    """
+    Sends registrations to a publisher, and waits for the replies
+    Args:
+        port: Registration port of the publisher
+        count: Number of registrations
+
+    Returns: (replies received, seconds elapsed) tuple
+
+    """
+    codec = wire_codec.get_codec(wire_codec.BINARY)
+    selector = selectors.DefaultSelector()
+    requests = {}
+    for i in range(CLIENTS):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('localhost', 0))
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+        request = {'address': ('localhost', sock.getsockname()[1]), 'codec': wire_codec.BINARY}
+        requests[sock] = transport.encode_datagram(codec.encode((daily_news_provider.REGISTER, request)))
+
+    sent = replies = 0
+    start = last_reply = time.perf_counter()
+    for sock, frame in requests.items():
+        for i in range(min(OUTSTANDING, count - sent)):
+            sock.sendto(frame, ('localhost', port))
+            sent += 1
+
+    while replies < count and time.perf_counter() - last_reply < IDLE_TIMEOUT:
+        for key, events in selector.select(timeout=0.1):
+            while True:
+                try:
+                    key.fileobj.recv(transport.MAX_DATAGRAM_SZ)
+                except BlockingIOError:
+                    break
+                replies += 1
+                last_reply = time.perf_counter()
+                if sent < count:
+                    key.fileobj.sendto(requests[key.fileobj], ('localhost', port))
+                    sent += 1
+
+    for sock in requests:
+        sock.close()
+    selector.close()
+    return replies, last_reply - start
+
+
+def measure(name, port, count, console) -> None:
+    """
+    Measures and prints the registration throughput of a publisher
+    Args:
+        name: Name of the register server
+        port: Registration port of the publisher
+        count: Number of registrations
+        console: Stream the result is printed to
+
+    Returns: None
+
+    """
+    replies, elapsed = storm(port, count)
+    print('{:<36} {:>10} {:>8} {:>14.0f}'.format(name, replies, count - replies, replies / elapsed), file=console)
+
+
+def run(count) -> None:
+    """
+    Runs the benchmark
+    Args:
+        count: Number of registrations
+
+    Returns: None
+
+    """
+    #The publishers print every registration, keep that off the console
+    console = sys.stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        threaded = daily_news_provider.DailyNewsPublisher(THREADED_PORT, 0)
+        threading.Thread(target=threaded.start_register_server, args=(), daemon=True).start()
+        selector = daily_news_provider.DailyNewsPublisher(SELECTOR_PORT, 0)
+        threading.Thread(target=selector.serve, args=(), daemon=True).start()
+        time.sleep(0.2)
+
+        print('{:<36} {:>10} {:>8} {:>14}'.format('register server', 'replies', 'lost', 'registr./sec'), file=console)
+        measure('thread per datagram', THREADED_PORT, count, console)
+        measure('selector loop', SELECTOR_PORT, count, console)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else REGISTRATIONS)
@@ -0,0 +1,261 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Aacer Daken and Arielle Wilson
+:Filename: relay_benchmark.py
+:Version: 1.0
+Description: End-to-end delivery latency by depth of a tree of relays. For each depth, starts a local topology of
+processes: a root publisher, relays with the given fan-out degree, down to the leaf publishers, and a probe subscriber
+per leaf. The subscribers are split between the leaf publishers, and each leaf publisher also sends to its share of
+stand-in subscribers (closed local ports), so the root only sends to its children. The root publishes news items
+stamped with their publish time, and the probes report the time they got them.
+
+Usage:
+    python3 relay_benchmark.py [<number of subscribers> [<fan-out degree> [<max depth>]]]
+"""
+import contextlib
+import multiprocessing
+import os
+import queue
+import statistics
+import sys
+import threading
+import time
+
+import daily_news_provider
+import daily_news_relay
+import daily_news_subscriber
+import wire_codec
+
+SUBSCRIBERS = 4000
+DEGREE = 4
+MAX_DEPTH = 2
+ITEMS = 50                      #Items published
+INTERVAL = 0.02                 #Seconds between two items
+BASE_PORT = 51600               #First port of the topology
+STAND_IN_PORT = 20000           #First port of the stand-in subscribers
+START_TIMEOUT = 30.0            #Max seconds to wait for a level of the topology to register
+TIMEOUT = 10.0                  #Max seconds to wait for the probes after the last item
+
+
+class ProbeSubscriber(daily_news_subscriber.DailyNewsSubscriber):
+    """
+    Subscriber reporting the delivery latency of the stamped news items it gets
+    """
+
+    def __init__(self, latencies, ready, *args, **kwargs):
+        """
+        Constructor, see DailyNewsSubscriber
+        Args:
+            latencies: Queue the latencies are put on, in seconds
+            ready: Queue told once the subscriber is registered
+        """
+        super().__init__(*args, **kwargs)
+        self.latencies = latencies
+        self.ready = ready
+
+    def print_registration_confirmation(self, result):
+        """
+        Tells the benchmark the subscriber is registered
+        Args:
+            result: Registration result
+        """
+        self.ready.put(self.address)
+
+    def print_news(self, item):
+        """
+        Reports the latency of a news item
+        Args:
+            item: NewsItem, with the publish time as headline
+        """
+        self.latencies.put(time.time() - float(item.headline))
+
+
+def add_stand_ins(publisher, first_port, count) -> None:
+    """
+    Registers subscribers on closed local ports with a publisher, standing in for real ones
+    Args:
+        publisher: DailyNewsPublisher
+        first_port: Port of the first stand-in
+        count: Number of stand-ins
+
+    Returns: None
+
+    """
+    for port in range(first_port, first_port + count):
+        publisher.register({'address': ('localhost', port), 'codec': wire_codec.BINARY})
+
+
+def run_root(reg_port, stand_ins, ready, start) -> None:
+    """
+    Runs the root publisher, then publishes the stamped news items once start is set
+    Args:
+        reg_port: Registration port
+        stand_ins: (first port, count) of the stand-in subscribers
+        ready: Queue told once the publisher serves
+        start: Event set when publishing can start
+
+    Returns: None
+
+    """
+    with quiet():
+        publisher = daily_news_provider.DailyNewsPublisher(reg_port, 0)
+        add_stand_ins(publisher, *stand_ins)
+        threading.Thread(target=publisher.serve, args=(), daemon=True).start()
+        while publisher.selector is None:
+            time.sleep(0.01)
+        ready.put(reg_port)
+        start.wait()
+        for i in range(ITEMS):
+            publisher.publish(wire_codec.NewsItem('bench', repr(time.time())))
+            time.sleep(INTERVAL)
+        time.sleep(TIMEOUT)
+
+
+def run_relay(reg_port, upstream_port, listen_port, stand_ins, ready) -> None:
+    """
+    Runs a relay
+    Args:
+        reg_port: Registration port
+        upstream_port: Registration port of the parent
+        listen_port: Port the news from the parent are received on
+        stand_ins: (first port, count) of the stand-in subscribers
+        ready: Queue told once the relay serves, and is registered with its parent
+
+    Returns: None
+
+    """
+    with quiet():
+        relay = daily_news_relay.DailyNewsRelay(reg_port, upstream_port, listen_port)
+        add_stand_ins(relay, *stand_ins)
+        server = threading.Thread(target=relay.serve, args=(), daemon=True)
+        server.start()
+        while relay.selector is None or relay.upstream.epoch is None:
+            time.sleep(0.01)
+        ready.put(reg_port)
+        server.join()
+
+
+def run_probe(port, pub_port, latencies, ready) -> None:
+    """
+    Runs a probe subscriber
+    Args:
+        port: Port the news are received on
+        pub_port: Registration port of the leaf publisher
+        latencies: Queue the latencies are put on
+        ready: Queue told once the probe is registered
+
+    Returns: None
+
+    """
+    with quiet():
+        ProbeSubscriber(latencies, ready, port, pub_port).run()
+
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Sends the console output of a topology process to /dev/null, it prints every registration and publish
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def measure(depth, count, degree) -> None:
+    """
+    Measures and prints the delivery latency with a tree of a given depth
+    Args:
+        depth: Number of levels of relays below the root
+        count: Number of subscribers
+        degree: Number of children of the root and of each relay
+
+    Returns: None
+
+    """
+    context = multiprocessing.get_context('spawn')
+    latencies = context.Queue()
+    ready = context.Queue()
+    start = context.Event()
+    ports = iter(range(BASE_PORT, BASE_PORT + 10000))
+
+    #Build the tree level by level, each level holding the registration ports of its publishers, and the processes
+    #started with it. Leaf publishers share the stand-in subscribers
+    root_port = next(ports)
+    level = [root_port]
+    root_stand_ins = (STAND_IN_PORT, count - 1) if depth == 0 else (0, 0)
+    levels = [[context.Process(target=run_root, args=(root_port, root_stand_ins, ready, start), daemon=True)]]
+    for i in range(depth):
+        children = []
+        for parent in level:
+            for j in range(degree):
+                children.append((next(ports), parent, next(ports)))
+        share = count // len(children) if i == depth - 1 else 1
+        levels.append([context.Process(target=run_relay, daemon=True, args=(
+            reg_port, parent, listen_port, (STAND_IN_PORT, share - 1), ready))
+            for reg_port, parent, listen_port in children])
+        level = [reg_port for reg_port, parent, listen_port in children]
+
+    #Each leaf publisher gets a probe among its subscribers
+    levels.append([context.Process(target=run_probe, args=(next(ports), pub_port, latencies, ready), daemon=True)
+                   for pub_port in level])
+
+    #Start one level at a time, so every process registers with a running publisher
+    processes = [process for processes in levels for process in processes]
+    started = True
+    for processes_of_level in levels:
+        for process in processes_of_level:
+            process.start()
+        try:
+            for process in processes_of_level:
+                ready.get(timeout=START_TIMEOUT)
+        except queue.Empty:
+            started = False
+            break
+    start.set()
+
+    expected = ITEMS * len(level)
+    results = []
+    deadline = time.monotonic() + ITEMS * INTERVAL + TIMEOUT
+    while started and len(results) < expected and time.monotonic() < deadline:
+        try:
+            results.append(latencies.get(timeout=0.1))
+        except queue.Empty:
+            pass
+    for process in processes:
+        process.terminate()
+        process.join()
+
+    if not started:
+        print('{:<6} {:>8} topology failed to start'.format(depth, len(level)))
+        return
+    if len(results) == 0:
+        print('{:<6} {:>8} no delivery'.format(depth, len(level)))
+        return
+    results.sort()
+    print('{:<6} {:>8} {:>10} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+        depth, len(level), '{}/{}'.format(len(results), expected), statistics.median(results) * 1000,
+        results[int(0.99 * (len(results) - 1))] * 1000, results[-1] * 1000))
+
+
+def run(count, degree, max_depth) -> None:
+    """
+    Runs the benchmark
+    Args:
+        count: Number of subscribers
+        degree: Fan-out degree of the root and of each relay
+        max_depth: Largest number of levels of relays measured
+
+    Returns: None
+
+    """
+    print('Publishing {} items to {} subscribers, fan-out degree {}'.format(ITEMS, count, degree))
+    print('{:<6} {:>8} {:>10} {:>10} {:>10} {:>10}'.format('depth', 'leaves', 'received', 'median ms', 'p99 ms',
+                                                           'max ms'))
+    for depth in range(max_depth + 1):
+        measure(depth, count, degree)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else SUBSCRIBERS,
+        int(sys.argv[2]) if len(sys.argv) > 2 else DEGREE,
+        int(sys.argv[3]) if len(sys.argv) > 3 else MAX_DEPTH)
@@ -12,6 +12,7 @@ import time
 import sys
 
 import news_reporter
+import wire_codec
 
 LOOPS = 10
 NUM_CLIENTS = 20
@@ -37,18 +38,8 @@ PLACES = [
     'South Africa',
     'Papua New Guinea'
 ]
-SOURCES = [
-    'CNN',
-    'BBC',
-    'FOX',
-    'EuroNews',
-    'SkyNews',
-    'AlJazeera',
-    'Reuters',
-    'France24',
-    'DW',
-    'AssociatedPress'
-]
+SOURCES = list(wire_codec.CORPUS_SOURCES)     #The news sources known to the preset dictionaries
+
 
 def print_welcome_message():
     """Prints a welcome message on console"""
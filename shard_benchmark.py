@@ -0,0 +1,128 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Aacer Daken and Arielle Wilson
+:Filename: shard_benchmark.py
+:Version: 1.0
+Description: Benchmark of the sharded publisher. Registers a large set of subscribers with a ShardedPublisher, through
+the coordinator, publishes a burst of items, and measures how long the shards take to fan it out, for an increasing
+number of shard processes. The fan-out throughput grows with the number of shards, up to the number of cores.
+
+Usage:
+    python3 shard_benchmark.py [<number of subscribers> [<max number of shards>]]
+"""
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import time
+
+import daily_news_provider
+import wire_codec
+
+SUBSCRIBERS = 20000
+BURST = 50                      #Items in the burst
+TIMEOUT = 60.0                  #Max seconds to wait for the shards
+
+
+@contextlib.contextmanager
+def quiet_shards():
+    """
+    Sends the console output of the shard processes started in the block to /dev/null. They print every
+    registration and publish, on their own file descriptors
+    """
+    sys.stdout.flush()
+    console = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        yield
+    finally:
+        os.dup2(console, 1)
+        os.close(console)
+        os.close(devnull)
+
+
+def wait_for(publisher, name, value) -> bool:
+    """
+    Waits until a counter reaches a value in every shard
+    Args:
+        publisher: ShardedPublisher
+        name: Name of the counter, one of SHARD_STATS
+        value: Value per shard for subscribers, or in every shard for the other counters
+
+    Returns: True, if the counters reached the value before TIMEOUT
+
+    """
+    slot = daily_news_provider.SHARD_STATS.index(name)
+    size = len(daily_news_provider.SHARD_STATS)
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        counts = [publisher.counters[index * size + slot] for index in range(len(publisher.shards))]
+        if (sum(counts) if name == 'subscribers' else min(counts)) >= value:
+            return True
+        time.sleep(0.001)
+    return False
+
+
+def measure(shards, count) -> None:
+    """
+    Measures and prints the fan-out time of a burst with a number of shards
+    Args:
+        shards: Number of shard processes
+        count: Number of subscribers
+
+    Returns: None
+
+    """
+    codec = wire_codec.get_codec(wire_codec.BINARY)
+    with contextlib.redirect_stdout(io.StringIO()):
+        with quiet_shards():
+            publisher = daily_news_provider.ShardedPublisher(0, 0, shards, linger=0)
+        for i in range(count):
+            address = ('localhost', 1024 + i % 64000)
+            request = {'address': address, 'codec': wire_codec.BINARY}
+            publisher.answer_subscriber(address, codec.encode((daily_news_provider.REGISTER, request)))
+        registered = wait_for(publisher, 'subscribers', count)
+
+        items = [wire_codec.NewsItem('BBC', 'Burst headline number {}'.format(i)) for i in range(BURST)]
+        start = time.perf_counter()
+        for item in items:
+            publisher.publish(item)
+        done = wait_for(publisher, 'published', BURST)
+        elapsed = time.perf_counter() - start
+        datagrams = publisher.stats()['datagrams']
+
+    if not registered or not done:
+        print('{:<10} timed out'.format(shards))
+    else:
+        print('{:<10} {:>10} {:>10.1f} {:>14.0f}'.format(shards, datagrams, elapsed * 1000, datagrams / elapsed))
+    for process, connection, lock in publisher.shards:
+        connection.close()
+        process.join()
+    publisher.registration_socket.close()
+    publisher.publication_socket.close()
+
+
+def run(count, max_shards) -> None:
+    """
+    Runs the benchmark
+    Args:
+        count: Number of subscribers
+        max_shards: Largest number of shards measured
+
+    Returns: None
+
+    """
+    print('Publishing {} items to {} subscribers, {} cores'.format(BURST, count, multiprocessing.cpu_count()))
+    print('{:<10} {:>10} {:>10} {:>14}'.format('shards', 'datagrams', 'time (ms)', 'datagrams/sec'))
+    shards = 1
+    while shards <= max_shards:
+        measure(shards, count)
+        shards *= 2
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else SUBSCRIBERS,
+        int(sys.argv[2]) if len(sys.argv) > 2 else max(2, multiprocessing.cpu_count()))
@@ -0,0 +1,145 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Aacer Daken and Arielle Wilson
+:Filename: stream_benchmark.py
+:Version: 1.0
+Description: Stream subscriptions with a slow consumer. For each overflow policy, runs a publisher with a fast and a
+slow stream subscriber, and a UDP subscriber, and publishes news items with large headlines, some too large for a
+datagram. Reports how many items each subscriber got, how long the fast one took to get them all, and how the
+publisher treated the slow one.
+
+Usage:
+    python3 stream_benchmark.py [<number of items> [<headline size>]]
+"""
+import contextlib
+import io
+import sys
+import threading
+import time
+
+import daily_news_provider
+import daily_news_subscriber
+import transport
+import wire_codec
+
+ITEMS = 2000
+HEADLINE_SZ = 16 * 1024         #Bytes of each headline
+LARGE_EVERY = 100               #Every so many items, one is too large for a datagram
+SLOW_DELAY = 0.01               #Seconds the slow subscriber takes per item
+SLOW_QUEUE = 64                 #News items the slow subscriber holds before it stops reading from its connection
+STREAM_QUEUE = 1024 * 1024      #Bytes queued per stream subscriber before the overflow policy applies
+BATCH = 10                      #Items published at a time
+INTERVAL = 0.002                #Seconds between two batches
+REG_PORT = 51014                #Registration port of the publisher
+FAST_PORT = 51016               #Port of the fast stream subscriber
+SLOW_PORT = 51017               #Port of the slow stream subscriber
+UDP_PORT = 51018                #Port of the UDP subscriber
+TIMEOUT = 10.0                  #Max seconds to wait for the fast subscriber after the last item
+
+
+class CountingSubscriber(daily_news_subscriber.DailyNewsSubscriber):
+    """
+    Subscriber counting the news items it gets, instead of printing them, optionally taking time over each
+    """
+
+    def __init__(self, delay, *args, **kwargs):
+        """
+        Constructor, see DailyNewsSubscriber
+        Args:
+            delay: Seconds spent on each item
+        """
+        super().__init__(*args, **kwargs)
+        self.delay = delay
+        self.received = 0
+        self.registered = False
+
+    def print_registration_confirmation(self, result):
+        """
+        Notes the subscriber is registered
+        Args:
+            result: Registration result
+        """
+        self.registered = True
+
+    def print_news(self, item):
+        """
+        Counts a news item
+        Args:
+            item: NewsItem
+        """
+        self.received += 1
+        if self.delay > 0:
+            time.sleep(self.delay)
+
+
+def measure(policy, count, headline_sz, port_offset) -> None:
+    """
+    Measures and prints the delivery to each subscriber with an overflow policy
+    Args:
+        policy: daily_news_provider.DROP_OLDEST or daily_news_provider.DISCONNECT
+        count: Number of news items
+        headline_sz: Bytes of each headline
+        port_offset: Added to every port, so runs don't reuse ports
+
+    Returns: None
+
+    """
+    console = sys.stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        publisher = daily_news_provider.DailyNewsPublisher(REG_PORT + port_offset, 0, stream_queue=STREAM_QUEUE,
+                                                           stream_policy=policy)
+        threading.Thread(target=publisher.serve, args=(), daemon=True).start()
+        while publisher.selector is None:
+            time.sleep(0.01)
+
+        fast = CountingSubscriber(0, FAST_PORT + port_offset, REG_PORT + port_offset, stream=True)
+        slow = CountingSubscriber(SLOW_DELAY, SLOW_PORT + port_offset, REG_PORT + port_offset, stream=True,
+                                  queue_size=SLOW_QUEUE)
+        udp = CountingSubscriber(0, UDP_PORT + port_offset, REG_PORT + port_offset)
+        subscribers = (fast, slow, udp)
+        for subscriber in subscribers:
+            threading.Thread(target=subscriber.run, args=(), daemon=True).start()
+        while not all(subscriber.registered for subscriber in subscribers):
+            time.sleep(0.01)
+
+        items = [wire_codec.NewsItem('bench', '{} {}'.format(i, 'x' * (
+            transport.MAX_DATAGRAM_SZ if i % LARGE_EVERY == LARGE_EVERY - 1 else headline_sz))) for i in range(count)]
+        start = time.perf_counter()
+        for i in range(0, count, BATCH):
+            publisher.publish_batch(items[i:i + BATCH])
+            time.sleep(INTERVAL)
+        published = time.perf_counter() - start
+
+        deadline = time.monotonic() + TIMEOUT
+        while fast.received < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        stats = publisher.stats()
+
+    print('{:<12} {:>10.1f} {:>10.1f} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+        policy, published * 1000, elapsed * 1000, fast.received, slow.received, udp.received,
+        stats['stream_dropped'], stats['stream_disconnected']), file=console)
+
+
+def run(count, headline_sz) -> None:
+    """
+    Runs the benchmark
+    Args:
+        count: Number of news items
+        headline_sz: Bytes of each headline
+
+    Returns: None
+
+    """
+    print('Publishing {} items of {} bytes, one in {} larger than a datagram, slow subscriber taking {} ms per item'
+          .format(count, headline_sz, LARGE_EVERY, SLOW_DELAY * 1000))
+    print('{:<12} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+        'policy', 'publish ms', 'fast ms', 'fast', 'slow', 'udp', 'dropped', 'disconnected'))
+    for i, policy in enumerate((daily_news_provider.DROP_OLDEST, daily_news_provider.DISCONNECT)):
+        measure(policy, count, headline_sz, i * 10)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else ITEMS,
+        int(sys.argv[2]) if len(sys.argv) > 2 else HEADLINE_SZ)
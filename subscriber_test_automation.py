@@ -0,0 +1,88 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Aacer Daken and Arielle Wilson
+:Filename: subscriber_test_automation.py
+:Version: 1.0
+Description: Test driver for the receiving thread of daily_news_subscriber. Sends a subscriber datagrams that decode
+but aren't messages of the publisher, then a publication, and exits with status 1 unless the subscriber still
+delivers the publication.
+
+Usage:
+    python3 subscriber_test_automation.py
+"""
+import socket
+import sys
+import threading
+import time
+
+import daily_news_subscriber
+import transport
+import wire_codec
+
+SUBSCRIBER_PORT = 50918         #Port of the subscriber
+PUBLISHER_PORT = 50919          #Registration port of a publisher that isn't running
+DELIVERY_TIMEOUT = 5.0          #Max seconds the publication may take to reach the sink
+GOOD_ITEM = wire_codec.NewsItem('BBC', 'Elections in Egypt')
+MALFORMED_MESSAGES = [
+    5,                                                      #Not a tuple
+    ('publish',),                                           #No result
+    ('publish', 5),                                         #Not a news item
+    ('publish', 'item', 'seq', 'prev', 1),                  #Sequence numbers not ints
+    ('publish_batch', 5),                                   #Result not (epoch, entries)
+    ('publish_batch', (1, 5)),                              #Entries not a list
+    ('publish_batch', (1, [('item', 1)])),                  #Entry not (item, seq, prev)
+    ('register', 'Registered', 'seq', 1),                   #Sequence number not an int
+    ('heartbeat', 'Renewed', None, 1),                      #Sequence number not an int
+    ('nack', 5),                                            #Result not (first, last)
+]
+
+
+class CollectingSink(object):
+    """
+    Sink keeping the news items it gets, and telling when one arrived
+    """
+
+    def __init__(self):
+        """Constructor"""
+        self.items = []
+        self.arrived = threading.Event()
+
+    def __call__(self, items):
+        """
+        Keeps news items
+        Args:
+            items: List of NewsItem
+        """
+        self.items.extend(items)
+        self.arrived.set()
+
+
+def run() -> bool:
+    """
+    Runs the check
+
+    Returns: True if the subscriber delivered the publication sent after the malformed messages
+
+    """
+    sink = CollectingSink()
+    subscriber = daily_news_subscriber.DailyNewsSubscriber(SUBSCRIBER_PORT, PUBLISHER_PORT, wire_codec.PICKLE,
+                                                           sink=sink)
+    threading.Thread(target=subscriber.run, args=(), daemon=True).start()
+    while subscriber.publisher.getsockname()[1] != SUBSCRIBER_PORT:
+        time.sleep(0.01)
+
+    codec = wire_codec.get_codec(wire_codec.PICKLE)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for message in MALFORMED_MESSAGES:
+        transport.send_datagram(sock, codec.encode(message), subscriber.address)
+    transport.send_datagram(sock, codec.encode(('publish', codec.wire_item(GOOD_ITEM))), subscriber.address)
+    sock.close()
+
+    passed = sink.arrived.wait(DELIVERY_TIMEOUT) and sink.items == [GOOD_ITEM]
+    print('{:<40} {}'.format('malformed datagrams', 'ok' if passed else 'FAILED: receiving thread stopped'))
+    return passed
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run() else 1)
@@ -10,9 +10,10 @@ import pickle
 import socket
 from xml.etree.ElementTree import Element, SubElement, tostring
 
+import transport
+
 PUBLISH_ADD = ('localhost', 50500)
 PUBLISH = 'publish'
-BUF_SZ = 4096
 
 class TestFeed(object):
     """
@@ -33,7 +34,7 @@ class TestFeed(object):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             try:
                 s.connect(PUBLISH_ADD)
-                s.sendall(pickle.dumps((PUBLISH, tree_str)))
+                transport.send_frame(s, pickle.dumps((PUBLISH, tree_str)))
             except Exception as e:
                 return None
 
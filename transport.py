@@ -0,0 +1,301 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Aacer Daken and Arielle Wilson
+:Filename: transport.py
+:Version: 1.0
+
+Description: Message framing shared by all RSS Feed components. Every message is sent as a frame, made of a 4 byte
+big-endian length followed by the payload. Over TCP this lets any number of messages, of any size, share one
+connection. Over UDP the length lets the receiver detect a truncated datagram.
+
+Frames are received with recv_into, into a buffer preallocated once per connection/socket, and handed to the caller
+as a memoryview of that buffer, so the payload isn't copied on the way in.
+
+FrameDecoder splits the bytes read from a non-blocking socket, in whatever chunks they arrive, into frames.
+
+read_frame and write_frame do the same over asyncio streams.
+
+LossySocket drops a share of the datagrams sent through a UDP socket, to test delivery over a lossy network.
+"""
+import asyncio
+import random
+import struct
+
+HEADER = struct.Struct('!I')            #Frame header, the length of the payload
+BUF_SZ = 64 * 1024                      #Initial size of the receive buffer of a stream connection
+MAX_FRAME_SZ = 64 * 1024 * 1024         #Largest frame accepted, to guard against corrupt headers
+MAX_DATAGRAM_SZ = 65507                 #Largest UDP datagram payload over IPv4
+
+
+class FrameError(OSError):
+    """
+    Raised when a frame can't be received, e.g. a connection closed in the middle of a frame, or a truncated datagram.
+    It is an OSError, so it is handled wherever socket errors are handled
+    """
+
+
+def encode_frame(payload) -> bytes:
+    """
+    Prefixes a payload with its length
+    Args:
+        payload: bytes-like payload
+
+    Returns: Frame as bytes
+
+    """
+    return HEADER.pack(len(payload)) + payload
+
+
+def send_frame(sock, payload) -> None:
+    """
+    Sends one frame on a stream socket
+    Args:
+        sock: Connected TCP socket
+        payload: bytes-like payload
+
+    Returns: None
+
+    """
+    sock.sendall(encode_frame(payload))
+
+
+def encode_datagram(payload) -> bytes:
+    """
+    Prefixes a payload with its length, checking that the frame fits in a UDP datagram. The frame can be sent to any
+    number of receivers with sendto
+    Args:
+        payload: bytes-like payload
+
+    Returns: Frame as bytes
+
+    """
+    frame = encode_frame(payload)
+    if len(frame) > MAX_DATAGRAM_SZ:
+        raise FrameError('Datagram of {} bytes exceeds the maximum of {}'.format(len(frame), MAX_DATAGRAM_SZ))
+    return frame
+
+
+def send_datagram(sock, payload, address) -> None:
+    """
+    Sends one frame as a UDP datagram
+    Args:
+        sock: UDP socket
+        payload: bytes-like payload
+        address: (host, port) of the receiver
+
+    Returns: None
+
+    """
+    sock.sendto(encode_datagram(payload), address)
+
+
+class FrameReader(object):
+    """
+    Reads frames from a stream socket into a preallocated buffer. The buffer grows if a frame doesn't fit
+    """
+
+    def __init__(self, sock, buf_sz = BUF_SZ):
+        """
+        Constructor
+        Args:
+            sock: Connected TCP socket
+            buf_sz: Initial size of the receive buffer
+        """
+        self.sock = sock
+        self.buffer = bytearray(buf_sz)
+        self.view = memoryview(self.buffer)
+        self.start = 0      #Start of the received data not handed out yet
+        self.end = 0        #End of the received data
+
+    def recv_frame(self):
+        """
+        Blocks until a whole frame is received
+
+        Returns: memoryview of the payload, which is only valid until the next call, or None if the connection was
+        closed between frames
+
+        """
+        if not self._fill(HEADER.size):
+            return None
+        length = HEADER.unpack_from(self.buffer, self.start)[0]
+        if length > MAX_FRAME_SZ:
+            raise FrameError('Frame of {} bytes exceeds the maximum of {}'.format(length, MAX_FRAME_SZ))
+        if not self._fill(HEADER.size + length):
+            raise FrameError('Connection closed in the middle of a frame')
+
+        payload_start = self.start + HEADER.size
+        self.start = payload_start + length
+        return self.view[payload_start:self.start]
+
+    def _fill(self, size) -> bool:
+        """
+        Receives until at least size bytes, not handed out yet, are in the buffer
+        Args:
+            size: Number of bytes needed
+
+        Returns: True, if the bytes were received, or False if the connection was closed with nothing buffered
+
+        """
+        while self.end - self.start < size:
+            #Make room at the end of the buffer, moving the pending bytes to the front, or growing the buffer
+            if self.start + size > len(self.buffer):
+                pending = self.end - self.start
+                if size > len(self.buffer):
+                    buffer = bytearray(max(size, 2 * len(self.buffer)))
+                    buffer[:pending] = self.view[self.start:self.end]
+                    self.buffer = buffer
+                    self.view = memoryview(self.buffer)
+                else:
+                    self.buffer[:pending] = self.buffer[self.start:self.end]
+                self.start = 0
+                self.end = pending
+
+            received = self.sock.recv_into(self.view[self.end:])
+            if received == 0:
+                if self.end == self.start:
+                    return False
+                raise FrameError('Connection closed in the middle of a frame')
+            self.end += received
+        return True
+
+
+class DatagramReader(object):
+    """
+    Reads framed UDP datagrams into a preallocated buffer
+    """
+
+    def __init__(self, sock):
+        """
+        Constructor
+        Args:
+            sock: Bound UDP socket
+        """
+        self.sock = sock
+        self.buffer = bytearray(MAX_DATAGRAM_SZ + 1)
+        self.view = memoryview(self.buffer)
+
+    def recv_datagram(self) -> tuple:
+        """
+        Blocks until a datagram is received
+
+        Returns: (payload, address) tuple, the payload being a memoryview only valid until the next call
+
+        """
+        received, address = self.sock.recvfrom_into(self.buffer)
+        if received < HEADER.size or HEADER.unpack_from(self.buffer)[0] != received - HEADER.size:
+            raise FrameError('Truncated or malformed datagram from {}'.format(address))
+        return self.view[HEADER.size:received], address
+
+
+class FrameDecoder(object):
+    """
+    Incremental frame decoder for non-blocking sockets: bytes are fed as they are received, and complete frames are
+    returned as soon as they are buffered
+    """
+
+    def __init__(self):
+        """Constructor"""
+        self.buffer = bytearray()
+
+    def feed(self, data) -> list:
+        """
+        Buffers received bytes, and splits off the complete frames
+        Args:
+            data: bytes-like data received
+
+        Returns: List of the payloads of the complete frames, as bytes
+
+        """
+        self.buffer += data
+        frames = []
+        start = 0
+        while len(self.buffer) - start >= HEADER.size:
+            length = HEADER.unpack_from(self.buffer, start)[0]
+            if length > MAX_FRAME_SZ:
+                raise FrameError('Frame of {} bytes exceeds the maximum of {}'.format(length, MAX_FRAME_SZ))
+            end = start + HEADER.size + length
+            if end > len(self.buffer):
+                break
+            frames.append(bytes(self.buffer[start + HEADER.size:end]))
+            start = end
+        del self.buffer[:start]
+        return frames
+
+    def pending(self) -> bool:
+        """Tells whether part of a frame is buffered"""
+        return len(self.buffer) > 0
+
+
+class LossySocket(object):
+    """
+    Wraps a UDP socket and drops a share of the datagrams it sends, to test delivery over a lossy network. Everything
+    else is passed through to the socket
+    """
+
+    def __init__(self, sock, loss_rate, seed=None):
+        """
+        Constructor
+        Args:
+            sock: UDP socket
+            loss_rate: Share of the datagrams dropped, from 0 to 1
+            seed: Seed of the random drops, to make a test repeatable
+        """
+        self.sock = sock
+        self.loss_rate = loss_rate
+        self.random = random.Random(seed)
+        self.dropped = 0        #Number of datagrams dropped so far
+
+    def sendto(self, data, address) -> int:
+        """
+        Sends a datagram, unless it is dropped
+        Args:
+            data: bytes-like datagram
+            address: Address of the receiver
+
+        Returns: Number of bytes sent, or pretended to be
+        """
+        if self.random.random() < self.loss_rate:
+            self.dropped += 1
+            return len(data)
+        return self.sock.sendto(data, address)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    """
+    Reads one frame from an asyncio stream
+    Args:
+        reader: asyncio StreamReader
+
+    Returns: Payload as bytes, or None if the connection was closed between frames
+
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as excpt:
+        if len(excpt.partial) == 0:
+            return None
+        raise FrameError('Connection closed in the middle of a frame')
+    length = HEADER.unpack(header)[0]
+    if length > MAX_FRAME_SZ:
+        raise FrameError('Frame of {} bytes exceeds the maximum of {}'.format(length, MAX_FRAME_SZ))
+    try:
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise FrameError('Connection closed in the middle of a frame')
+
+
+def write_frame(writer: asyncio.StreamWriter, payload) -> None:
+    """
+    Queues one frame on an asyncio stream. The caller should await writer.drain() for flow control
+    Args:
+        writer: asyncio StreamWriter
+        payload: bytes-like payload
+
+    Returns: None
+
+    """
+    writer.write(encode_frame(payload))
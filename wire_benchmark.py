@@ -0,0 +1,159 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Aacer Daken and Arielle Wilson
+:Filename: wire_benchmark.py
+:Version: 1.0
+Description: Benchmark of the wire codecs. For every hop a news item takes (reporter -> host -> publisher ->
+subscriber), compares the bytes per item and the encode/decode cost of the original path (hand-built XML strings in
+pickled tuples, parsed with ElementTree) with the binary codec, and with both codecs compressed with their preset
+dictionary. The headlines are those of the reporter test driver, which the dictionary isn't built from, so the
+compressed sizes are those of headlines it hasn't seen.
+
+Usage:
+    python3 wire_benchmark.py [<number of items>]
+"""
+import pickle
+import random
+import sys
+import timeit
+import xml.etree.ElementTree
+
+import reporter_test_automation
+import wire_codec
+
+ITEMS = 10000
+
+
+def make_items(count) -> list:
+    """
+    Builds random news items, like the reporter test driver does. None of the headlines is a sample of the preset
+    dictionaries
+    Args:
+        count: Number of items
+
+    Returns: List of NewsItems
+
+    """
+    rnd = random.Random(5520)
+    return [wire_codec.NewsItem(rnd.choice(reporter_test_automation.SOURCES),
+                                rnd.choice(reporter_test_automation.EVENTS) + ' in ' +
+                                rnd.choice(reporter_test_automation.PLACES))
+            for i in range(count)]
+
+
+class XmlHelper(object):
+    """Helper class to create XML strings, the way the reporter did before the wire codecs"""
+    def __init__(self):
+        self.xml_string = '<news>'  #init the XML string
+
+    def add_data(self, tag, data) -> None:
+        """
+        Adds data to XML string
+        :param
+        tag: XML tag for the data to be added
+            data: data to be added to XML string
+
+        Returns:None
+
+        """
+        #Append new information to XML string
+        self.xml_string = self.xml_string + '<{}>{}</{}>'.format(tag, data, tag)
+
+    def get_xml(self) -> str:
+        """
+        Finalize XML file and returns string representation
+        Returns: String representation of XML file
+
+        """
+        return self.xml_string + '</news>'
+
+
+def legacy_xml(item) -> str:
+    """Builds the XML string of an item with XmlHelper"""
+    xml_file = XmlHelper()
+    xml_file.add_data(wire_codec.SOURCE_TAG, item.source)
+    xml_file.add_data(wire_codec.HEADLINE_TAG, item.headline)
+    return xml_file.get_xml()
+
+
+def legacy_parse(xml_str) -> tuple:
+    """Parses an XML string the way NewsHost.dispatch_rpc did, with one parse per field"""
+    source = xml.etree.ElementTree.fromstring(xml_str).find('source').text
+    headline = xml.etree.ElementTree.fromstring(xml_str).find('headline').text
+    return source, headline
+
+
+def measure(name, items, encode, decode) -> None:
+    """
+    Measures and prints the bytes per item and the encode/decode cost per item of a hop
+    Args:
+        name: Name of the hop and codec
+        items: News items
+        encode: Function encoding an item into a message
+        decode: Function decoding a message
+
+    Returns: None
+
+    """
+    messages = [encode(item) for item in items]
+    size = sum(len(message) for message in messages) / len(messages)
+    encode_time = timeit.timeit(lambda: [encode(item) for item in items], number=1) / len(items)
+    decode_time = timeit.timeit(lambda: [decode(message) for message in messages], number=1) / len(items)
+    print('{:<40} {:>8.1f} {:>12.2f} {:>12.2f}'.format(name, size, encode_time * 1e6, decode_time * 1e6))
+
+
+def run(count) -> None:
+    """
+    Runs the benchmark
+    Args:
+        count: Number of items per measurement
+
+    Returns: None
+
+    """
+    items = make_items(count)
+    binary = wire_codec.get_codec(wire_codec.BINARY)
+    compressed = [wire_codec.get_codec(name) for name in (wire_codec.BINARY_ZLIB, wire_codec.PICKLE_ZLIB)]
+
+    print('{:<40} {:>8} {:>12} {:>12}'.format('hop / codec', 'bytes', 'encode (us)', 'decode (us)'))
+
+    #Reporter -> host: add_post
+    measure('reporter->host   pickle+xml', items,
+            lambda item: pickle.dumps(('add_post', legacy_xml(item))),
+            lambda message: legacy_parse(pickle.loads(message)[1]))
+    measure('reporter->host   binary', items,
+            lambda item: binary.encode(('add_post', item)),
+            lambda message: wire_codec.decode_any(message)[1][1])
+    for codec in compressed:
+        measure('reporter->host   ' + codec.name, items,
+                lambda item: codec.encode(('add_post', codec.wire_item(item))),
+                lambda message: wire_codec.as_news_item(wire_codec.decode_any(message)[1][1]))
+
+    #Host -> publisher: publish (the host rebuilt the XML string from the database columns)
+    measure('host->publisher  pickle+xml', items,
+            lambda item: pickle.dumps(('publish', wire_codec.to_xml(item))),
+            lambda message: pickle.loads(message)[1])
+    measure('host->publisher  binary', items,
+            lambda item: binary.encode(('publish', item)),
+            lambda message: wire_codec.decode_any(message)[1][1])
+    for codec in compressed:
+        measure('host->publisher  ' + codec.name, items,
+                lambda item: codec.encode(('publish', codec.wire_item(item))),
+                lambda message: wire_codec.decode_any(message)[1][1])
+
+    #Publisher -> subscriber: publish datagram, parsed by the subscriber
+    measure('publisher->sub   pickle+xml', items,
+            lambda item: pickle.dumps(('publish', wire_codec.to_xml(item))),
+            lambda message: wire_codec.from_xml(pickle.loads(message)[1]))
+    measure('publisher->sub   binary', items,
+            lambda item: binary.encode(('publish', item)),
+            lambda message: wire_codec.decode_any(message)[1][1])
+    for codec in compressed:
+        measure('publisher->sub   ' + codec.name, items,
+                lambda item: codec.encode(('publish', codec.wire_item(item))),
+                lambda message: wire_codec.as_news_item(wire_codec.decode_any(message)[1][1]))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else ITEMS)
@@ -0,0 +1,665 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Author: Aacer Daken and Arielle Wilson
+:Filename: wire_codec.py
+:Version: 1.0
+
+Description: Codecs for the messages exchanged by the RSS Feed components, carried in the frames of transport.py.
+
+Two codecs are available:
+    binary: Compact tagged binary encoding. News items are a struct-packed header holding the field lengths, followed
+            by the UTF-8 source and headline. Only plain values (None, bool, int, float, str, bytes, tuple, list,
+            dict and NewsItem) can be decoded, so untrusted input can't build arbitrary objects
+    pickle: Compatibility mode, the original pickled tuples with news items as XML strings. Decoding is restricted to
+            plain values as well
+
+Each is also available compressed (binary+zlib, pickle+zlib): every message is deflated on its own, with a preset
+dictionary built from sample messages, holding the method names, the framing and XML tags, the news sources and the
+common headline words. Headlines are short, so they hardly compress alone, but most of their bytes are found in the
+dictionary. A compressed codec is only used when both ends offer it. Every compressed message carries the ID of the
+dictionary it was compressed with, so a message from a build with another dictionary is rejected, never misread.
+
+The counters of a compressed codec are kept per hop (reporter->host, host->publisher, publisher->subscriber): each
+component looks its codecs up with the hop they are used on, and compression_stats reports them by hop.
+
+Every binary message starts with BINARY_MARK, and every compressed message with the mark of its codec, which are never
+the first byte of a pickle, so a receiver can decode a message without knowing the codec in advance (decode_any). Over
+TCP, the codec used for replies is negotiated at connect time: the client sends a hello frame listing the codecs it
+accepts, in order of preference, and the server answers with a hello frame naming the codec it picked. A client that
+sends no hello gets the compatibility codec.
+"""
+import collections
+import copy
+import io
+import pickle
+import re
+import struct
+import time
+import xml.etree.ElementTree
+import zlib
+from xml.sax.saxutils import escape
+
+import transport
+
+BINARY = 'binary'               #Name of the binary codec
+PICKLE = 'pickle'               #Name of the compatibility codec (pickle + XML)
+DEFAULT_CODECS = (BINARY, PICKLE)   #Codecs offered by default, in order of preference
+HELLO_MAGIC = b'RSSW'           #Start of a hello frame
+BINARY_MARK = 0xB1              #First byte of every binary message
+ROOT_TAG = 'news'               #XML tag for the root of a news item
+SOURCE_TAG = 'source'           #XML tag for the news source
+HEADLINE_TAG = 'headline'       #XML tag for the news headline
+ZLIB_SUFFIX = '+zlib'           #Suffix of the name of a compressed codec
+BINARY_ZLIB = BINARY + ZLIB_SUFFIX  #Name of the compressed binary codec
+PICKLE_ZLIB = PICKLE + ZLIB_SUFFIX  #Name of the compressed compatibility codec
+ZLIB_MARKS = {BINARY: 0xB2, PICKLE: 0xB3}   #First byte of every compressed message, by wrapped codec
+ZLIB_LEVEL = 6                  #Deflate compression level
+ZLIB_WBITS = 12                 #Deflate window of 4 KB, enough for a dictionary and a datagram
+ZLIB_MEM_LEVEL = 4              #Deflate hash table size, small tables make a primed compressor cheap to copy
+ZDICT_SZ = 3 * 1024             #Max bytes of a preset dictionary, leaving room in the window for the message
+COMPRESS_MIN = 16               #Messages shorter than this many bytes aren't worth compressing
+REPORTER_HOP = 'reporter->host'             #Hop of the requests of reporters, and the replies of the host
+PUBLISHER_HOP = 'host->publisher'           #Hop of the publish requests of the host, and the replies of the publisher
+SUBSCRIBER_HOP = 'publisher->subscriber'    #Hop of the publications, and the requests of subscribers
+CORPUS_METHODS = ('add_post', 'publish', 'publish_batch', 'register', 'heartbeat', 'nack', 'stats')
+CORPUS_SOURCES = ('CNN', 'BBC', 'FOX', 'EuroNews', 'SkyNews', 'AlJazeera', 'Reuters', 'France24', 'DW',
+                  'AssociatedPress', 'Bloomberg', 'The Guardian', 'NPR', 'AP')
+#Common headline phrases. Kept apart from the headlines of the test drivers, so benchmarks measure held-out headlines
+CORPUS_HEADLINES = ('President says government will', 'Police investigate after', 'Prime Minister announces new',
+                    'Breaking news: storm hits', 'Stocks fall as markets react to', 'World leaders meet over',
+                    'Election results expected', 'killed and injured in attack', 'protests continue across the country',
+                    'court rules on', 'report finds', 'first time in years', 'United States', 'United Kingdom',
+                    'European Union', 'China', 'Russia', 'Ukraine', 'India', 'Brazil', 'climate change', 'economy',
+                    'health', 'officials said on Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'weekend')
+
+NewsItem = collections.namedtuple('NewsItem', ['source', 'headline'])
+
+_INT32 = struct.Struct('!i')
+_INT64 = struct.Struct('!q')
+_FLOAT = struct.Struct('!d')
+_LEN8 = struct.Struct('!B')
+_LEN32 = struct.Struct('!I')
+_ITEM_HEADER = struct.Struct('!HH')     #Byte lengths of the source and headline of a news item
+_LONG_ITEM_HEADER = struct.Struct('!II')    #Byte lengths of the source and headline of a news item over 64 KB
+_DICT_ID = struct.Struct('!H')          #ID of the preset dictionary, following the mark of a compressed message
+_MAX_DEPTH = 32                         #Max nesting of tuples, lists and dicts in a decoded binary message
+_FRAGMENT = re.compile(rb'[A-Za-z][A-Za-z ]*|[^A-Za-z]+')  #Runs of words, and runs of framing, of a sample message
+_TAG_NONE, _TAG_TRUE, _TAG_FALSE = b'NTF'
+_TAG_INT32, _TAG_INT64, _TAG_FLOAT = b'iqd'
+_TAG_SHORT_STR, _TAG_STR, _TAG_BYTES = b'sSb'
+_TAG_ITEM, _TAG_TUPLE, _TAG_LIST, _TAG_DICT = b'ntlm'
+_TAG_LONG_ITEM = b'I'[0]
+
+
+def to_xml(item: NewsItem) -> str:
+    """
+    Formats a news item as an XML string
+    Args:
+        item: News item
+
+    Returns: XML string of the news item
+
+    """
+    return '<{0}><{1}>{2}</{1}><{3}>{4}</{3}></{0}>'.format(ROOT_TAG, SOURCE_TAG, escape(item.source),
+                                                            HEADLINE_TAG, escape(item.headline))
+
+
+def from_xml(xml_str) -> NewsItem:
+    """
+    Parses an XML string holding a news item, with a single ElementTree parse
+    Args:
+        xml_str: XML str or bytes
+
+    Returns: News item
+
+    """
+    root = xml.etree.ElementTree.fromstring(xml_str)
+    return NewsItem(root.findtext(SOURCE_TAG), root.findtext(HEADLINE_TAG))
+
+
+def as_news_item(value) -> NewsItem:
+    """
+    Returns a received news item as a NewsItem, whichever codec it was received with
+    Args:
+        value: NewsItem, or XML str/bytes
+
+    Returns: News item
+
+    """
+    if isinstance(value, NewsItem):
+        return value
+    if isinstance(value, tuple):
+        return NewsItem(*value)
+    return from_xml(value)
+
+
+class BinaryCodec(object):
+    """
+    Compact tagged binary codec
+    """
+
+    name = BINARY
+
+    def encode(self, value) -> bytes:
+        """
+        Encodes a message
+        Args:
+            value: Message made of plain values and news items
+
+        Returns: Encoded message
+
+        """
+        parts = [bytes((BINARY_MARK,))]
+        self._encode_value(value, parts)
+        return b''.join(parts)
+
+    def decode(self, data):
+        """
+        Decodes a message
+        Args:
+            data: bytes-like encoded message
+
+        Returns: Message
+
+        """
+        data = bytes(data)
+        if len(data) == 0 or data[0] != BINARY_MARK:
+            raise ValueError('Not a binary message')
+        value, offset = self._decode_value(data, 1, 0)
+        if offset != len(data):
+            raise ValueError('Trailing bytes after binary message')
+        return value
+
+    def wire_item(self, item: NewsItem):
+        """
+        Returns: The news item as carried in messages of this codec
+        """
+        return item
+
+    def _encode_value(self, value, parts: list) -> None:
+        """
+        Appends the encoding of a value to a list of byte strings
+        Args:
+            value: Value to be encoded
+            parts: List the encoding is appended to
+
+        Returns: None
+
+        """
+        value_type = type(value)
+        if value_type is str:
+            encoded = value.encode('utf-8')
+            if len(encoded) < 256:
+                parts.append(b's' + _LEN8.pack(len(encoded)))
+            else:
+                parts.append(b'S' + _LEN32.pack(len(encoded)))
+            parts.append(encoded)
+        elif value_type is NewsItem:
+            source = value.source.encode('utf-8')
+            headline = value.headline.encode('utf-8')
+            if len(source) < 65536 and len(headline) < 65536:
+                parts.append(b'n' + _ITEM_HEADER.pack(len(source), len(headline)))
+            else:
+                parts.append(b'I' + _LONG_ITEM_HEADER.pack(len(source), len(headline)))
+            parts.append(source)
+            parts.append(headline)
+        elif value_type is tuple or value_type is list:
+            parts.append((b't' if value_type is tuple else b'l') + _LEN32.pack(len(value)))
+            for element in value:
+                self._encode_value(element, parts)
+        elif value is None:
+            parts.append(b'N')
+        elif value is True:
+            parts.append(b'T')
+        elif value is False:
+            parts.append(b'F')
+        elif isinstance(value, int):
+            if -2 ** 31 <= value < 2 ** 31:
+                parts.append(b'i' + _INT32.pack(value))
+            else:
+                parts.append(b'q' + _INT64.pack(value))
+        elif isinstance(value, float):
+            parts.append(b'd' + _FLOAT.pack(value))
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            parts.append(b'b' + _LEN32.pack(len(value)))
+            parts.append(bytes(value))
+        elif isinstance(value, dict):
+            parts.append(b'm' + _LEN32.pack(len(value)))
+            for key, element in value.items():
+                self._encode_value(key, parts)
+                self._encode_value(element, parts)
+        elif isinstance(value, (set, frozenset)):
+            self._encode_value(sorted(value), parts)
+        elif isinstance(value, str):
+            self._encode_value(str(value), parts)
+        elif isinstance(value, (tuple, list)):
+            self._encode_value(tuple(value) if isinstance(value, tuple) else list(value), parts)
+        else:
+            raise TypeError('Can\'t encode value of type {}'.format(type(value).__name__))
+
+    def _decode_value(self, data: bytes, offset: int, depth: int) -> tuple:
+        """
+        Decodes the value starting at offset
+        Args:
+            data: Encoded message
+            offset: Offset of the value
+            depth: Number of containers the value is nested in, at most _MAX_DEPTH
+
+        Returns: (value, offset after the value) tuple
+
+        """
+        tag = data[offset]
+        offset += 1
+        if (tag == _TAG_TUPLE or tag == _TAG_LIST or tag == _TAG_DICT) and depth >= _MAX_DEPTH:
+            raise ValueError('Binary message nested deeper than {} levels'.format(_MAX_DEPTH))
+        if tag == _TAG_TUPLE or tag == _TAG_LIST:
+            count = _LEN32.unpack_from(data, offset)[0]
+            offset += _LEN32.size
+            elements = []
+            for i in range(count):
+                element, offset = self._decode_value(data, offset, depth + 1)
+                elements.append(element)
+            return (tuple(elements) if tag == _TAG_TUPLE else elements), offset
+        if tag == _TAG_SHORT_STR:
+            end = offset + 1 + data[offset]
+            return self._slice(data, offset + 1, end).decode('utf-8'), end
+        if tag == _TAG_ITEM or tag == _TAG_LONG_ITEM:
+            header = _ITEM_HEADER if tag == _TAG_ITEM else _LONG_ITEM_HEADER
+            source_len, headline_len = header.unpack_from(data, offset)
+            offset += header.size
+            end = offset + source_len + headline_len
+            item = self._slice(data, offset, end)
+            return NewsItem(item[:source_len].decode('utf-8'), item[source_len:].decode('utf-8')), end
+        if tag == _TAG_INT32:
+            return _INT32.unpack_from(data, offset)[0], offset + _INT32.size
+        if tag == _TAG_NONE:
+            return None, offset
+        if tag == _TAG_TRUE:
+            return True, offset
+        if tag == _TAG_FALSE:
+            return False, offset
+        if tag == _TAG_INT64:
+            return _INT64.unpack_from(data, offset)[0], offset + _INT64.size
+        if tag == _TAG_FLOAT:
+            return _FLOAT.unpack_from(data, offset)[0], offset + _FLOAT.size
+        if tag == _TAG_STR or tag == _TAG_BYTES:
+            end = offset + _LEN32.size + _LEN32.unpack_from(data, offset)[0]
+            raw = self._slice(data, offset + _LEN32.size, end)
+            return (raw if tag == _TAG_BYTES else raw.decode('utf-8')), end
+        if tag == _TAG_DICT:
+            count = _LEN32.unpack_from(data, offset)[0]
+            offset += _LEN32.size
+            mapping = {}
+            for i in range(count):
+                key, offset = self._decode_value(data, offset, depth + 1)
+                mapping[key], offset = self._decode_value(data, offset, depth + 1)
+            return mapping, offset
+        raise ValueError('Unknown tag {} in binary message'.format(tag))
+
+    @staticmethod
+    def _slice(data: bytes, start: int, end: int) -> bytes:
+        """
+        Returns: data[start:end], checking the bytes are all there
+        """
+        if end > len(data):
+            raise ValueError('Truncated binary message')
+        return data[start:end]
+
+
+class PickleCodec(object):
+    """
+    Compatibility codec: pickled messages, with news items as XML strings
+    """
+
+    name = PICKLE
+
+    def encode(self, value) -> bytes:
+        """
+        Encodes a message
+        Args:
+            value: Message made of plain values
+
+        Returns: Encoded message
+
+        """
+        return pickle.dumps(value)
+
+    def decode(self, data):
+        """
+        Decodes a message, refusing anything but plain values
+        Args:
+            data: bytes-like encoded message
+
+        Returns: Message
+
+        """
+        return self.RestrictedUnpickler(io.BytesIO(data)).load()
+
+    def wire_item(self, item: NewsItem):
+        """
+        Returns: The news item as carried in messages of this codec
+        """
+        return to_xml(item)
+
+    class RestrictedUnpickler(pickle.Unpickler):
+        """Unpickler that can't load any class or function, so only plain values can be decoded"""
+
+        def find_class(self, module, name):
+            raise pickle.UnpicklingError('Refusing to load {}.{} from the network'.format(module, name))
+
+
+def build_zdict(samples, size = ZDICT_SZ) -> bytes:
+    """
+    Builds a preset dictionary for deflate from sample messages. The samples are split in runs of words and runs of
+    framing bytes, and the runs saving the most bytes over all samples are put last, where deflate reaches them with
+    the shortest distances. The dictionary is cut to size from the front
+    Args:
+        samples: Encoded sample messages, as bytes
+        size: Max bytes of the dictionary
+
+    Returns: Dictionary as bytes
+
+    """
+    counts = collections.Counter()
+    for sample in samples:
+        counts.update(_FRAGMENT.findall(sample))
+    ordered = sorted(counts, key=lambda fragment: (counts[fragment] * len(fragment), fragment))
+    return b''.join(ordered)[-size:]
+
+
+def sample_messages(codec) -> list:
+    """
+    Encodes the sample messages of a codec a preset dictionary is built from: every method, with news items
+    combining the sample sources and headlines, alone and in batches, plus the bare news items and their XML strings
+    Args:
+        codec: Codec the samples are encoded with
+
+    Returns: List of encoded messages
+
+    """
+    items = [NewsItem(CORPUS_SOURCES[i % len(CORPUS_SOURCES)], headline)
+             for i, headline in enumerate(CORPUS_HEADLINES)]
+    samples = []
+    for i, item in enumerate(items):
+        wire_item = codec.wire_item(item)
+        samples.append(codec.encode(wire_item))
+        for method in CORPUS_METHODS:
+            samples.append(codec.encode((method, wire_item)))
+        samples.append(codec.encode(('publish', wire_item, i + 1, i, 1 << 40)))
+        samples.append(codec.encode(('publish_batch', [wire_item, codec.wire_item(items[i - 1])], i)))
+    samples.append(codec.encode(('register', {'address': ('localhost', 50420), 'codec': codec.name})))
+    return samples
+
+
+class CompressedCodec(object):
+    """
+    Wraps a codec, deflating each message with a preset dictionary (zlib zdict). Messages are compressed on their own,
+    so datagrams can be decoded in any order, by copies of a compressor and a decompressor primed with the dictionary
+    once. A compressed message starts with the mark and the dictionary ID, derived from the dictionary, and one with
+    another dictionary ID is rejected. A message that wouldn't get smaller is sent as encoded by the wrapped codec.
+    The bytes and time spent compressing and decompressing are counted for the hop the codec is used on (without a
+    lock, so concurrent calls may miss a count)
+    """
+
+    def __init__(self, inner, mark, zdict, level = ZLIB_LEVEL):
+        """
+        Constructor
+        Args:
+            inner: Wrapped codec
+            mark: First byte of every compressed message, different from that of any other codec
+            zdict: Preset dictionary, the same on both ends
+            level: Deflate compression level
+        """
+        self.inner = inner
+        self.name = inner.name + ZLIB_SUFFIX
+        self.mark = mark
+        self.zdict = zdict
+        self.dict_id = zlib.crc32(zdict) & 0xFFFF
+        self._header = bytes((mark,)) + _DICT_ID.pack(self.dict_id)
+        self.hop = None             #Hop the counters are kept for, None for uses on no hop in particular
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -ZLIB_WBITS, ZLIB_MEM_LEVEL,
+                                            zlib.Z_DEFAULT_STRATEGY, zdict)
+        self._decompressor = zlib.decompressobj(-ZLIB_WBITS, zdict)
+        self.encoded_count = 0      #Messages encoded
+        self.raw_bytes = 0          #Bytes of the messages encoded, before compression
+        self.wire_bytes = 0         #Bytes of the messages encoded, after compression
+        self.compress_time = 0.0    #Seconds spent compressing
+        self.decoded_count = 0      #Compressed messages decoded
+        self.decompress_time = 0.0  #Seconds spent decompressing
+
+    def encode(self, value) -> bytes:
+        """
+        Encodes a message with the wrapped codec, and compresses it
+        Args:
+            value: Message
+
+        Returns: Compressed message, or the message as encoded by the wrapped codec if it doesn't get smaller
+
+        """
+        raw = self.inner.encode(value)
+        message = raw
+        start = time.perf_counter()
+        if len(raw) >= COMPRESS_MIN:
+            compressor = self._compressor.copy()
+            compressed = compressor.compress(raw) + compressor.flush()
+            if len(compressed) + len(self._header) < len(raw):
+                message = self._header + compressed
+        self.compress_time += time.perf_counter() - start
+        self.encoded_count += 1
+        self.raw_bytes += len(raw)
+        self.wire_bytes += len(message)
+        return message
+
+    def decode(self, data):
+        """
+        Decompresses and decodes a message
+        Args:
+            data: bytes-like compressed message, or message encoded by the wrapped codec
+
+        Returns: Message
+
+        """
+        if len(data) == 0 or data[0] != self.mark:
+            return self.inner.decode(data)
+        if len(data) < len(self._header) or _DICT_ID.unpack_from(data, 1)[0] != self.dict_id:
+            raise ValueError('Compressed message of another preset dictionary')
+        start = time.perf_counter()
+        decompressor = self._decompressor.copy()
+        try:
+            raw = decompressor.decompress(memoryview(data)[len(self._header):], transport.MAX_FRAME_SZ)
+        except zlib.error as excpt:
+            raise ValueError('Corrupt compressed message: {}'.format(excpt))
+        if not decompressor.eof or len(decompressor.unconsumed_tail) > 0 or len(decompressor.unused_data) > 0:
+            raise ValueError('Truncated or oversized compressed message')
+        self.decompress_time += time.perf_counter() - start
+        self.decoded_count += 1
+        return self.inner.decode(raw)
+
+    def wire_item(self, item: NewsItem):
+        """
+        Returns: The news item as carried in messages of the wrapped codec
+        """
+        return self.inner.wire_item(item)
+
+    def on_hop(self, hop):
+        """
+        Args:
+            hop: Name of the hop, e.g. REPORTER_HOP
+
+        Returns: Copy of the codec sharing its primed compressor and decompressor, with its own counters for the hop
+
+        """
+        codec = copy.copy(self)
+        codec.hop = hop
+        codec.encoded_count = codec.raw_bytes = codec.wire_bytes = codec.decoded_count = 0
+        codec.compress_time = codec.decompress_time = 0.0
+        return codec
+
+    def stats(self) -> dict:
+        """
+        Returns: Dictionary of the messages encoded, their bytes before and after compression, the milliseconds spent
+        compressing, the compressed messages decoded, and the milliseconds spent decompressing
+        """
+        return {'encoded': self.encoded_count,
+                'raw_bytes': self.raw_bytes,
+                'wire_bytes': self.wire_bytes,
+                'compress_ms': round(self.compress_time * 1000, 3),
+                'decoded': self.decoded_count,
+                'decompress_ms': round(self.decompress_time * 1000, 3)}
+
+
+CODECS = {BINARY: BinaryCodec(), PICKLE: PickleCodec()}
+for _name, _mark in ZLIB_MARKS.items():
+    _codec = CompressedCodec(CODECS[_name], _mark, build_zdict(sample_messages(CODECS[_name])))
+    CODECS[_codec.name] = _codec
+COMPRESSED_CODECS = {codec.mark: codec for codec in CODECS.values() if isinstance(codec, CompressedCodec)}
+_HOP_CODECS = {}    #Compressed codecs by (name, hop), each counting the messages of its hop
+
+
+def get_codec(name, hop = None):
+    """
+    Args:
+        name: Codec name
+        hop: Name of the hop the codec is used on, to count its messages for, or None
+
+    Returns: The codec object
+
+    """
+    if name not in CODECS:
+        raise ValueError('Unknown codec {}'.format(name))
+    return on_hop(CODECS[name], hop)
+
+
+def on_hop(codec, hop):
+    """
+    Args:
+        codec: Codec object
+        hop: Name of the hop the codec is used on, or None
+
+    Returns: The codec counting its messages for the hop, the same object on every call. Uncompressed codecs keep no
+    counters, and are returned as they are
+
+    """
+    if hop is None or not isinstance(codec, CompressedCodec):
+        return codec
+    key = (codec.name, hop)
+    if key not in _HOP_CODECS:
+        _HOP_CODECS.setdefault(key, codec.on_hop(hop))
+    return _HOP_CODECS[key]
+
+
+def decode_any(data, hop = None) -> tuple:
+    """
+    Decodes a message of either codec
+    Args:
+        data: bytes-like encoded message
+        hop: Name of the hop the message came on, or None
+
+    Returns: (codec, message) tuple
+
+    """
+    if len(data) > 0 and data[0] == BINARY_MARK:
+        codec = CODECS[BINARY]
+    elif len(data) > 0 and data[0] in COMPRESSED_CODECS:
+        codec = on_hop(COMPRESSED_CODECS[data[0]], hop)
+    else:
+        codec = CODECS[PICKLE]
+    try:
+        return codec, codec.decode(data)
+    except (ValueError, TypeError, IndexError, struct.error, EOFError, pickle.UnpicklingError,
+            RecursionError) as excpt:
+        raise ValueError('Malformed {} message: {}'.format(codec.name, excpt))
+
+
+def compression_stats() -> dict:
+    """
+    Returns: Dictionary of the counters of the compressed codecs used so far in this process, by hop, then by codec
+    name. Uses on no hop in particular are reported under None
+    """
+    stats = {}
+    for codec in list(COMPRESSED_CODECS.values()) + list(_HOP_CODECS.values()):
+        if codec.encoded_count + codec.decoded_count > 0:
+            stats.setdefault(codec.hop, {})[codec.name] = codec.stats()
+    return stats
+
+
+def encode_hello(codec_names) -> bytes:
+    """
+    Args:
+        codec_names: Names of the codecs offered/picked, in order of preference
+
+    Returns: Hello frame payload
+
+    """
+    return HELLO_MAGIC + ','.join(codec_names).encode('ascii')
+
+
+def is_hello(data) -> bool:
+    """
+    Returns: True if the frame payload is a hello frame
+    """
+    return bytes(data[:len(HELLO_MAGIC)]) == HELLO_MAGIC
+
+
+def decode_hello(data) -> list:
+    """
+    Returns: Names of the codecs listed in a hello frame
+    """
+    return [name for name in bytes(data[len(HELLO_MAGIC):]).decode('ascii').split(',') if name]
+
+
+def choose_codec(offered, hop = None):
+    """
+    Picks the first offered codec that is supported
+    Args:
+        offered: Names of the codecs offered by the client, in order of preference
+        hop: Name of the hop the codec is used on, or None
+
+    Returns: The codec object, the compatibility codec if none is supported
+
+    """
+    for name in offered:
+        if name in CODECS:
+            return get_codec(name, hop)
+    return CODECS[PICKLE]
+
+
+def client_hello(sock, reader, codec_names = DEFAULT_CODECS, hop = None):
+    """
+    Negotiates the codec on a new client connection
+    Args:
+        sock: Connected TCP socket
+        reader: transport.FrameReader of the socket
+        codec_names: Names of the codecs accepted, in order of preference. Offering only the compatibility codec
+                     skips the negotiation, like a legacy client
+        hop: Name of the hop of the connection, or None
+
+    Returns: Codec picked by the server
+
+    """
+    if list(codec_names) == [PICKLE]:
+        return CODECS[PICKLE]
+    transport.send_frame(sock, encode_hello(codec_names))
+    reply = reader.recv_frame()
+    if reply is None or not is_hello(reply):
+        raise transport.FrameError('Codec negotiation failed')
+    return choose_codec(decode_hello(reply), hop)
+
+
+def server_hello(sock, frame, hop = None):
+    """
+    Answers the codec negotiation of a client, if the first frame of a connection is a hello frame
+    Args:
+        sock: Connected TCP socket
+        frame: First frame received on the connection
+        hop: Name of the hop of the connection, or None
+
+    Returns: Codec picked, or None if the frame isn't a hello frame, i.e. the client uses the compatibility codec
+
+    """
+    if not is_hello(frame):
+        return None
+    codec = choose_codec(decode_hello(frame), hop)
+    transport.send_frame(sock, encode_hello([codec.name]))
+    return codec